@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Pure-NumPy ANN indexes used when faiss is not installed (build_index.py --index-type numpy-*).
+
+- NumpyFlatIndex: exact inner-product search over L2-normalized vectors (blocked, multi-threaded)
+- NumpyIVFIndex:  IVF-Flat (spherical k-means coarse quantizer + contiguous inverted lists)
+- NumpyF16Index:  brute force over float16 vectors (half the memory)
+- NumpyInt8Index: brute force over per-dimension scalar-quantized uint8 codes (a quarter)
+
+All are stored as a directory of .npy files so they can be opened with mmap_mode='r'.
+Queries are normalized internally; scores are cosine similarities, missing slots are -1.
+
+Brute-force scans go through `blocked_search()`, the Python counterpart of the std::thread
+chunking in app/src/main/cpp/native_search.cpp. Stored vectors are normalized once at build
+time. The corpus is split into cache-sized blocks, contiguous runs of blocks are scored on a
+thread pool (NumPy matmul releases the GIL), each block keeps only its argpartition top-k,
+and the per-thread candidates are merged at the end. Memory per query batch is therefore
+O(threads * block) rather than O(n).
+
+Every `search()` takes an optional `subset`: sorted row ids (a facet filter, see facets.py)
+that are the only rows considered. The brute-force indexes then score just those rows. IVF
+probes `filtered_depth()` lists under a filter, nprobe scaled by 1/selectivity so the probed
+lists still hold about as many allowed rows as an unfiltered probe scores, and only those rows
+are scored. Once the subset has no more rows than those lists, it is scanned exactly instead.
+The choice is by absolute cost, so a narrow filter gets cheaper and never loses recall.
+
+The quantized indexes optionally re-score their top `k * rescore` candidates against the
+float32 source rows (embeddings.npy, memory-mapped), which recovers nearly all of the
+quantization recall loss while only touching a few full-precision rows per query.
+"""
+import abc
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+# rows per scored block: ~4 MB of float32 vectors (2730 rows at dim 384), sized to stay in L3;
+# smaller blocks pay more per-block argpartition overhead, larger ones stop helping
+BLOCK_BYTES = 4 << 20
+MIN_BLOCK_ROWS = 256
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+
+def normalize(x) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 1:
+        x = x[None, :]
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def topk(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row-wise top-k of a [nq, n] score matrix, best first; pads with -1 when n < k."""
+    nq, n = scores.shape
+    kk = min(k, n)
+    out_s = np.full((nq, k), -np.inf, dtype=np.float32)
+    out_i = np.full((nq, k), -1, dtype=np.int64)
+    if kk == 0:
+        return out_s, out_i
+    part = np.argpartition(-scores, kk - 1, axis=1)[:, :kk] if kk < n else np.tile(np.arange(n), (nq, 1))
+    ps = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-ps, axis=1, kind='stable')
+    out_i[:, :kk] = np.take_along_axis(part, order, axis=1)
+    out_s[:, :kk] = np.take_along_axis(ps, order, axis=1)
+    return out_s, out_i
+
+
+def default_threads() -> int:
+    return int(os.environ.get('SEARCH_THREADS', 0)) or os.cpu_count() or 1
+
+
+def filtered_depth(depth: int, selected: int, n: int, cap: int) -> int:
+    """Probe depth (nprobe / efSearch) for a filter keeping `selected` of `n` rows.
+
+    Scaled by 1/selectivity: with a mask, an unscaled probe reaches only a handful of allowed rows
+    on narrow filters (1% kept 0.38 of the filtered top-10 at nprobe 8). Capped at `cap`.
+    """
+    return max(1, min(cap, -(-depth * n // max(1, selected))))
+
+
+def _executor(threads: int) -> ThreadPoolExecutor:
+    global _pool, _pool_size
+    # concurrent searches (service threads) must not each replace the pool while growing it
+    with _pool_lock:
+        if _pool is None or _pool_size < threads:
+            # grown, never shrunk; the old pool's idle threads exit when it is collected
+            _pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='ann-scan')
+            _pool_size = threads
+        return _pool
+
+
+def block_rows(dim: int, itemsize: int = 4) -> int:
+    return max(MIN_BLOCK_ROWS, BLOCK_BYTES // max(1, dim * itemsize))
+
+
+def _block_candidates(s: np.ndarray, k: int, start: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Unordered top-k (scores, global row ids) of one scored block."""
+    m = s.shape[1]
+    if m <= k:
+        return s, np.broadcast_to(np.arange(start, start + m), s.shape)
+    part = np.argpartition(s, m - k, axis=1)[:, m - k:]
+    return np.take_along_axis(s, part, axis=1), part + start
+
+
+def _select(s: np.ndarray, i: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    best, local = topk(s, k)
+    return best, np.where(local >= 0, np.take_along_axis(i, np.maximum(local, 0), axis=1), -1)
+
+
+def blocked_search(q: np.ndarray, n: int, k: int, score_block: Callable[[np.ndarray, int, int], np.ndarray],
+                   block: int, threads: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact top-k over rows [0, n): `score_block(q, start, stop)` returns the [nq, stop - start] scores."""
+    nq = q.shape[0]
+    if n == 0 or k == 0:
+        return topk(np.zeros((nq, 0), dtype=np.float32), k)
+    if n <= block:
+        return topk(score_block(q, 0, n), k)
+    starts = list(range(0, n, block))
+    threads = max(1, min(threads or default_threads(), len(starts)))
+
+    def scan(chunk):
+        # keep only each block's unordered top-k; one sort over the survivors at the end
+        parts = [_block_candidates(score_block(q, start, min(n, start + block)), k, start) for start in chunk]
+        return np.concatenate([p[0] for p in parts], axis=1), np.concatenate([p[1] for p in parts], axis=1)
+
+    # contiguous runs of blocks per thread, like the per-thread [start, end) ranges in native_search.cpp
+    per = -(-len(starts) // threads)
+    chunks = [starts[t:t + per] for t in range(0, len(starts), per)]
+    if len(chunks) == 1:
+        return _select(*scan(chunks[0]), k)
+    found = list(_executor(threads).map(scan, chunks))
+    return _select(np.concatenate([f[0] for f in found], axis=1), np.concatenate([f[1] for f in found], axis=1), k)
+
+
+def scan_search(q: np.ndarray, n: int, k: int, scores_of: Callable[[np.ndarray, object], np.ndarray],
+                block: int, threads: Optional[int] = None, subset=None) -> Tuple[np.ndarray, np.ndarray]:
+    """`blocked_search` over all n rows, or only over the sorted row ids in `subset`.
+
+    `scores_of(q, sel)` scores the rows selected by `sel`, a slice or an array of row ids.
+    Returned ids are always global row ids.
+    """
+    if subset is None or len(subset) >= n:
+        # contiguous slices avoid the gather when the filter keeps every row
+        return blocked_search(q, n, k, lambda q, a, b: scores_of(q, slice(a, b)), block, threads)
+    rows = np.asarray(subset, dtype=np.int64)
+    s, i = blocked_search(q, rows.size, k, lambda q, a, b: scores_of(q, rows[a:b]), block, threads)
+    return s, (np.where(i >= 0, rows[np.maximum(i, 0)], -1) if rows.size else i)
+
+
+class NumpyFlatIndex:
+    index_type = 'numpy-flat'
+    arrays = ('vecs',)
+
+    def __init__(self, vecs, threads: Optional[int] = None):
+        self.vecs = vecs  # already L2-normalized (build() / saved index)
+        self.threads = threads
+        self.block = block_rows(vecs.shape[1] if vecs.ndim == 2 else 1)
+
+    @classmethod
+    def build(cls, emb, **_):
+        return cls(normalize(emb))
+
+    @property
+    def ntotal(self) -> int:
+        return self.vecs.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return np.asarray(self.vecs).nbytes
+
+    def _scores(self, q, sel):
+        return q @ np.asarray(self.vecs[sel]).T
+
+    def search(self, q, k: int, subset=None):
+        return scan_search(normalize(q), self.ntotal, k, self._scores, self.block, self.threads, subset)
+
+
+def quantize_int8(x: np.ndarray, block: int = 65536) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Per-dimension min/max scalar quantization: x ~= codes * scale + offset, codes uint8."""
+    lo = np.min(x, axis=0).astype(np.float32)
+    hi = np.max(x, axis=0).astype(np.float32)
+    scale = np.maximum(hi - lo, 1e-12) / 255.0
+    codes = np.empty(x.shape, dtype=np.uint8)
+    for s in range(0, x.shape[0], block):
+        codes[s:s + block] = np.clip(np.rint((x[s:s + block] - lo) / scale), 0, 255)
+    return codes, scale.astype(np.float32), lo
+
+
+def dequantize_int8(codes: np.ndarray, scale: np.ndarray, offset: np.ndarray) -> np.ndarray:
+    return np.asarray(codes, dtype=np.float32) * scale + offset
+
+
+class _QuantizedIndex(abc.ABC):
+    """Blocked brute-force search over compressed rows, with optional float32 re-scoring."""
+    arrays: Tuple[str, ...] = ()
+    # small blocks keep the decoded float32 copy in cache (~1.5 MB at dim 384)
+    block = 1024
+
+    def __init__(self, rescore: int = 0, source=None, threads: Optional[int] = None):
+        self.rescore = rescore
+        self.source = source  # float32 [n, dim] rows in the same order (embeddings.npy)
+        self.threads = threads
+
+    @property
+    def nbytes(self) -> int:
+        return sum(np.asarray(getattr(self, name)).nbytes for name in self.arrays)
+
+    @abc.abstractmethod
+    def _scores(self, q: np.ndarray, sel) -> np.ndarray:
+        """[nq, len(rows)] cosine scores of normalized queries `q` against rows `sel` (slice or ids)."""
+
+    def search(self, q, k: int, subset=None):
+        q = normalize(q)
+        depth = k * self.rescore if (self.rescore and self.source is not None) else k
+        # decode one block at a time so the float32 copy never exceeds `block` rows per thread
+        s, i = scan_search(q, self.ntotal, depth, self._scores, self.block, self.threads, subset)
+        if depth == k:
+            return s, i
+        out_s = np.full((q.shape[0], k), -np.inf, dtype=np.float32)
+        out_i = np.full((q.shape[0], k), -1, dtype=np.int64)
+        for qi in range(q.shape[0]):
+            cand = i[qi][i[qi] >= 0]
+            if cand.size == 0:
+                continue
+            order = np.argsort(cand)  # sorted reads are kinder to a memory-mapped source
+            exact = normalize(np.asarray(self.source[cand[order]])) @ q[qi]
+            rs, ri = topk(exact[None, :], k)
+            valid = ri[0] >= 0
+            out_s[qi, valid] = rs[0, valid]
+            out_i[qi, valid] = cand[order][ri[0, valid]]
+        return out_s, out_i
+
+
+class NumpyF16Index(_QuantizedIndex):
+    index_type = 'numpy-f16'
+    arrays = ('vecs',)
+
+    def __init__(self, vecs, rescore: int = 0, source=None):
+        super().__init__(rescore, source)
+        self.vecs = vecs
+
+    @classmethod
+    def build(cls, emb, rescore: int = 0, **_):
+        return cls(normalize(emb).astype(np.float16), rescore, emb)
+
+    @property
+    def ntotal(self) -> int:
+        return self.vecs.shape[0]
+
+    def _scores(self, q, sel):
+        return q @ np.asarray(self.vecs[sel], dtype=np.float32).T
+
+
+class NumpyInt8Index(_QuantizedIndex):
+    index_type = 'numpy-int8'
+    arrays = ('codes', 'scale', 'offset')
+
+    def __init__(self, codes, scale, offset, rescore: int = 0, source=None):
+        super().__init__(rescore, source)
+        self.codes = codes
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+
+    @classmethod
+    def build(cls, emb, rescore: int = 0, **_):
+        codes, scale, offset = quantize_int8(normalize(emb))
+        return cls(codes, scale, offset, rescore, emb)
+
+    @property
+    def ntotal(self) -> int:
+        return self.codes.shape[0]
+
+    def _scores(self, q, sel):
+        # q . (c * scale + offset) == (q * scale) . c + q . offset
+        return (q * self.scale) @ np.asarray(self.codes[sel], dtype=np.float32).T + (q @ self.offset)[:, None]
+
+
+class NumpyIVFIndex:
+    index_type = 'numpy-ivf'
+    arrays = ('centroids', 'offsets', 'ids', 'vecs')
+
+    def __init__(self, centroids, offsets, ids, vecs, nprobe: int = 8):
+        self.centroids = centroids
+        self.offsets = offsets  # list j occupies rows offsets[j]:offsets[j+1] of vecs/ids
+        self.ids = ids
+        self.vecs = vecs
+        self.nprobe = nprobe
+        self._positions = None
+
+    @classmethod
+    def build(cls, emb, nlist: int = 64, nprobe: int = 8, iters: int = 20, seed: int = 0, **_):
+        x = normalize(emb)
+        n = x.shape[0]
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(seed)
+        cent = x[rng.choice(n, nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(x @ cent.T, axis=1)
+            sums = np.zeros_like(cent)
+            np.add.at(sums, assign, x)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            # re-seed empty clusters from random points so every list stays usable
+            sums[empty] = x[rng.choice(n, int(empty.sum()))]
+            cent = normalize(sums)
+        assign = np.argmax(x @ cent.T, axis=1)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=nlist)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(cent.astype(np.float32), offsets, order.astype(np.int64), x[order], nprobe)
+
+    @property
+    def ntotal(self) -> int:
+        return self.ids.shape[0]
+
+    def _search_subset(self, q, k: int, subset: np.ndarray):
+        if self._positions is None:
+            # row id -> position in the list-ordered vecs
+            self._positions = np.argsort(np.asarray(self.ids))
+        return scan_search(q, self.ntotal, k, lambda q, sel: q @ np.asarray(self.vecs[self._positions[sel]]).T,
+                           block_rows(self.vecs.shape[1]), subset=subset)
+
+    def _list_rows(self, lists: np.ndarray) -> np.ndarray:
+        # the rows of the given inverted lists, concatenated without a per-list Python loop
+        starts = self.offsets[lists]
+        lens = self.offsets[lists + 1] - starts
+        return np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(lens.sum())
+
+    def search(self, q, k: int, subset=None):
+        q = normalize(q)
+        nlist = self.centroids.shape[0]
+        nprobe = max(1, min(self.nprobe, nlist))
+        allowed = None
+        if subset is not None and len(subset) < self.ntotal:
+            subset = np.asarray(subset, dtype=np.int64)
+            nprobe = filtered_depth(nprobe, subset.size, self.ntotal, nlist)
+            # no more rows than the probed lists would visit: scan them exactly, no recall to lose
+            if subset.size * nlist <= self.ntotal * nprobe:
+                return self._search_subset(q, k, subset)
+            allowed = np.zeros(self.ntotal, dtype=bool)
+            allowed[subset] = True
+        probes = np.argsort(-(q @ np.asarray(self.centroids).T), axis=1)[:, :nprobe]
+        out_s = np.full((q.shape[0], k), -np.inf, dtype=np.float32)
+        out_i = np.full((q.shape[0], k), -1, dtype=np.int64)
+        for qi in range(q.shape[0]):
+            rows = self._list_rows(probes[qi])
+            if allowed is not None:
+                rows = rows[allowed[np.asarray(self.ids)[rows]]]
+            if rows.size == 0:
+                continue
+            s, local = topk((np.asarray(self.vecs[rows]) @ q[qi])[None, :], k)
+            valid = local[0] >= 0
+            out_s[qi, valid] = s[0, valid]
+            out_i[qi, valid] = np.asarray(self.ids)[rows[local[0, valid]]]
+        return out_s, out_i
+
+
+_TYPES = {c.index_type: c for c in (NumpyFlatIndex, NumpyIVFIndex, NumpyF16Index, NumpyInt8Index)}
+
+
+def save(index, path: str) -> None:
+    os.makedirs(path, exist_ok=True)
+    for name in index.arrays:
+        np.save(os.path.join(path, name + '.npy'), np.asarray(getattr(index, name)))
+    with open(os.path.join(path, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump({'index_type': index.index_type}, f)
+
+
+def load(path: str, mmap: bool = True, source=None, **search_params):
+    """Open a saved index; `source` (float32 rows, e.g. a memmap of embeddings.npy) enables re-scoring."""
+    with open(os.path.join(path, 'index.json'), 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    cls = _TYPES[info['index_type']]
+    mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mode) for name in cls.arrays}
+    if cls is NumpyIVFIndex:
+        return cls(arrays['centroids'], np.asarray(arrays['offsets']), arrays['ids'], arrays['vecs'],
+                   search_params.get('nprobe') or 8)
+    if issubclass(cls, _QuantizedIndex):
+        return cls(*(arrays[name] for name in cls.arrays), rescore=search_params.get('rescore') or 0, source=source)
+    return cls(arrays['vecs'])
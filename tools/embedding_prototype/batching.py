@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Length-bucketed, token-budget batching for SentenceTransformer.encode.
+
+Texts are sorted by token length and packed into batches whose padded size
+(len(batch) * longest member) stays under `token_budget`, so short table rows are
+encoded in large batches and long paragraphs in small ones instead of every batch
+being padded to its longest member. Results are scattered back to input order.
+
+Used by compute_embeddings.py, embed_batch_cli.py and service.py.
+"""
+from typing import List, Sequence
+
+import numpy as np
+
+DEFAULT_TOKEN_BUDGET = 8192
+DEFAULT_MAX_BATCH = 256
+
+
+def token_lengths(model, texts: Sequence[str]) -> List[int]:
+    """Token count per text (incl. special tokens), capped at the model's max_seq_length."""
+    max_len = getattr(model, 'max_seq_length', None) or 512
+    tok = getattr(model, 'tokenizer', None)
+    if tok is not None and texts:
+        try:
+            ids = tok(list(texts), add_special_tokens=True, truncation=True, max_length=max_len)['input_ids']
+            return [len(x) for x in ids]
+        except Exception:
+            pass
+    # fallback: CJK text is roughly one wordpiece per character, plus [CLS]/[SEP]
+    return [min(len(t) + 2, max_len) for t in texts]
+
+
+def plan_batches(lengths: Sequence[int], token_budget: int = DEFAULT_TOKEN_BUDGET,
+                 max_batch: int = DEFAULT_MAX_BATCH) -> List[List[int]]:
+    """Group indices (longest first) so each batch's padded token count fits the budget."""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches: List[List[int]] = []
+    cur: List[int] = []
+    width = 0
+    for i in order:
+        if cur and ((len(cur) + 1) * width > token_budget or len(cur) >= max_batch):
+            batches.append(cur)
+            cur = []
+        if not cur:
+            # sorted descending, so the first member fixes the padded width of the batch
+            width = max(1, lengths[i])
+        cur.append(i)
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def encode_bucketed(model, texts: Sequence[str], token_budget: int = DEFAULT_TOKEN_BUDGET,
+                    max_batch: int = DEFAULT_MAX_BATCH, **encode_kwargs) -> np.ndarray:
+    """Encode `texts` with length-bucketed batches; returns float32 [len(texts), dim] in input order."""
+    texts = list(texts)
+    if not texts:
+        dim = model.get_sentence_embedding_dimension() if hasattr(model, 'get_sentence_embedding_dimension') else 0
+        return np.zeros((0, dim or 0), dtype=np.float32)
+    encode_kwargs.setdefault('show_progress_bar', False)
+    out = None
+    for idxs in plan_batches(token_lengths(model, texts), token_budget, max_batch):
+        embs = np.asarray(model.encode([texts[i] for i in idxs], batch_size=len(idxs), **encode_kwargs),
+                          dtype=np.float32)
+        if out is None:
+            out = np.empty((len(texts), embs.shape[1]), dtype=np.float32)
+        out[idxs] = embs
+    return out
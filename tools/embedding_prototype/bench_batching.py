@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark fixed-size vs length-bucketed encode batching (items/sec).
+
+Texts come from output/metadata.json (repeated up to --n), so the mix of one-line
+docx_tables_* rows and long procedure paragraphs matches the real KB.
+Usage: python bench_batching.py [--n 2000] [--batch-size 64] [--token-budget 8192] [--model NAME]
+
+Modes:
+  fixed     input-order chunks of --batch-size, one encode call each (previous compute_embeddings)
+  st-sort   a single model.encode(all, batch_size=--batch-size) (sentence-transformers length sort)
+  bucketed  batching.encode_bucketed with a token budget
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from batching import DEFAULT_TOKEN_BUDGET, encode_bucketed
+
+OUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
+META_PATH = os.path.join(OUT_DIR, 'metadata.json')
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+
+
+def load_texts(n):
+    if not os.path.exists(META_PATH):
+        raise SystemExit('Run compute_embeddings.py first')
+    with open(META_PATH, 'r', encoding='utf-8') as f:
+        base = [m.get('content', '') for m in json.load(f) if m.get('content')]
+    return [base[i % len(base)] for i in range(n)]
+
+
+def run_fixed(model, texts, bs):
+    out = [model.encode(texts[i:i + bs], batch_size=bs, show_progress_bar=False) for i in range(0, len(texts), bs)]
+    return np.concatenate(out)
+
+
+def run_st_sort(model, texts, bs):
+    return model.encode(texts, batch_size=bs, show_progress_bar=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--token-budget', type=int, default=DEFAULT_TOKEN_BUDGET)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--model', default=MODEL_NAME)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(args.model)
+    texts = load_texts(args.n)
+    modes = [
+        ('fixed', lambda: run_fixed(model, texts, args.batch_size)),
+        ('st-sort', lambda: run_st_sort(model, texts, args.batch_size)),
+        ('bucketed', lambda: encode_bucketed(model, texts, token_budget=args.token_budget)),
+    ]
+    model.encode(texts[:args.batch_size], show_progress_bar=False)  # warm-up
+    ref = None
+    print(f'{len(texts)} texts, batch_size={args.batch_size}, token_budget={args.token_budget}')
+    print(f"{'mode':<10} {'best s':>8} {'items/s':>10} {'speedup':>8}")
+    base = None
+    for name, fn in modes:
+        best = float('inf')
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            embs = np.asarray(fn(), dtype=np.float32)
+            best = min(best, time.perf_counter() - t0)
+        if ref is None:
+            ref = embs
+        else:
+            # scatter-back must preserve input order
+            cos = np.sum(ref * embs, axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(embs, axis=1) + 1e-12)
+            assert cos.min() > 0.999, f'{name}: output order/values differ (min cos {cos.min():.4f})'
+        base = base or best
+        print(f'{name:<10} {best:8.3f} {len(texts) / best:10.1f} {base / best:7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Startup vs steady-state timing for embed_batch_cli.py: N one-shot runs (one process and
+model load per batch, as EmbeddingWorker's CLI mode does today) against one --daemon
+process answering the same N batches over stdin.
+
+Usage: python bench_cli_daemon.py [--batches 5] [--batch-size 8] [--format f32]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from embed_batch_cli import read_response
+
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embed_batch_cli.py')
+TEXTS = ['变压器 发热 异常 需 停运', '变压器 短路 故障 原因 分析', '维护规程: 变压器检查 温度 急剧上升',
+         '带电体电压 有安全遮栏 无安全遮栏 6~10kV 0.35 0.70', '断路器 拒动 处理 步骤']
+
+
+def make_batches(n, size):
+    return [[{'id': f'{b}-{i}', 'content': f'{TEXTS[(b + i) % len(TEXTS)]} {b}'} for i in range(size)] for b in range(n)]
+
+
+def run_one_shot(batches, fmt):
+    lat = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for b, batch in enumerate(batches):
+            path = os.path.join(tmp, f'batch_{b}.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(batch, f, ensure_ascii=False)
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, CLI, path, '--format', fmt], check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            lat.append((time.perf_counter() - t0) * 1000)
+    return lat
+
+
+def run_daemon(batches, fmt):
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, CLI, '--daemon'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    try:
+        header, _ = read_response(proc.stdout)
+        startup = (time.perf_counter() - t0) * 1000
+        lat = []
+        for b, batch in enumerate(batches):
+            t1 = time.perf_counter()
+            proc.stdin.write(json.dumps({'req': b, 'items': batch, 'format': fmt}, ensure_ascii=False).encode('utf-8') + b'\n')
+            proc.stdin.flush()
+            header, _ = read_response(proc.stdout)
+            if 'error' in header:
+                raise SystemExit(f"daemon error: {header['error']}")
+            lat.append((time.perf_counter() - t1) * 1000)
+    finally:
+        proc.stdin.close()
+        proc.wait(timeout=30)
+    return startup, lat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batches', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--format', default='f32')
+    args = parser.parse_args()
+    batches = make_batches(args.batches, args.batch_size)
+    one = run_one_shot(batches, args.format)
+    startup, warm = run_daemon(batches, args.format)
+    print(f'{args.batches} batches x {args.batch_size} items, format={args.format}')
+    print(f"{'mode':<10} {'startup ms':>11} {'per-batch p50':>14} {'total ms':>10}")
+    print(f"{'one-shot':<10} {'-':>11} {np.median(one):14.1f} {sum(one):10.1f}")
+    print(f"{'daemon':<10} {startup:11.1f} {np.median(warm):14.1f} {startup + sum(warm):10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Latency/throughput benchmark for the Python retrieval stack.
+
+Stages: model load, single and batched embedding, exact search (blocked NumPy, single query
+and 32-query batches; faiss flat),
+ANN search (faiss HNSW, or NumPy IVF without faiss), lexical BM25 search, hybrid merge
+and cross-encoder rerank. `filtered` repeats ANN and lexical search under facet filters
+(facets.py) that keep ~100%, 10% and 1% of the rows, and reports the filtered ANN recall@k
+against an exact scan of the same rows. Search stages run over synthetic corpora (default sizes 100,
+500, 1000, 5000, 50000, 500000, matching the NEON table in README.md); model stages run once.
+
+Rows are appended to `benchmarks_python.csv` (next to this script, same spirit as
+tools/benchmarks.csv) with p50/p95/p99 latency, throughput and the process peak RSS.
+Search throughput is reported in vectors/ms like README.md; model stages in items/s.
+
+Usage:
+  python bench_retrieval.py [--sizes 100,500,1000] [--stages exact,ann,lexical] [--skip-model]
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import ann_numpy
+from fusion import score_merge
+
+BASE = os.path.dirname(__file__)
+META_PATH = os.path.join(BASE, 'output', 'metadata.json')
+CSV_PATH = os.path.join(BASE, 'benchmarks_python.csv')
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+CE_NAME = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+DEFAULT_SIZES = (100, 500, 1000, 5000, 50000, 500000)
+SEARCH_STAGES = ('exact', 'exact_batch', 'exact_faiss', 'ann', 'lexical', 'hybrid', 'filtered')
+# synthetic taxonomy for the filtered stage: rows spread over this many documents
+FILTER_DOCS = 100
+# (label, filter expression) at roughly 100%, 10% and 1% selectivity
+FILTERS = (('100%', 'industry=铁路'),
+           ('10%', 'document in (' + ', '.join(f'doc{i}' for i in range(10)) + ')'),
+           ('1%', 'document=doc0'))
+# queries per call for the exact_batch stage
+QUERY_BATCH = 32
+MODEL_STAGES = ('model_load', 'embed_single', 'embed_batch', 'rerank')
+FIELDS = ['timestamp', 'stage', 'corpus_size', 'dim', 'batch', 'iters', 'p50_ms', 'p95_ms', 'p99_ms',
+          'throughput', 'throughput_unit', 'peak_rss_bytes', 'note']
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return rss if sys.platform == 'darwin' else rss * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except ImportError:
+        return ''
+
+
+def measure(fn, iters, warmup=2):
+    for _ in range(warmup):
+        fn()
+    lat = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        fn()
+        lat.append((time.perf_counter() - t0) * 1000)
+    return lat
+
+
+class Recorder:
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.rows = []
+
+    def add(self, stage, lat_ms, corpus_size='', batch=1, throughput=None, unit='', note=''):
+        p50, p95, p99 = (float(np.percentile(lat_ms, p)) for p in (50, 95, 99))
+        row = {'timestamp': datetime.now(timezone.utc).isoformat(), 'stage': stage, 'corpus_size': corpus_size,
+               'dim': self.dim, 'batch': batch, 'iters': len(lat_ms), 'p50_ms': f'{p50:.4f}',
+               'p95_ms': f'{p95:.4f}', 'p99_ms': f'{p99:.4f}',
+               'throughput': '' if throughput is None else f'{throughput:.3f}', 'throughput_unit': unit,
+               'peak_rss_bytes': peak_rss_bytes(), 'note': note}
+        self.rows.append(row)
+        print(f"{stage:<13} n={str(corpus_size):<7} p50={p50:9.3f}ms p95={p95:9.3f}ms p99={p99:9.3f}ms "
+              f"{row['throughput']:>10} {unit:<7} rss={row['peak_rss_bytes']}")
+
+    def flush(self):
+        new = not os.path.exists(self.path)
+        with open(self.path, 'a', newline='', encoding='utf-8') as f:
+            w = csv.DictWriter(f, fieldnames=FIELDS)
+            if new:
+                w.writeheader()
+            w.writerows(self.rows)
+        print(f'Appended {len(self.rows)} rows to {self.path}')
+
+
+def base_texts():
+    if os.path.exists(META_PATH):
+        with open(META_PATH, 'r', encoding='utf-8') as f:
+            texts = [m.get('content', '') for m in json.load(f) if m.get('content')]
+        if texts:
+            return texts
+    return ['变压器 发热 异常 需 停运', '变压器 短路 故障 原因 分析', '带电体电压 有安全遮栏 无安全遮栏 6~10kV 0.35 0.70']
+
+
+def synthetic_corpus(n, dim, texts, rng):
+    # clustered vectors (topic structure) and KB-like text rows cycled from metadata.json
+    centers = rng.standard_normal((max(8, n // 100), dim), dtype=np.float32)
+    emb = centers[rng.integers(0, centers.shape[0], n)] + 0.5 * rng.standard_normal((n, dim), dtype=np.float32)
+    meta = [{'content': f'{texts[i % len(texts)]} {i}', 'title': ''} for i in range(n)]
+    return ann_numpy.normalize(emb), meta
+
+
+def bench_search(rec, sizes, dim, stages, iters, k, rng):
+    texts = base_texts()
+    try:
+        import faiss
+    except Exception:
+        faiss = None
+    import build_index
+    from lexical_index import LexicalIndex
+    for n in sizes:
+        xb, meta = synthetic_corpus(n, dim, texts, rng)
+        xq = ann_numpy.normalize(xb[rng.integers(0, n, iters)] + 0.05 * rng.standard_normal((iters, dim), dtype=np.float32))
+        qi = iter(range(10 ** 9))
+
+        def next_q():
+            return xq[next(qi) % iters][None, :]
+
+        ann_hits = lex_hits = None
+        if 'exact' in stages or 'exact_batch' in stages:
+            flat = ann_numpy.NumpyFlatIndex(xb)
+        if 'exact' in stages:
+            lat = measure(lambda: flat.search(next_q(), k), iters)
+            rec.add('exact', lat, n, throughput=n / np.median(lat), unit='vec/ms', note='blocked numpy')
+        if 'exact_batch' in stages:
+            xq_batch = xq[np.arange(QUERY_BATCH) % iters]
+            lat = measure(lambda: flat.search(xq_batch, k), max(1, iters // 4))
+            rec.add('exact_batch', lat, n, batch=QUERY_BATCH, throughput=n * QUERY_BATCH / np.median(lat),
+                    unit='vec/ms', note='blocked numpy')
+        if 'exact_faiss' in stages and faiss is not None:
+            index = faiss.IndexFlatIP(dim)
+            index.add(xb)
+            lat = measure(lambda: index.search(next_q(), k), iters)
+            rec.add('exact_faiss', lat, n, throughput=n / np.median(lat), unit='vec/ms', note='IndexFlatIP')
+        if 'ann' in stages or 'hybrid' in stages:
+            params = dict(build_index.DEFAULT_PARAMS, nlist=max(1, min(1024, int(4 * np.sqrt(n)))))
+            kind = 'hnsw' if faiss is not None else 'numpy-ivf'
+            t0 = time.perf_counter()
+            if faiss is not None:
+                ann = build_index.make_faiss_index(xb, kind, params)
+            else:
+                ann = build_index.make_numpy_index(xb, kind, params)
+            rec.add('ann_build', [(time.perf_counter() - t0) * 1000], n, note=kind)
+            if 'ann' in stages:
+                lat = measure(lambda: ann.search(next_q(), k), iters)
+                rec.add('ann', lat, n, throughput=n / np.median(lat), unit='vec/ms', note=kind)
+            s, i = ann.search(xq[:1], 2 * k)
+            ann_hits = [(int(a), float(b)) for a, b in zip(i[0], s[0]) if a >= 0]
+        if 'lexical' in stages or 'hybrid' in stages:
+            t0 = time.perf_counter()
+            lex = LexicalIndex.build(meta)
+            rec.add('lexical_build', [(time.perf_counter() - t0) * 1000], n, note='char 1-3 gram BM25')
+            queries = []
+            for _ in range(iters):
+                t = meta[random.randrange(n)]['content']
+                start = random.randrange(max(1, len(t) - 8))
+                queries.append(t[start:start + 8])
+            qs = iter(range(10 ** 9))
+            if 'lexical' in stages:
+                lat = measure(lambda: lex.search(queries[next(qs) % iters], k), iters)
+                rec.add('lexical', lat, n, throughput=n / np.median(lat), unit='docs/ms')
+            lex_hits = lex.search(queries[0], 2 * k)
+        if 'hybrid' in stages and ann_hits is not None and lex_hits is not None:
+            top = max((s for _, s in lex_hits), default=0.0) or 1.0
+            lex_norm = [(i, s / top) for i, s in lex_hits]
+            lat = measure(lambda: score_merge(ann_hits, lex_norm, k), iters)
+            rec.add('hybrid_merge', lat, n, note=f'{len(ann_hits)}+{len(lex_norm)} candidates')
+        if 'filtered' in stages:
+            bench_filtered(rec, xb, xq, meta, iters, k, faiss)
+
+
+def bench_filtered(rec, xb, xq, meta, iters, k, faiss):
+    """ANN and lexical latency under narrowing facet filters, with ANN recall against exact filtered top-k."""
+    import build_index
+    from facets import FacetIndex
+    from index_io import FaissSearcher, NumpySearcher
+    from lexical_index import LexicalIndex
+    n = len(xb)
+    params = dict(build_index.DEFAULT_PARAMS, nlist=max(1, min(1024, int(4 * np.sqrt(n)))))
+    if faiss is not None:
+        kind = 'hnsw'
+        ann = FaissSearcher(build_index.make_faiss_index(xb, kind, params), xb)
+    else:
+        kind = 'numpy-ivf'
+        ann = NumpySearcher(build_index.make_numpy_index(xb, kind, params))
+    flat = ann_numpy.NumpyFlatIndex(xb)
+    lex = LexicalIndex.build(meta)
+    facets = FacetIndex.build((f'铁路/专业知识/doc{i % FILTER_DOCS}' for i in range(n)), n)
+    queries = [meta[random.randrange(n)]['content'][:8] for _ in range(iters)]
+    for label, expr in FILTERS:
+        sel = facets.select(expr)
+        if not sel.count:
+            continue
+        qi = iter(range(10 ** 9))
+        lat = measure(lambda: ann.search(xq[next(qi) % iters][None, :], k, sel.rows), iters)
+        hits = found = 0
+        for q in xq:
+            _, got = ann.search(q[None, :], k, sel.rows)
+            _, want = flat.search(q[None, :], k, sel.rows)
+            want = set(want[0][want[0] >= 0].tolist())
+            found += len(want & set(got[0].tolist()))
+            hits += len(want)
+        rec.add('filtered_ann', lat, n, throughput=sel.count / np.median(lat), unit='vec/ms',
+                note=f'{kind} sel={label} ({sel.count} rows) recall@{k}={found / max(1, hits):.3f}')
+        lat = measure(lambda: lex.search(queries[next(qi) % iters], k, allowed=sel.mask), iters)
+        rec.add('filtered_lex', lat, n, throughput=sel.count / np.median(lat), unit='docs/ms',
+                note=f'sel={label} ({sel.count} rows)')
+
+
+def bench_model(rec, stages, iters, batch, rng, model_name, ce_name, backend='torch'):
+    texts = base_texts()
+    if {'model_load', 'embed_single', 'embed_batch'} & set(stages):
+        t0 = time.perf_counter()
+        from encoder import load_encoder
+        model = load_encoder(model_name, backend)
+        rec.add('model_load', [(time.perf_counter() - t0) * 1000],
+                note='incl. torch import' if backend == 'torch' else backend)
+        single = iter(range(10 ** 9))
+        if 'embed_single' in stages:
+            lat = measure(lambda: model.encode([texts[next(single) % len(texts)]], show_progress_bar=False), iters)
+            rec.add('embed_single', lat, throughput=1000 / np.median(lat), unit='items/s', note=backend)
+        if 'embed_batch' in stages:
+            from batching import encode_bucketed
+            chunk = [texts[int(i)] for i in rng.integers(0, len(texts), batch)]
+            lat = measure(lambda: encode_bucketed(model, chunk), max(3, iters // 10), warmup=1)
+            rec.add('embed_batch', lat, batch=batch, throughput=batch * 1000 / np.median(lat), unit='items/s',
+                    note=backend)
+    if 'rerank' in stages:
+        from sentence_transformers import CrossEncoder
+        ce = CrossEncoder(ce_name)
+        pairs = [['变压器 故障', texts[i % len(texts)][:512]] for i in range(30)]
+        lat = measure(lambda: ce.predict(pairs, show_progress_bar=False), max(3, iters // 10), warmup=1)
+        rec.add('rerank', lat, batch=len(pairs), throughput=len(pairs) * 1000 / np.median(lat), unit='items/s')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES))
+    parser.add_argument('--stages', default=','.join(MODEL_STAGES + SEARCH_STAGES))
+    parser.add_argument('--dim', type=int, default=384, help='vector dim (README NEON table uses 128)')
+    parser.add_argument('--iters', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--batch', type=int, default=64, help='texts per batched embedding call')
+    parser.add_argument('--skip-model', action='store_true', help='only run the corpus-size search stages')
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--backend', default='torch', help='encoder backend: torch, onnx or onnx-int8 (encoder.py)')
+    parser.add_argument('--cross-encoder', default=CE_NAME)
+    parser.add_argument('--out', default=CSV_PATH)
+    args = parser.parse_args()
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    rng = np.random.default_rng(0)
+    random.seed(0)
+    rec = Recorder(args.out, args.dim)
+    try:
+        if not args.skip_model:
+            bench_model(rec, stages, args.iters, args.batch, rng, args.model, args.cross_encoder, args.backend)
+        bench_search(rec, sizes, args.dim, stages, args.iters, args.k, rng)
+    finally:
+        if rec.rows:
+            rec.flush()
+
+
+if __name__ == '__main__':
+    main()
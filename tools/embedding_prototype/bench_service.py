@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test for the running embedding service (simulates several devices'
+EmbeddingWorkers posting small batches at once).
+
+Reports requests/s, p50/p95/p99 latency and the number of 503 (overloaded) responses.
+Compare runs against a service started with EMBED_MAX_WAIT_MS=0 (no merging window).
+
+Usage:
+  python bench_service.py [--url http://127.0.0.1:8000/embed_batch] [--concurrency 16] [--requests 400] [--batch 4]
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+import requests
+
+TEXTS = ['变压器 发热 异常 需 停运', '变压器 短路 故障 原因 分析', '维护规程: 变压器检查 温度 急剧上升',
+         '带电体电压 有安全遮栏 无安全遮栏 6~10kV 0.35 0.70', '断路器 拒动 处理 步骤']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000/embed_batch')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=400, help='total requests across all clients')
+    parser.add_argument('--batch', type=int, default=4, help='items per request')
+    args = parser.parse_args()
+
+    lat, rejected, failed = [], [0], [0]
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def client(cid):
+        session = requests.Session()
+        for n in counter:
+            batch = [{'id': f'{cid}-{n}-{j}', 'content': f'{TEXTS[(n + j) % len(TEXTS)]} {n}'} for j in range(args.batch)]
+            t0 = time.perf_counter()
+            try:
+                resp = session.post(args.url, json=batch, timeout=120)
+            except requests.RequestException:
+                with lock:
+                    failed[0] += 1
+                continue
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                if resp.status_code == 503:
+                    rejected[0] += 1
+                elif resp.ok:
+                    lat.append(ms)
+                else:
+                    failed[0] += 1
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(args.concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    if lat:
+        p50, p95, p99 = (np.percentile(lat, p) for p in (50, 95, 99))
+        print(f'{len(lat)} ok in {wall:.2f}s: {len(lat) / wall:.1f} req/s, {len(lat) * args.batch / wall:.1f} items/s')
+        print(f'latency ms: p50={p50:.1f} p95={p95:.1f} p99={p99:.1f}')
+    print(f'503 overloaded={rejected[0]} failed={failed[0]}')
+    try:
+        print('batcher:', requests.get(args.url.rsplit('/', 1)[0] + '/health', timeout=5).json().get('batcher'))
+    except Exception:
+        pass
+
+
+if __name__ == '__main__':
+    main()
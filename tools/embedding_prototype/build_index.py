@@ -1,42 +1,230 @@
 #!/usr/bin/env python3
 """
-Build a FAISS index if faiss is available; otherwise serialize a sklearn NearestNeighbors model.
-Produces `output/index.faiss` or `output/nn_model.pkl`.
+Build the ANN index over output/embeddings.npy.
+
+Index families (--index-type):
+  auto        faiss IndexFlatIP if faiss is available, otherwise numpy-flat
+  flat        faiss exact inner product
+  ivf-flat    faiss IVF with uncompressed lists        (--nlist, --nprobe)
+  ivf-pq      faiss IVF with product-quantized lists   (--nlist, --nprobe, --pq-m, --pq-bits)
+  hnsw        faiss HNSW graph                         (--M, --ef-construction, --ef-search)
+  numpy-flat  pure-NumPy exact search, no faiss needed (blocked, multi-threaded; SEARCH_THREADS)
+  numpy-ivf   pure-NumPy IVF-Flat, no faiss needed     (--nlist, --nprobe)
+  numpy-f16   float16 vectors, half the memory         (--rescore)
+  numpy-int8  per-dimension int8 scalar quantization   (--rescore)
+
+Quantized indexes search the compressed vectors and, with --rescore R > 0, re-score the
+top k*R candidates against the float32 rows of embeddings.npy (memory-mapped).
+
+Produces `output/index.faiss` or `output/index_numpy/`, plus
+`output/index_manifest.json` recording the index type, search parameters and the
+embeddings/metadata fingerprint so retrieve.py can reuse the index until it is stale.
+
+--sweep builds the requested families (or all available ones) and reports recall@k against
+exact search together with p50/p99 single-query latency for a grid of nprobe / efSearch values.
 """
+import argparse
 import os
 import json
+import shutil
+import time
 import numpy as np
-import pickle
 
-OUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
-EMB_PATH = os.path.join(OUT_DIR, 'embeddings.npy')
-META_PATH = os.path.join(OUT_DIR, 'metadata.json')
+import ann_numpy
+from index_io import FAISS_NAME, NUMPY_NAME, OUT_DIR, apply_search_params, fingerprint, write_manifest
+
+FAISS_TYPES = ('flat', 'ivf-flat', 'ivf-pq', 'hnsw')
+NUMPY_TYPES = ('numpy-flat', 'numpy-ivf', 'numpy-f16', 'numpy-int8')
+QUANTIZED_TYPES = ('numpy-f16', 'numpy-int8')
+INDEX_TYPES = ('auto',) + FAISS_TYPES + NUMPY_TYPES
+DEFAULT_PARAMS = {'nlist': 64, 'nprobe': 8, 'pq_m': 16, 'pq_bits': 8, 'M': 32, 'ef_construction': 200, 'ef_search': 64,
+                  'rescore': 4}
+
+
+def have_faiss() -> bool:
+    try:
+        import faiss  # noqa: F401
+        return True
+    except Exception:
+        return False
 
-if not os.path.exists(EMB_PATH):
-    raise SystemExit('embeddings.npy not found; run compute_embeddings.py first')
 
-emb = np.load(EMB_PATH)
-print('Loaded embeddings', emb.shape)
+def normalize(emb) -> np.ndarray:
+    return ann_numpy.normalize(emb)
 
-try:
+
+def effective_pq_bits(n: int, pq_bits: int) -> int:
+    # faiss wants ~39 training points per PQ centroid (2**nbits of them per sub-quantizer)
+    return max(1, min(pq_bits, int(np.log2(max(2, n // 39)))))
+
+
+def make_faiss_index(emb_norm: np.ndarray, index_type: str, params: dict):
     import faiss
-    use_faiss = True
-except Exception:
-    use_faiss = False
-
-if use_faiss:
-    d = emb.shape[1]
-    # Use index suitable for cosine similarity: normalize then use IndexFlatIP
-    emb_norm = emb / np.linalg.norm(emb, axis=1, keepdims=True)
-    index = faiss.IndexFlatIP(d)
+    n, d = emb_norm.shape
+    ip = faiss.METRIC_INNER_PRODUCT
+    # small corpora cannot train many centroids / 256-entry PQ codebooks
+    nlist = max(1, min(params['nlist'], n // 4 or 1))
+    if index_type == 'flat':
+        index = faiss.IndexFlatIP(d)
+    elif index_type == 'ivf-flat':
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(d), d, nlist, ip)
+    elif index_type == 'ivf-pq':
+        m = params['pq_m']
+        if d % m:
+            raise SystemExit(f'--pq-m {m} must divide the embedding dim {d}')
+        nbits = effective_pq_bits(n, params['pq_bits'])
+        index = faiss.IndexIVFPQ(faiss.IndexFlatIP(d), d, nlist, m, nbits, ip)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(d, params['M'], ip)
+        index.hnsw.efConstruction = params['ef_construction']
+    else:
+        raise ValueError(index_type)
+    if not index.is_trained:
+        index.train(emb_norm)
     index.add(emb_norm)
-    faiss.write_index(index, os.path.join(OUT_DIR, 'index.faiss'))
-    print('Built FAISS Index and saved to', os.path.join(OUT_DIR, 'index.faiss'))
-else:
-    print('faiss not available; falling back to sklearn NearestNeighbors serialization')
-    from sklearn.neighbors import NearestNeighbors
-    nn = NearestNeighbors(n_neighbors=10, algorithm='auto', metric='cosine')
-    nn.fit(emb)
-    with open(os.path.join(OUT_DIR, 'nn_model.pkl'), 'wb') as f:
-        pickle.dump(nn, f)
-    print('Saved sklearn NN model to', os.path.join(OUT_DIR, 'nn_model.pkl'))
+    apply_search_params(index, params)
+    return index
+
+
+def make_numpy_index(emb: np.ndarray, index_type: str, params: dict):
+    if index_type == 'numpy-ivf':
+        return ann_numpy.NumpyIVFIndex.build(emb, nlist=params['nlist'], nprobe=params['nprobe'])
+    if index_type == 'numpy-f16':
+        return ann_numpy.NumpyF16Index.build(emb, rescore=params['rescore'])
+    if index_type == 'numpy-int8':
+        return ann_numpy.NumpyInt8Index.build(emb, rescore=params['rescore'])
+    return ann_numpy.NumpyFlatIndex.build(emb)
+
+
+def build(out_dir: str = OUT_DIR, index_type: str = 'auto', params: dict = None) -> dict:
+    emb_path = os.path.join(out_dir, 'embeddings.npy')
+    if not os.path.exists(emb_path):
+        raise SystemExit('embeddings.npy not found; run compute_embeddings.py first')
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    # fingerprint before reading so a concurrent rewrite shows up as stale next time
+    inputs = fingerprint(out_dir)
+    emb = np.load(emb_path)
+    print('Loaded embeddings', emb.shape)
+
+    use_faiss = have_faiss()
+    if index_type == 'auto':
+        index_type = 'flat' if use_faiss else 'numpy-flat'
+    if index_type in FAISS_TYPES and not use_faiss:
+        raise SystemExit(f'--index-type {index_type} needs faiss; use numpy-flat / numpy-ivf instead')
+
+    if index_type in FAISS_TYPES:
+        import faiss
+        # Use index suitable for cosine similarity: normalize then use inner product
+        index = make_faiss_index(normalize(emb), index_type, params)
+        if index_type == 'ivf-pq':
+            # record what was built, not what was asked for
+            params['pq_bits'] = effective_pq_bits(emb.shape[0], params['pq_bits'])
+            print(f"PQ: m={params['pq_m']} pq_bits={params['pq_bits']}")
+        faiss.write_index(index, os.path.join(out_dir, FAISS_NAME))
+        print(f'Built FAISS {index_type} index and saved to', os.path.join(out_dir, FAISS_NAME))
+        kind, name = 'faiss', FAISS_NAME
+    else:
+        path = os.path.join(out_dir, NUMPY_NAME)
+        shutil.rmtree(path, ignore_errors=True)
+        ann_numpy.save(make_numpy_index(emb, index_type, params), path)
+        print(f'Built {index_type} index and saved to', path)
+        kind, name = 'numpy', NUMPY_NAME
+
+    manifest = {'kind': kind, 'index_type': index_type, 'path': name, 'n': int(emb.shape[0]),
+                'dim': int(emb.shape[1]), 'params': params, 'inputs': inputs}
+    write_manifest(manifest, out_dir)
+    return manifest
+
+
+def _latency_recall(search, xq, truth, k):
+    lat = []
+    hits = 0
+    for i in range(xq.shape[0]):
+        t0 = time.perf_counter()
+        _, idx = search(xq[i:i + 1], k)
+        lat.append((time.perf_counter() - t0) * 1000)
+        hits += len(set(int(x) for x in idx[0] if x >= 0) & set(truth[i]))
+    return hits / (xq.shape[0] * k), float(np.percentile(lat, 50)), float(np.percentile(lat, 99))
+
+
+def sweep(emb: np.ndarray, index_types, params: dict, k: int, n_queries: int, seed: int = 0):
+    """Print recall@k vs exact search and p50/p99 single-query latency per operating point."""
+    xb = normalize(emb)
+    rng = np.random.default_rng(seed)
+    # queries: perturbed corpus vectors, so neighbours exist but are not trivially the source row
+    xq = xb[rng.choice(xb.shape[0], n_queries)] + 0.05 * rng.standard_normal((n_queries, xb.shape[1]), dtype=np.float32)
+    xq = normalize(xq)
+    _, truth = ann_numpy.topk(xq @ xb.T, k)
+    truth = [set(int(x) for x in row if x >= 0) for row in truth]
+    print(f'sweep: n={xb.shape[0]} dim={xb.shape[1]} queries={n_queries} k={k}')
+    print(f"{'index':<11} {'params':<22} {'build s':>8} {'MB':>8} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for index_type in index_types:
+        t0 = time.perf_counter()
+        if index_type in FAISS_TYPES:
+            index = make_faiss_index(xb, index_type, params)
+        else:
+            index = make_numpy_index(xb, index_type, params)
+        build_s = time.perf_counter() - t0
+        # ivf-pq rows show the PQ shape actually built (pq_bits is clamped on small corpora)
+        suffix = f" pq_bits={effective_pq_bits(xb.shape[0], params['pq_bits'])}" if index_type == 'ivf-pq' else ''
+        mb = f'{index.nbytes / 2**20:8.1f}' if hasattr(index, 'nbytes') else f"{'-':>8}"
+        if index_type in ('ivf-flat', 'ivf-pq', 'numpy-ivf'):
+            grid = [('nprobe', v) for v in (1, 2, 4, 8, 16, 32, 64, 128) if v <= params['nlist']]
+        elif index_type == 'hnsw':
+            grid = [('ef_search', v) for v in (16, 32, 64, 128, 256, 512)]
+        elif index_type in QUANTIZED_TYPES:
+            grid = [('rescore', v) for v in (0, 2, 4, 8)]
+        else:
+            grid = [(None, None)]
+        for key, value in grid:
+            if key:
+                p = dict(params, **{key: value})
+                apply_search_params(index, p)
+            recall, p50, p99 = _latency_recall(index.search, xq, truth, k)
+            label = (f'{key}={value}' if key else '-') + suffix
+            print(f'{index_type:<11} {label:<22} {build_s:8.2f} {mb} {recall:9.4f} {p50:8.3f} {p99:8.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default='auto')
+    parser.add_argument('--nlist', type=int, default=DEFAULT_PARAMS['nlist'])
+    parser.add_argument('--nprobe', type=int, default=DEFAULT_PARAMS['nprobe'])
+    parser.add_argument('--pq-m', type=int, default=DEFAULT_PARAMS['pq_m'], help='PQ sub-quantizers (must divide dim)')
+    parser.add_argument('--pq-bits', type=int, default=DEFAULT_PARAMS['pq_bits'])
+    parser.add_argument('--M', type=int, default=DEFAULT_PARAMS['M'], help='HNSW graph degree')
+    parser.add_argument('--ef-construction', type=int, default=DEFAULT_PARAMS['ef_construction'])
+    parser.add_argument('--ef-search', type=int, default=DEFAULT_PARAMS['ef_search'])
+    parser.add_argument('--rescore', type=int, default=DEFAULT_PARAMS['rescore'],
+                        help='quantized indexes: re-score top k*R candidates in float32 (0 = off)')
+    parser.add_argument('--sweep', action='store_true', help='report recall@k / latency instead of writing an index')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200, help='sweep query count')
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='sweep over N clustered random vectors instead of embeddings.npy (scale testing)')
+    args = parser.parse_args()
+    params = {'nlist': args.nlist, 'nprobe': args.nprobe, 'pq_m': args.pq_m, 'pq_bits': args.pq_bits,
+              'M': args.M, 'ef_construction': args.ef_construction, 'ef_search': args.ef_search,
+              'rescore': args.rescore}
+    if not args.sweep:
+        build(OUT_DIR, args.index_type, params)
+        return
+    if args.synthetic:
+        # clustered like real topic-grouped KB text rather than uniform noise (IVF's worst case)
+        rng = np.random.default_rng(1)
+        centers = rng.standard_normal((max(16, args.synthetic // 100), 384), dtype=np.float32)
+        emb = centers[rng.integers(0, centers.shape[0], args.synthetic)]
+        emb += 0.5 * rng.standard_normal(emb.shape, dtype=np.float32)
+    else:
+        emb = np.load(os.path.join(OUT_DIR, 'embeddings.npy'))
+    if args.index_type != 'auto':
+        types = [args.index_type]
+    else:
+        types = (list(FAISS_TYPES) if have_faiss() else []) + list(NUMPY_TYPES)
+    if any(t in FAISS_TYPES for t in types) and not have_faiss():
+        raise SystemExit('faiss not available; sweep numpy-flat / numpy-ivf instead')
+    sweep(emb, types, params, args.k, args.queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,13 @@
 #!/usr/bin/env python3
 import json, os
+from meta_store import open_meta
 BASE = os.path.dirname(__file__)
-META = os.path.join(BASE, 'output', 'metadata.json')
 EVAL = os.path.join(BASE, 'eval_generated.json')
-if not os.path.exists(META):
+meta = open_meta(os.path.join(BASE, 'output'))
+if meta is None:
     print('metadata.json missing; run compute_embeddings.py first'); raise SystemExit(1)
 if not os.path.exists(EVAL):
     print('eval_generated.json missing'); raise SystemExit(1)
-with open(META,'r',encoding='utf-8') as f:
-    meta = json.load(f)
-ids = set(f"{m.get('source_file')}::{m.get('original_index')}" for m in meta)
 with open(EVAL,'r',encoding='utf-8') as f:
     ev = json.load(f)
 queries = ev.get('queries', [])
@@ -17,7 +15,7 @@ missing = {}
 for q in queries:
     gid = q.get('id')
     for g in q.get('gold', []):
-        if g not in ids:
+        if not meta.rows_for(g):
             missing.setdefault(g,[]).append(gid)
 print('Total queries:', len(queries))
 print('Total unique gold ids referenced:', len(set(g for q in queries for g in q.get('gold',[]))))
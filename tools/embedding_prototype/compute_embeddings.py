@@ -1,28 +1,84 @@
 #!/usr/bin/env python3
 """
 Compute embeddings for local KB JSON files under project `tmp/` and save embeddings + metadata.
-Usage: python compute_embeddings.py
+Usage: python compute_embeddings.py [--no-cache] [--batch-size 512] [--max-memory MB] [--backend onnx]
+                                     [--no-dedup | --dedup-threshold 0.8]
+                                     [--trace FILE] [--metrics-out FILE] [--profile-hz 100]
+
+Vectors are cached under `output/cache/` keyed by model + content hash, so re-running after
+a small KB edit only encodes new/changed items (see embedding_cache.py).
+
+Ingestion is streamed (see kb_stream.py): records are parsed incrementally, encoded in bounded
+batches and appended to embeddings.npy / metadata.json, so memory does not grow with the corpus.
+The same rows go to the columnar store `output/metadata/` (meta_store.py) that the search
+scripts open instead of parsing metadata.json.
+With --workers N (default: up to 4) files are parsed and hashed in a process pool that runs
+ahead of the encoder through a bounded window of --prefetch files. Workers stream each file back
+in PARSE_CHUNK-item chunks through a two-chunk queue, so parse memory stays bounded by
+prefetch * PARSE_CHUNK items however large one export is. Results are consumed in file
+order so `source_file::original_index` rows come out exactly as in a serial run.
+--quantize float16|int8 additionally writes a compact copy of the vectors for export
+(embeddings.f16.npy, or embeddings.int8.npy + embeddings.int8.params.npy holding per-dimension
+[scale, offset] so that row ~= codes * scale + offset).
+Near-duplicate passages (per-model variants, docx_tables_* re-extractions) are collapsed before
+encoding by a streaming MinHash/LSH stage (near_dup.py). The first copy keeps its row; later
+copies go to `output/aliases.json`, so their `source_file::original_index` ids still resolve
+through meta_store.rows_for(). --no-dedup keeps every copy.
+The bundled KB under app/src/main/assets/kb/ (`<行业>/<内容类型>/[<专业>/]<文档>/knowledge_base.json`,
+see KB_TAXONOMY_GUIDE.md) is ingested ahead of the tmp/ exports. Its rows keep the path relative to
+the KB root as `source_file` and the document directory as `taxonomy`, from which facets.py builds
+the filter bitmaps. Reading those files first makes the canonical copy of a shared passage the one
+that carries a taxonomy.
+Stage timings also go to telemetry.py: --trace appends per-file parse and per-batch encode /
+write spans as JSON lines, --metrics-out writes the stage histograms in the Prometheus text
+format at the end of the run, and --profile-hz samples the main process's stacks into
+output/profile.folded (parse workers are separate processes and are not sampled).
 """
-import json
+import argparse
 import os
 import glob
-from typing import List, Dict, Any
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import numpy as np
 
-try:
-    from sentence_transformers import SentenceTransformer
-except Exception as e:
-    raise SystemExit("Missing sentence-transformers. Install via requirements.txt")
+from ann_numpy import quantize_int8
+from batching import DEFAULT_TOKEN_BUDGET, encode_bucketed
+from embedding_cache import EmbeddingCache, content_key
+from encoder import BACKENDS, backend_from_env, encoder_id, load_encoder
+from index_io import fingerprint
+from kb_stream import JsonArrayWriter, NpyAppendWriter, iter_batches, iter_json_records
+from meta_store import ALIASES_NAME, MetaStoreWriter, input_names
+from near_dup import DEFAULT_THRESHOLD, NearDupIndex
+import telemetry
 
 ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 # Search both project-level `tmp/` and `build/tmp/` where existing exports live
 TMP_DIRS = [os.path.join(ROOT, 'tmp'), os.path.join(ROOT, 'build', 'tmp')]
+# bundled KB, one knowledge_base.json per taxonomy leaf (KB_TAXONOMY_GUIDE.md)
+KB_ROOT = os.path.join(ROOT, 'app', 'src', 'main', 'assets', 'kb')
+KB_FILE = 'knowledge_base.json'
 OUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
+CACHE_DIR = os.path.join(OUT_DIR, 'cache')
 os.makedirs(OUT_DIR, exist_ok=True)
 MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+EMB_DIM = 384
+# items per chunk a parse worker hands back to the encoder process
+PARSE_CHUNK = 512
+
 
+def load_model(backend=None, threads=None):
+    # imported lazily so parse worker processes never pay for torch / onnxruntime
+    try:
+        return load_encoder(MODEL_NAME, backend, threads)
+    except ImportError as e:
+        raise SystemExit(f"Missing {e.name}. Install via requirements.txt (onnxruntime for the onnx backends)")
 
-def discover_json_files(tmp_dirs: List[str]) -> List[str]:
+
+def discover_json_files(tmp_dirs: List[str], kb_root: Optional[str] = KB_ROOT) -> List[str]:
     patterns = ['*.json', '*.jsonl']
     files = []
     for d in tmp_dirs:
@@ -30,7 +86,24 @@ def discover_json_files(tmp_dirs: List[str]) -> List[str]:
             continue
         for p in patterns:
             files.extend(glob.glob(os.path.join(d, p)))
-    return sorted(files)
+    kb_files = sorted(glob.glob(os.path.join(kb_root, '**', KB_FILE), recursive=True)) if kb_root else []
+    return kb_files + sorted(files)
+
+
+def taxonomy_of(path: str) -> Optional[str]:
+    """'行业/内容类型[/专业]/文档' for a bundled KB file, None for tmp/ exports."""
+    try:
+        rel = os.path.relpath(path, KB_ROOT)
+    except ValueError:  # another drive on Windows
+        return None
+    if rel.startswith(os.pardir) or os.path.isabs(rel):
+        return None
+    return os.path.dirname(rel).replace(os.sep, '/') or None
+
+
+def source_name(path: str) -> str:
+    # bundled KB files all share one basename, so they are named by their path under the KB root
+    return os.path.relpath(path, KB_ROOT).replace(os.sep, '/') if taxonomy_of(path) else os.path.basename(path)
 
 
 def extract_text(obj: Any) -> str:
@@ -53,70 +126,324 @@ def extract_text(obj: Any) -> str:
     return ''
 
 
-def load_items_from_file(path: str) -> List[Dict[str, Any]]:
-    items = []
-    with open(path, 'r', encoding='utf-8') as f:
-        data = None
-        try:
-            data = json.load(f)
-        except Exception:
-            # try line-delimited JSONL
-            f.seek(0)
-            data = []
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                    data.append(obj)
-                except Exception:
-                    continue
-    if isinstance(data, dict):
-        # may be a root object with items under a key
-        # try to find array-like fields
-        for k, v in data.items():
-            if isinstance(v, list):
-                data = v
-                break
-    if not isinstance(data, list):
-        return []
-    for idx, el in enumerate(data):
+def iter_items_from_file(path: str) -> Iterator[Dict[str, Any]]:
+    # records are parsed incrementally; only one element is materialized at a time
+    source, taxonomy = source_name(path), taxonomy_of(path)
+    for idx, el in enumerate(iter_json_records(path)):
         text = extract_text(el)
         if not text:
             continue
-        items.append({
-            'source_file': os.path.basename(path),
+        item = {
+            'source_file': source,
             'original_index': idx,
             'title': (el.get('title') if isinstance(el, dict) else '') or '',
             'content': text
-        })
-    return items
+        }
+        if taxonomy:
+            item['taxonomy'] = taxonomy
+        yield item
+
+
+def load_items_from_file(path: str) -> List[Dict[str, Any]]:
+    return list(iter_items_from_file(path))
+
+
+def iter_all_items(tmp_dirs: List[str]) -> Iterator[Dict[str, Any]]:
+    for f in discover_json_files(tmp_dirs):
+        yield from iter_items_from_file(f)
 
 
 def collect_all_items(tmp_dirs: List[str]) -> List[Dict[str, Any]]:
-    files = discover_json_files(tmp_dirs)
-    all_items = []
-    for f in files:
-        all_items.extend(load_items_from_file(f))
-    return all_items
+    return list(iter_all_items(tmp_dirs))
+
+
+class StageStats:
+    """Per-stage item counts and busy seconds for the end-of-run throughput summary (and telemetry.py)."""
+
+    def __init__(self):
+        self.items: Dict[str, int] = {}
+        self.secs: Dict[str, float] = {}
+        self.t0 = time.perf_counter()
+
+    def add(self, stage: str, n: int, secs: float, trace: bool = True) -> None:
+        self.items[stage] = self.items.get(stage, 0) + n
+        self.secs[stage] = self.secs.get(stage, 0.0) + secs
+        # per-item callers pass trace=False: histograms only, no trace line per record
+        telemetry.record(stage, secs, n, trace=trace)
+
+    def report(self) -> str:
+        wall = time.perf_counter() - self.t0
+        lines = [f'Stage summary (wall {wall:.2f}s):']
+        for stage in ('parse', 'dedup', 'encode', 'write'):
+            if stage not in self.items:
+                continue
+            n, secs = self.items[stage], self.secs[stage]
+            rate = f'{n / secs:.1f} items/s' if secs > 0 else '-'
+            lines.append(f'  {stage:<8} items={n:<8} busy={secs:8.2f}s  {rate}')
+        if 'wait' in self.secs:
+            lines.append(f'  encoder stalled on parse for {self.secs["wait"]:.2f}s')
+        return '\n'.join(lines)
+
+
+def _parse_file(path: str, out, stop, chunk: int = PARSE_CHUNK) -> None:
+    """Put (items, keys, parse seconds) chunks of one file on queue `out`, then None.
+
+    `out` holds at most two chunks, so a worker that runs ahead blocks instead of buffering the
+    file. Setting the `stop` event ends the file early.
+    """
+    try:
+        items, keys = [], []
+        t0 = time.perf_counter()
+        for it in iter_items_from_file(path):
+            items.append(it)
+            keys.append(content_key(it['content']))
+            if len(items) >= chunk:
+                if stop.is_set():
+                    return
+                out.put((items, keys, time.perf_counter() - t0))
+                items, keys = [], []
+                # time spent blocked on a full queue is not parse time
+                t0 = time.perf_counter()
+        out.put((items, keys, time.perf_counter() - t0))
+    finally:
+        out.put(None)
+
+
+def iter_keyed_items(files: List[str], workers: int, prefetch: int,
+                     stats: StageStats) -> Iterator[Tuple[Dict[str, Any], str]]:
+    """Yield (item, content_key) in file order, parsing up to `prefetch` files ahead in a pool.
+
+    Workers hand items back in PARSE_CHUNK-sized chunks through bounded queues, so at most
+    about 2 * prefetch chunks are buffered.
+    """
+    if workers <= 0:
+        for path in files:
+            records = iter_items_from_file(path)
+            while True:
+                # time only the parser, not the consumer running between yields
+                t0 = time.perf_counter()
+                it = next(records, None)
+                key = content_key(it['content']) if it is not None else None
+                stats.add('parse', int(it is not None), time.perf_counter() - t0, trace=False)
+                if it is None:
+                    break
+                yield it, key
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool, Manager() as manager:
+        stop = manager.Event()
+
+        def submit(path):
+            out = manager.Queue(maxsize=2)
+            return pool.submit(_parse_file, path, out, stop), out
+
+        todo = iter(files[prefetch:])
+        pending = deque(submit(p) for p in files[:prefetch])
+        try:
+            while pending:
+                # tasks start in submission order, so the head file always has a worker
+                future, out = pending[0]
+                while True:
+                    t0 = time.perf_counter()
+                    chunk = out.get()
+                    stats.add('wait', 0, time.perf_counter() - t0)
+                    if chunk is None:
+                        break
+                    items, keys, secs = chunk
+                    stats.add('parse', len(items), secs)
+                    yield from zip(items, keys)
+                pending.popleft()
+                future.result()  # re-raise a worker's parse error
+                nxt = next(todo, None)
+                if nxt is not None:
+                    pending.append(submit(nxt))
+        finally:
+            # stopped early (error or consumer gone): let started workers finish their current
+            # chunk and drain them, so none is left blocked on a queue when the manager shuts down
+            stop.set()
+            for future, out in pending:
+                if not future.cancel():
+                    while out.get() is not None:
+                        pass
+
+
+def iter_canonical(pairs: Iterator[Tuple[Dict[str, Any], str]], dedup: NearDupIndex, on_alias,
+                   stats: StageStats, kept_keys: set) -> Iterator[Tuple[Dict[str, Any], str]]:
+    """Pass through the first item of each near-duplicate cluster; `on_alias(item, key, row, sim)` gets the rest.
+
+    `kept_keys` collects the content keys of the items passed through.
+    """
+    row = 0
+    for it, key in pairs:
+        t0 = time.perf_counter()
+        hit = dedup.add(row, it['content'])
+        stats.add('dedup', 1, time.perf_counter() - t0, trace=False)
+        if hit is not None:
+            on_alias(it, key, *hit)
+            continue
+        row += 1
+        kept_keys.add(key)
+        yield it, key
+
+
+def item_cost(pair: Tuple[Dict[str, Any], str]) -> int:
+    # rough resident bytes of one buffered item: utf-8 text plus its float32 vector
+    return len(pair[0]['content'].encode('utf-8')) + EMB_DIM * 4
+
+
+def write_quantized(out_dir: str, kind: str) -> str:
+    emb = np.load(os.path.join(out_dir, 'embeddings.npy'), mmap_mode='r')
+    if kind == 'float16':
+        path = os.path.join(out_dir, 'embeddings.f16.npy')
+        np.save(path, np.asarray(emb, dtype=np.float16))
+        return f'{path} ({os.path.getsize(path) / 2**20:.1f} MB)'
+    codes, scale, offset = quantize_int8(emb)
+    path = os.path.join(out_dir, 'embeddings.int8.npy')
+    np.save(path, codes)
+    np.save(os.path.join(out_dir, 'embeddings.int8.params.npy'), np.stack([scale, offset]))
+    return f'{path} ({os.path.getsize(path) / 2**20:.1f} MB)'
 
 
 def main():
-    print('Using model:', MODEL_NAME)
-    model = SentenceTransformer(MODEL_NAME)
-    items = collect_all_items(TMP_DIRS)
-    if not items:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--no-cache', action='store_true', help='ignore and do not update the embedding cache')
+    parser.add_argument('--batch-size', type=int, default=512,
+                        help='items pooled per encode window; split into length-bucketed sub-batches')
+    parser.add_argument('--token-budget', type=int, default=DEFAULT_TOKEN_BUDGET,
+                        help='max padded tokens per model forward pass')
+    parser.add_argument('--max-memory', type=float, default=None,
+                        help='cap (MB) on buffered batch text+vectors; shrinks batches when items are large')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help='parse processes (0 = parse inline, strictly record-by-record)')
+    parser.add_argument('--prefetch', type=int, default=None,
+                        help='files parsed ahead of the encoder (default: 2 * workers)')
+    parser.add_argument('--quantize', choices=('float16', 'int8'), default=None,
+                        help='also write a float16 / per-dimension int8 copy of embeddings.npy')
+    parser.add_argument('--backend', choices=BACKENDS, default=None,
+                        help='encoder backend (default: EMBED_BACKEND or torch; see encoder.py)')
+    parser.add_argument('--threads', type=int, default=None, help='encoder intra-op threads (default: EMBED_THREADS)')
+    parser.add_argument('--no-dedup', action='store_true', help='keep near-duplicate items as separate rows')
+    parser.add_argument('--dedup-threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='estimated Jaccard similarity of character 3-grams at which items are collapsed')
+    parser.add_argument('--trace', default=None, help='append per-stage spans to this JSON-lines file')
+    parser.add_argument('--metrics-out', default=None, help='write stage metrics (Prometheus text format) here')
+    parser.add_argument('--profile-hz', type=float, default=None,
+                        help='sample stacks at this rate into output/profile.folded')
+    args = parser.parse_args()
+    telemetry.configure(args.trace, args.profile_hz)
+    backend = args.backend or backend_from_env()
+    print('Using model:', MODEL_NAME, f'({backend})')
+    max_bytes = int(args.max_memory * 1024 * 1024) if args.max_memory else None
+    prefetch = args.prefetch or max(1, 2 * args.workers)
+    files = discover_json_files(TMP_DIRS)
+    cache = None if args.no_cache else EmbeddingCache(CACHE_DIR, encoder_id(MODEL_NAME, backend))
+    stats = StageStats()
+    model = None
+    live_keys = []
+    encoded = 0
+    emb_out = NpyAppendWriter(os.path.join(OUT_DIR, 'embeddings.npy'))
+    meta_out = JsonArrayWriter(os.path.join(OUT_DIR, 'metadata.json'))
+    store_out = MetaStoreWriter(OUT_DIR)
+    aliases_path = os.path.join(OUT_DIR, ALIASES_NAME)
+    dedup = None if args.no_dedup else NearDupIndex(args.dedup_threshold)
+    aliases_out = None if dedup is None else JsonArrayWriter(aliases_path)
+    kept_keys = set()
+    # aliases whose text would have gone to the encoder (not cached, not the same text as a kept row)
+    skipped = 0
+
+    def on_alias(it, key, row, sim):
+        nonlocal skipped
+        alias = {'source_file': it['source_file'], 'original_index': it['original_index'],
+                 'row': row, 'similarity': round(sim, 3)}
+        if it.get('taxonomy'):
+            # facets.py adds the alias's taxonomy to the canonical row
+            alias['taxonomy'] = it['taxonomy']
+        aliases_out.append(alias)
+        store_out.add_alias(it, row)
+        if key not in kept_keys and (cache is None or key not in cache):
+            skipped += 1
+
+    # root span: every stage record of this run shares its trace id
+    run_span = telemetry.span('ingest', files=len(files))
+    run_span.__enter__()
+    try:
+        pairs = iter_keyed_items(files, args.workers, prefetch, stats)
+        if dedup is not None:
+            pairs = iter_canonical(pairs, dedup, on_alias, stats, kept_keys)
+        for batch in iter_batches(pairs, args.batch_size, max_bytes, item_cost):
+            keys = [key for _, key in batch]
+            vecs = [cache.get(k) if cache is not None else None for k in keys]
+            # encode each distinct missing content once; cached rows are reused as-is
+            todo = {}
+            for (it, key), v in zip(batch, vecs):
+                if v is None and key not in todo:
+                    todo[key] = it['content']
+            if todo:
+                if model is None:
+                    model = load_model(backend, args.threads)
+                t0 = time.perf_counter()
+                fresh = encode_bucketed(model, list(todo.values()), token_budget=args.token_budget)
+                fresh = dict(zip(todo.keys(), np.asarray(fresh, dtype=np.float32)))
+                stats.add('encode', len(fresh), time.perf_counter() - t0)
+                encoded += len(fresh)
+                if cache is not None:
+                    for key, v in fresh.items():
+                        cache.put(key, v)
+                vecs = [fresh[k] if v is None else v for k, v in zip(keys, vecs)]
+            t0 = time.perf_counter()
+            emb_out.append(np.stack(vecs))
+            for it, _ in batch:
+                meta_out.append(it)
+                store_out.append(it)
+            stats.add('write', len(batch), time.perf_counter() - t0)
+            live_keys.extend(keys)
+            print(f'  {meta_out.count} items written ({encoded} encoded)', end='\r', flush=True)
+    except BaseException:
+        emb_out.abort()
+        meta_out.abort()
+        store_out.abort()
+        if aliases_out is not None:
+            aliases_out.abort()
+        if cache is not None:
+            cache.discard_pending()
+        run_span.__exit__(*sys.exc_info())
+        raise
+    run_span.set(items=meta_out.count)
+    run_span.__exit__(None, None, None)
+    if not meta_out.count:
+        emb_out.abort()
+        meta_out.abort()
+        store_out.abort()
+        if aliases_out is not None:
+            aliases_out.abort()
         print('No items found under', TMP_DIRS)
         return
-    contents = [it['content'] for it in items]
-    print(f'Found {len(contents)} items, computing embeddings...')
-    embeddings = model.encode(contents, show_progress_bar=True, batch_size=64)
-    emb = np.array(embeddings, dtype=np.float32)
-    np.save(os.path.join(OUT_DIR, 'embeddings.npy'), emb)
-    with open(os.path.join(OUT_DIR, 'metadata.json'), 'w', encoding='utf-8') as f:
-        json.dump(items, f, ensure_ascii=False, indent=2)
-    print('Saved embeddings (embeddings.npy) and metadata (metadata.json) in', OUT_DIR)
+    emb_out.close()
+    meta_out.close()
+    if aliases_out is not None:
+        aliases_out.close()
+    elif os.path.exists(aliases_path):
+        # a --no-dedup run keeps every row; stale aliases would point at the wrong rows
+        os.remove(aliases_path)
+    # the store records the final metadata.json (and aliases.json) so open_meta() knows it is current
+    store_out.close(fingerprint(OUT_DIR, input_names(OUT_DIR)))
+    print()
+    print(f'Saved {meta_out.count} embeddings (embeddings.npy) and metadata (metadata.json) in', OUT_DIR)
+    if dedup is not None:
+        print(f'Near-duplicates: collapsed {dedup.dups} of {dedup.seen} items ({dedup.ratio:.1%}) '
+              f'at similarity >= {dedup.threshold}; aliases in {ALIASES_NAME}')
+        rate = stats.secs.get('encode', 0.0) / encoded if encoded else None
+        saved = f', ~{skipped * rate:.2f}s of encoding at this run\'s rate' if rate else ''
+        print(f'  {skipped} texts not sent to the encoder{saved}')
+    if args.quantize:
+        print(f'Quantized ({args.quantize}):', write_quantized(OUT_DIR, args.quantize))
+    if cache is not None:
+        cache.save(live_keys)
+        print(cache.report())
+    print(stats.report())
+    if args.metrics_out:
+        with open(args.metrics_out, 'w', encoding='utf-8') as f:
+            f.write(telemetry.render())
+        print('Metrics written to', args.metrics_out)
 
 
 if __name__ == '__main__':
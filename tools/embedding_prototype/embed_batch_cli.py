@@ -1,26 +1,165 @@
 #!/usr/bin/env python3
 """
 A minimal CLI to compute embeddings for a batch JSON file.
-Usage: python embed_batch_cli.py /path/to/batch.json
+Usage: python embed_batch_cli.py /path/to/batch.json [--format json|f32|f16|msgpack]
 Batch JSON format: [{"id": "...", "content": "..."}, ...]
-Outputs JSON to stdout: {"results": {"id": [float,...], ...}}
+Outputs to stdout:
+  json (default)  {"results": {"id": [float,...], ...}}
+  f32 / f16       binary embeddings frame (see wire.py); f32 rows are `<id>.emb` bytes
+  msgpack         {"dim", "dtype", "results": {"id": <float32 bytes>}}
+
+--backend torch|onnx|onnx-int8 and --threads N pick the encoder (see encoder.py).
+
+Daemon mode loads the model once and answers many batches:
+  python embed_batch_cli.py --daemon                  newline-delimited requests on stdin
+  python embed_batch_cli.py --socket /tmp/embed.sock  same protocol over a Unix socket
+
+Request line: a batch array, or {"req": "<tag>", "items": [...], "format": "f32"}.
+Every response starts with one JSON header line:
+  {"req": ..., "format": "json", "results": {...}}        (json: results inline)
+  {"req": ..., "format": "f32", "bytes": N} + N bytes     (binary formats: payload follows)
+  {"req": ..., "error": "..."}                            (bad request; the daemon keeps running)
+The daemon writes {"ready": true, ...} once the model is loaded.
 """
+import argparse
+import os
+import socketserver
 import sys
 import json
-from sentence_transformers import SentenceTransformer
+import threading
+import time
+
+import wire
+from batching import encode_bucketed
+from encoder import BACKENDS, backend_from_env
+
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+
+
+def load_model(backend=None, threads=None):
+    from encoder import load_encoder
+    return load_encoder(MODEL_NAME, backend, threads)
+
+
+def embed_items(model, items):
+    texts = [it.get('content','') for it in items]
+    ids = [str(it.get('id','')) for it in items]
+    return ids, encode_bucketed(model, texts)
+
+
+def one_shot(args):
+    with open(args.batch_path, 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    ids, embs = embed_items(load_model(args.backend, args.threads), items)
+    if args.format != 'json':
+        body, _ = wire.encode_response(ids, embs, args.format)
+        sys.stdout.buffer.write(body)
+        sys.stdout.buffer.flush()
+    else:
+        results = {ids[i]: embs[i].tolist() for i in range(len(ids))}
+        print(json.dumps({'results': results}, ensure_ascii=False))
+
+
+def _header(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def handle_line(model, line: bytes, default_fmt: str, lock: threading.Lock) -> bytes:
+    """Encode one request line and return the framed response bytes."""
+    req = None
+    try:
+        msg = json.loads(line)
+        if isinstance(msg, list):
+            items, fmt = msg, default_fmt
+        else:
+            req = msg.get('req')
+            items, fmt = msg.get('items') or [], msg.get('format') or default_fmt
+        if fmt not in wire.FORMATS:
+            raise ValueError(f'unknown format {fmt!r}')
+        with lock:
+            ids, embs = embed_items(model, items)
+        if fmt == 'json':
+            return _header({'req': req, 'format': 'json', 'results': {ids[i]: embs[i].tolist() for i in range(len(ids))}})
+        body, _ = wire.encode_response(ids, embs, fmt)
+        return _header({'req': req, 'format': fmt, 'bytes': len(body)}) + body
+    except Exception as e:
+        return _header({'req': req, 'error': f'{type(e).__name__}: {e}'})
+
+
+def read_response(fin):
+    """Client side: (header, payload bytes or None) for the next framed response on `fin`."""
+    line = fin.readline()
+    if not line:
+        raise EOFError('embedding daemon closed the stream')
+    header = json.loads(line)
+    return header, (fin.read(header['bytes']) if 'bytes' in header else None)
+
+
+def serve_stream(model, fin, fout, default_fmt: str, lock: threading.Lock) -> int:
+    served = 0
+    for line in fin:
+        if not line.strip():
+            continue
+        fout.write(handle_line(model, line, default_fmt, lock))
+        fout.flush()
+        served += 1
+    return served
+
+
+def serve_socket(model, path: str, default_fmt: str, lock: threading.Lock):
+    if not hasattr(socketserver, 'UnixStreamServer'):
+        raise SystemExit('Unix sockets are not available on this platform; use --daemon (stdin) instead')
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve_stream(model, self.rfile, self.wfile, default_fmt, lock)
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(path):
+        os.remove(path)
+    with Server(path, Handler) as server:
+        print(f'listening on {path}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
+
 
-if len(sys.argv) < 2:
-    print('usage: embed_batch_cli.py batch.json', file=sys.stderr)
-    sys.exit(2)
+def main():
+    parser = argparse.ArgumentParser(usage='embed_batch_cli.py batch.json [--format ...] | --daemon | --socket PATH')
+    parser.add_argument('batch_path', nargs='?')
+    parser.add_argument('--format', choices=sorted(wire.FORMATS), default='json',
+                        help='output format (daemon: default for requests that do not name one)')
+    parser.add_argument('--daemon', action='store_true', help='serve newline-delimited requests from stdin')
+    parser.add_argument('--socket', help='serve requests on this Unix socket path')
+    parser.add_argument('--backend', choices=BACKENDS, default=None, help='encoder backend (default: EMBED_BACKEND or torch)')
+    parser.add_argument('--threads', type=int, default=None, help='intra-op threads (default: EMBED_THREADS)')
+    args = parser.parse_args()
+    if not (args.daemon or args.socket):
+        if not args.batch_path:
+            parser.error('batch.json is required unless --daemon or --socket is given')
+        one_shot(args)
+        return
 
-batch_path = sys.argv[1]
-with open(batch_path, 'r', encoding='utf-8') as f:
-    items = json.load(f)
+    out = sys.stdout.buffer
+    # library chatter must not corrupt the framed stream
+    sys.stdout = sys.stderr
+    t0 = time.perf_counter()
+    model = load_model(args.backend, args.threads)
+    # first encode initializes torch kernels; pay it before announcing readiness
+    encode_bucketed(model, ['warmup'])
+    ready = {'ready': True, 'model': MODEL_NAME, 'backend': args.backend or backend_from_env(), 'load_ms': round((time.perf_counter() - t0) * 1000, 1)}
+    lock = threading.Lock()
+    if args.socket:
+        print(json.dumps(ready), file=sys.stderr)
+        serve_socket(model, args.socket, args.format, lock)
+    else:
+        out.write(_header(ready))
+        out.flush()
+        serve_stream(model, sys.stdin.buffer, out, args.format, lock)
 
-model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-texts = [it.get('content','') for it in items]
-ids = [str(it.get('id','')) for it in items]
-embs = model.encode(texts, show_progress_bar=False)
 
-results = {ids[i]: embs[i].tolist() for i in range(len(ids))}
-print(json.dumps({'results': results}, ensure_ascii=False))
+if __name__ == '__main__':
+    main()
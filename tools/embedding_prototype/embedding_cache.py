@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Persistent, content-hashed embedding cache used by compute_embeddings.py.
+
+Vectors are keyed by model name + sha256 of the normalized item content, so an
+unchanged item reuses its stored vector across runs and only new/changed items
+are sent to the encoder. Layout under `output/cache/`:
+  <model-slug>.f32   raw float32 rows (little-endian, row-major)
+  <model-slug>.json  {"model": ..., "dim": ..., "keys": [...]} (keys in row order)
+Vectors added during a run are spilled to `<model-slug>.f32.new` rather than held in memory.
+"""
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+_WS_RE = re.compile(r'\s+')
+
+
+def normalize_content(text: str) -> str:
+    # NFKC folds full-width punctuation/digits common in the KB exports
+    text = unicodedata.normalize('NFKC', text or '')
+    return _WS_RE.sub(' ', text).strip()
+
+
+def content_key(text: str) -> str:
+    return hashlib.sha256(normalize_content(text).encode('utf-8')).hexdigest()
+
+
+def model_slug(model_name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: str, model_name: str):
+        self.model_name = model_name
+        slug = model_slug(model_name)
+        self.vec_path = os.path.join(cache_dir, slug + '.f32')
+        self.index_path = os.path.join(cache_dir, slug + '.json')
+        self.dim: Optional[int] = None
+        self._rows: Dict[str, int] = {}
+        self._stored = None
+        self._new: Dict[str, int] = {}
+        self._new_f = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not (os.path.exists(self.index_path) and os.path.exists(self.vec_path)):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                idx = json.load(f)
+        except Exception:
+            return
+        keys = idx.get('keys') or []
+        dim = idx.get('dim')
+        if idx.get('model') != self.model_name or not dim or not keys:
+            return
+        if os.path.getsize(self.vec_path) != len(keys) * dim * 4:
+            # torn write or foreign file: ignore rather than serve wrong vectors
+            return
+        self.dim = int(dim)
+        self._rows = {k: i for i, k in enumerate(keys)}
+        self._stored = np.memmap(self.vec_path, dtype='<f4', mode='r', shape=(len(keys), self.dim))
+
+    def __len__(self):
+        return len(self._rows) + len(self._new)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._new or key in self._rows
+
+    def _read_new(self, row: int) -> np.ndarray:
+        self._new_f.flush()
+        self._new_f.seek(row * self.dim * 4)
+        v = np.frombuffer(self._new_f.read(self.dim * 4), dtype='<f4')
+        self._new_f.seek(0, os.SEEK_END)
+        return v
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        v = None
+        if key in self._new:
+            v = self._read_new(self._new[key])
+        elif key in self._rows:
+            v = np.asarray(self._stored[self._rows[key]])
+        if v is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return v
+
+    def put(self, key: str, vec) -> None:
+        vec = np.asarray(vec, dtype=np.float32).reshape(-1)
+        if self.dim is None:
+            self.dim = int(vec.shape[0])
+        elif vec.shape[0] != self.dim:
+            raise ValueError(f'cache dim mismatch: {vec.shape[0]} != {self.dim}')
+        if key in self._new:
+            return
+        if self._new_f is None:
+            self._new_f = open(self.vec_path + '.new', 'w+b')
+        self._new[key] = len(self._new)
+        self._new_f.write(vec.astype('<f4').tobytes())
+
+    def save(self, live_keys: Iterable[str]) -> None:
+        """Persist vectors for `live_keys` only; everything else is evicted."""
+        if self.dim is None:
+            return
+        live: List[str] = []
+        seen = set()
+        for k in live_keys:
+            if k in seen or k not in self:
+                continue
+            seen.add(k)
+            live.append(k)
+        self.evictions = sum(1 for k in self._rows if k not in seen)
+        tmp_vec = self.vec_path + '.tmp'
+        with open(tmp_vec, 'wb') as f:
+            for k in live:
+                if k in self._new:
+                    v = self._read_new(self._new[k])
+                else:
+                    v = self._stored[self._rows[k]]
+                f.write(np.asarray(v, dtype='<f4').tobytes())
+        tmp_idx = self.index_path + '.tmp'
+        with open(tmp_idx, 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model_name, 'dim': self.dim, 'keys': live}, f)
+        # release the old mapping before replacing the file (required on Windows)
+        self._stored = None
+        os.replace(tmp_vec, self.vec_path)
+        os.replace(tmp_idx, self.index_path)
+        self._rows = {k: i for i, k in enumerate(live)}
+        self.discard_pending()
+        if live:
+            self._stored = np.memmap(self.vec_path, dtype='<f4', mode='r', shape=(len(live), self.dim))
+
+    def discard_pending(self) -> None:
+        self._new = {}
+        if self._new_f is not None:
+            self._new_f.close()
+            self._new_f = None
+            try:
+                os.remove(self.vec_path + '.new')
+            except OSError:
+                pass
+
+    def report(self) -> str:
+        return f'cache hits={self.hits} misses={self.misses} evictions={self.evictions}'
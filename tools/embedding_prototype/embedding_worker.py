@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Pipelined embedding worker engine (the dev-machine counterpart of Android's EmbeddingWorker).
+
+Pending `{"id", "content"}` files are chunked into batches bounded by item count and bytes.
+Up to `in_flight` batches are posted concurrently over one pooled keep-alive
+requests.Session, asking for float32 frames (wire.py). Each batch is handled as soon as its
+response arrives: the vectors are appended to the VectorStore, then that batch's pending
+files are removed. One failed batch never discards the work of the others.
+
+Transient failures (connection errors, timeouts, 5xx, 503 with Retry-After) are retried
+with exponential backoff and jitter. Items still failing stay pending and are counted in the
+checkpoint; after `max_attempts` runs they are moved to `pending/failed/`.
+
+Crash safety: before a batch's pending files are removed, `worker_checkpoint.json` records
+the content keys it stored. On startup a pending file matching such a record is just removed
+(the crash hit between store and cleanup); anything else, including a re-queued id with new
+content, is embedded again. The checkpoint also carries cumulative counters and per-item
+attempts.
+Metrics are appended as JSON lines {"ts", "processed", "failures", "pid"} to
+`embedding_worker_metrics.log`, like the Android worker.
+"""
+import json
+import os
+import random
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+import wire
+from embedding_cache import content_key
+from kb_stream import iter_batches
+from vector_store import VectorStore
+
+DEFAULT_URL = 'http://127.0.0.1:8000/embed_batch'
+METRICS_NAME = 'embedding_worker_metrics.log'
+CHECKPOINT_NAME = 'worker_checkpoint.json'
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+Item = Tuple[str, str, str]  # (id, content, pending file path)
+
+
+class RetryableError(Exception):
+    def __init__(self, msg: str, retry_after: Optional[float] = None):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+class EmbeddingWorker:
+    def __init__(self, base_dir: str, url: str = DEFAULT_URL, batch_size: int = 32, max_bytes: int = 256 << 10,
+                 in_flight: int = 4, retries: int = 4, backoff: float = 0.5, max_backoff: float = 30.0,
+                 timeout: float = 60.0, max_attempts: int = 5, store: Optional[VectorStore] = None):
+        self.base_dir = base_dir
+        self.pending_dir = os.path.join(base_dir, 'pending')
+        self.failed_dir = os.path.join(self.pending_dir, 'failed')
+        self.url = url
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.in_flight = max(1, in_flight)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.store = store if store is not None else VectorStore(os.path.join(base_dir, 'store'))
+        self.metrics_path = os.path.join(base_dir, METRICS_NAME)
+        self.checkpoint_path = os.path.join(base_dir, CHECKPOINT_NAME)
+        self.checkpoint = self._load_checkpoint()
+        self.processed = 0
+        self.failures = 0
+        self.retried = 0
+        self.session = requests.Session()
+        # one keep-alive connection per in-flight batch
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    # -- checkpoint / metrics --------------------------------------------------------------
+    def _load_checkpoint(self) -> Dict:
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return {'processed': 0, 'failures': 0, 'attempts': {}}
+
+    def _save_checkpoint(self) -> None:
+        self.checkpoint['updated'] = int(time.time() * 1000)
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.checkpoint, f, ensure_ascii=False)
+        os.replace(tmp, self.checkpoint_path)
+
+    def _write_metrics(self, start_ms: int) -> None:
+        entry = {'ts': start_ms, 'processed': self.processed, 'failures': self.failures, 'pid': os.getpid()}
+        with open(self.metrics_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    # -- pending items ---------------------------------------------------------------------
+    def _fail_file(self, path: str) -> None:
+        os.makedirs(self.failed_dir, exist_ok=True)
+        try:
+            shutil.move(path, os.path.join(self.failed_dir, os.path.basename(path)))
+        except OSError:
+            pass
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def iter_pending(self) -> Iterator[Item]:
+        """Pending items oldest first, skipping (and clearing) items an interrupted run already stored."""
+        if not os.path.isdir(self.pending_dir):
+            return
+        entries = [e for e in os.scandir(self.pending_dir) if e.is_file() and e.name.endswith('.json')]
+        attempts = self.checkpoint.setdefault('attempts', {})
+        stored = self.checkpoint.setdefault('stored', {})
+        for e in sorted(entries, key=lambda e: e.stat().st_mtime):
+            try:
+                with open(e.path, 'r', encoding='utf-8') as f:
+                    obj = json.load(f)
+                id_, content = str(obj.get('id', '')), obj.get('content') or ''
+            except Exception:
+                self.failures += 1
+                self._fail_file(e.path)
+                continue
+            if not id_ or not content.strip():
+                self.failures += 1
+                self._fail_file(e.path)
+                continue
+            if stored.pop(id_, None) == content_key(content) and id_ in self.store:
+                # embedded before a crash, pending file not yet removed
+                self._remove(e.path)
+                attempts.pop(id_, None)
+                continue
+            if attempts.get(id_, 0) >= self.max_attempts:
+                self.failures += 1
+                self._fail_file(e.path)
+                attempts.pop(id_, None)
+                continue
+            yield id_, content, e.path
+        # whatever is left was cleaned up before the crash; this run's batches clear their own
+        stored.clear()
+
+    # -- HTTP ------------------------------------------------------------------------------
+    def _post_once(self, batch: List[Item]) -> Dict[str, np.ndarray]:
+        body = [{'id': id_, 'content': content} for id_, content, _ in batch]
+        try:
+            resp = self.session.post(self.url, json=body, timeout=self.timeout,
+                                     headers={'Accept': f'{wire.F32_TYPE}, {wire.JSON_TYPE};q=0.5'})
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryableError(str(e))
+        if resp.status_code in RETRY_STATUS:
+            retry_after = resp.headers.get('Retry-After')
+            raise RetryableError(f'HTTP {resp.status_code}', float(retry_after) if retry_after else None)
+        resp.raise_for_status()
+        if resp.headers.get('content-type', '').startswith(wire.F32_TYPE):
+            return {id_: np.frombuffer(row, dtype='<f4') for id_, row in wire.iter_frame(resp.content)}
+        return {k: np.asarray(v, dtype='<f4') for k, v in resp.json().get('results', {}).items()}
+
+    def post(self, batch: List[Item]) -> Dict[str, np.ndarray]:
+        """POST one batch, retrying transient failures with exponential backoff + jitter."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self._post_once(batch)
+            except RetryableError as e:
+                if attempt == self.retries:
+                    raise
+                self.retried += 1
+                delay = min(self.max_backoff, self.backoff * (2 ** attempt)) * (0.5 + random.random())
+                time.sleep(max(delay, e.retry_after or 0.0))
+        raise AssertionError('unreachable')
+
+    # -- pipeline --------------------------------------------------------------------------
+    def _complete(self, batch: List[Item], results: Optional[Dict[str, np.ndarray]], error: Optional[Exception]) -> None:
+        attempts = self.checkpoint.setdefault('attempts', {})
+        done = [(id_, content, path) for id_, content, path in batch if results and id_ in results]
+        if done:
+            # store, checkpoint what was stored, then drop the pending files: a crash in between
+            # leaves files whose id and content key the next run recognises and just removes
+            self.store.append([id_ for id_, _, _ in done], np.stack([results[id_] for id_, _, _ in done]))
+            stored = self.checkpoint.setdefault('stored', {})
+            stored.update((id_, content_key(content)) for id_, content, _ in done)
+            self._save_checkpoint()
+            for id_, _, path in done:
+                self._remove(path)
+                attempts.pop(id_, None)
+                stored.pop(id_, None)
+        missing = [id_ for id_, _, _ in batch if not results or id_ not in results]
+        for id_ in missing:
+            attempts[id_] = attempts.get(id_, 0) + 1
+        if error is not None:
+            print(f'batch of {len(batch)} failed: {error}')
+        self.processed += len(done)
+        self.failures += len(missing)
+        self.checkpoint['processed'] = self.checkpoint.get('processed', 0) + len(done)
+        self.checkpoint['failures'] = self.checkpoint.get('failures', 0) + len(missing)
+        self._save_checkpoint()
+
+    def run(self) -> Dict:
+        start_ms = int(time.time() * 1000)
+        t0 = time.perf_counter()
+        batches = iter_batches(self.iter_pending(), self.batch_size, self.max_bytes,
+                               size_of=lambda it: len(it[1].encode('utf-8')))
+        n_batches = 0
+        with ThreadPoolExecutor(max_workers=self.in_flight, thread_name_prefix='embed-post') as pool:
+            running = {}
+            for batch in batches:
+                # bounded pipeline: reading/chunking waits while `in_flight` posts are outstanding
+                while len(running) >= self.in_flight:
+                    self._drain(running, wait(running, return_when=FIRST_COMPLETED).done)
+                running[pool.submit(self.post, batch)] = batch
+                n_batches += 1
+            while running:
+                self._drain(running, wait(running, return_when=FIRST_COMPLETED).done)
+        self._save_checkpoint()
+        self._write_metrics(start_ms)
+        return {'processed': self.processed, 'failures': self.failures, 'batches': n_batches,
+                'retries': self.retried, 'seconds': round(time.perf_counter() - t0, 3)}
+
+    def _drain(self, running: Dict, done) -> None:
+        for fut in done:
+            batch = running.pop(fut)
+            try:
+                self._complete(batch, fut.result(), None)
+            except Exception as e:
+                self._complete(batch, None, e)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Pluggable sentence encoder backends for the MiniLM model.
+
+  torch      SentenceTransformer on PyTorch (default)
+  onnx       the same transformer exported to ONNX, run by ONNX Runtime
+  onnx-int8  the ONNX graph with dynamic int8 weight quantization
+
+`load_encoder()` picks the backend from its argument or EMBED_BACKEND, and the intra-op thread
+count from EMBED_THREADS (0 = library default). The ONNX backends need only `onnxruntime`,
+`tokenizers` and numpy at run time, so they skip the torch import entirely. Exporting needs
+torch and `onnx`; it runs once, automatically on first use or via `encoder.py export`, and
+writes output/onnx/<model>/ (model.onnx, model.int8.onnx, tokenizer.json, encoder.json).
+Pooling and normalization are read from the SentenceTransformer modules and replayed in numpy.
+
+The returned object implements the subset of SentenceTransformer the scripts use: `encode()`,
+`tokenizer`, `max_seq_length` and `get_sentence_embedding_dimension()`.
+
+Parity / throughput check against the PyTorch vectors:
+  python encoder.py export --quantize
+  python encoder.py check --backends torch,onnx,onnx-int8 --threads 1,4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from embedding_cache import model_slug
+
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+ONNX_DIR = os.path.join(os.path.dirname(__file__), 'output', 'onnx')
+CONFIG_NAME = 'encoder.json'
+OPSET = 17
+MIN_COSINE = 0.99
+
+
+def backend_from_env() -> str:
+    return os.environ.get('EMBED_BACKEND', 'torch')
+
+
+def threads_from_env() -> Optional[int]:
+    return int(os.environ.get('EMBED_THREADS', 0)) or None
+
+
+def model_dir(model_name: str = MODEL_NAME, onnx_dir: str = ONNX_DIR) -> str:
+    return os.path.join(onnx_dir, model_slug(model_name))
+
+
+def onnx_path(model_name: str = MODEL_NAME, quantized: bool = False, onnx_dir: str = ONNX_DIR) -> str:
+    return os.path.join(model_dir(model_name, onnx_dir), 'model.int8.onnx' if quantized else 'model.onnx')
+
+
+def encoder_id(model_name: str, backend: str) -> str:
+    """Name for vector caches: int8 weights change the vectors, the float32 ONNX graph does not."""
+    return model_name + '@int8' if backend == 'onnx-int8' else model_name
+
+
+_POOLING_KEYS = {'mean': 'pooling_mode_mean_tokens', 'cls': 'pooling_mode_cls_token', 'max': 'pooling_mode_max_tokens'}
+
+
+def _pooling_mode(st) -> str:
+    for module in st:
+        if type(module).__name__ == 'Pooling':
+            cfg = module.get_config_dict()
+            # newer sentence-transformers name the mode; older ones set one boolean per mode
+            if cfg.get('pooling_mode') in _POOLING_KEYS:
+                return cfg['pooling_mode']
+            for mode, key in _POOLING_KEYS.items():
+                if cfg.get(key):
+                    return mode
+    raise ValueError('unsupported pooling configuration; expected mean, cls or max pooling')
+
+
+def export_onnx(model_name: str = MODEL_NAME, quantize: bool = False, onnx_dir: str = ONNX_DIR) -> str:
+    """Export the transformer of `model_name` to ONNX (and its int8 variant with `quantize`); returns the dir."""
+    out = model_dir(model_name, onnx_dir)
+    fp32 = onnx_path(model_name, False, onnx_dir)
+    if not os.path.exists(fp32):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        st = SentenceTransformer(model_name, device='cpu')
+        hf = st[0].auto_model.eval()
+        tok = st.tokenizer
+        os.makedirs(out, exist_ok=True)
+        tok.save_pretrained(out)
+        sample = tok(['export sample', '导出 样例'], padding=True, return_tensors='pt')
+        names = [n for n in ('input_ids', 'attention_mask', 'token_type_ids') if n in sample]
+        axes = {n: {0: 'batch', 1: 'seq'} for n in names}
+        axes['last_hidden_state'] = {0: 'batch', 1: 'seq'}
+
+        class Wrapper(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, *inputs):
+                return self.model(**dict(zip(names, inputs)))[0]
+
+        kwargs = dict(input_names=names, output_names=['last_hidden_state'], dynamic_axes=axes, opset_version=OPSET)
+        tmp = fp32 + '.tmp'
+        with torch.no_grad():
+            try:
+                # the TorchScript exporter handles dynamic_axes without onnxscript
+                torch.onnx.export(Wrapper(hf), tuple(sample[n] for n in names), tmp, dynamo=False, **kwargs)
+            except TypeError:
+                torch.onnx.export(Wrapper(hf), tuple(sample[n] for n in names), tmp, **kwargs)
+        os.replace(tmp, fp32)
+        config = {'model': model_name, 'pooling': _pooling_mode(st),
+                  'normalize': any(type(m).__name__ == 'Normalize' for m in st),
+                  'max_seq_length': int(st.max_seq_length), 'dim': int(st.get_sentence_embedding_dimension()),
+                  'pad_id': int(tok.pad_token_id or 0), 'inputs': names, 'opset': OPSET}
+        with open(os.path.join(out, CONFIG_NAME), 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2)
+    int8 = onnx_path(model_name, True, onnx_dir)
+    if quantize and not os.path.exists(int8):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32, int8 + '.tmp', weight_type=QuantType.QInt8)
+        os.replace(int8 + '.tmp', int8)
+    return out
+
+
+class _Tokenizer:
+    """Callable like a HF tokenizer for batching.token_lengths(): returns {'input_ids': [...]}."""
+
+    def __init__(self, tok):
+        self._tok = tok
+
+    def __call__(self, texts, add_special_tokens: bool = True, **_):
+        return {'input_ids': [e.ids for e in self._tok.encode_batch(list(texts), add_special_tokens=add_special_tokens)]}
+
+
+class OnnxEncoder:
+    def __init__(self, path: str, threads: Optional[int] = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        d = os.path.dirname(path)
+        with open(os.path.join(d, CONFIG_NAME), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        self.max_seq_length = self.config['max_seq_length']
+        tok = Tokenizer.from_file(os.path.join(d, 'tokenizer.json'))
+        tok.no_padding()
+        tok.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer = _Tokenizer(tok)
+        self._tok = tok
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads or 0
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, opts, providers=['CPUExecutionProvider'])
+        self._inputs = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config['dim']
+
+    def _feeds(self, texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        encs = self._tok.encode_batch(list(texts))
+        width = max(len(e.ids) for e in encs)
+        ids = np.full((len(encs), width), self.config['pad_id'], dtype=np.int64)
+        mask = np.zeros((len(encs), width), dtype=np.int64)
+        types = np.zeros((len(encs), width), dtype=np.int64)
+        for r, e in enumerate(encs):
+            n = len(e.ids)
+            ids[r, :n] = e.ids
+            mask[r, :n] = 1
+            types[r, :n] = e.type_ids
+        feeds = {'input_ids': ids, 'attention_mask': mask, 'token_type_ids': types}
+        return {name: feeds[name] for name in self._inputs}
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        mode = self.config['pooling']
+        if mode == 'cls':
+            return hidden[:, 0]
+        m = mask[:, :, None].astype(np.float32)
+        if mode == 'max':
+            return np.where(m > 0, hidden, -1e9).max(axis=1)
+        return (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = False, **_) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.zeros((len(texts), self.config['dim']), dtype=np.float32)
+        for start in range(0, len(texts), max(1, batch_size)):
+            feeds = self._feeds(texts[start:start + batch_size])
+            hidden = self.session.run(None, feeds)[0]
+            out[start:start + len(hidden)] = self._pool(hidden, feeds['attention_mask'])
+        if self.config['normalize'] or normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+
+def load_encoder(model_name: str = MODEL_NAME, backend: Optional[str] = None, threads: Optional[int] = None,
+                 onnx_dir: str = ONNX_DIR):
+    """SentenceTransformer-compatible encoder for `backend` (default: EMBED_BACKEND, else torch)."""
+    backend = backend or backend_from_env()
+    threads = threads if threads is not None else threads_from_env()
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown encoder backend {backend!r}; expected one of {BACKENDS}')
+    if backend == 'torch':
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name)
+    quantized = backend == 'onnx-int8'
+    path = onnx_path(model_name, quantized, onnx_dir)
+    if not os.path.exists(path):
+        print(f'exporting {model_name} to ONNX ({backend}) under {model_dir(model_name, onnx_dir)}', file=sys.stderr)
+        export_onnx(model_name, quantized, onnx_dir)
+    return OnnxEncoder(path, threads)
+
+
+def _sample_texts(n: int) -> List[str]:
+    meta_path = os.path.join(os.path.dirname(__file__), 'output', 'metadata.json')
+    texts: List[str] = []
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            texts = [m.get('content') or '' for m in json.load(f) if (m.get('content') or '').strip()]
+    if not texts:
+        texts = ['变压器 故障 处理', '继电保护 定值 整定', '接触网 检修 作业', '高铁电力电缆贯通线路 寿命管理']
+    return [texts[i % len(texts)] for i in range(n)]
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return x / np.clip(np.linalg.norm(x, axis=1, keepdims=True), 1e-12, None)
+
+
+def check(backends: Sequence[str], threads: Sequence[int], samples: int, batch: int, model_name: str) -> bool:
+    """Print throughput per backend/thread count and cosine parity against torch; False if parity fails."""
+    from batching import encode_bucketed
+    texts = _sample_texts(samples)
+    ref = _unit(encode_bucketed(load_encoder(model_name, 'torch'), texts, max_batch=batch))
+    ok = True
+    print(f'{samples} texts, length-bucketed batches of <= {batch}; cosine vs torch (pass >= {MIN_COSINE})')
+    print(f"{'backend':<10} {'threads':>7} {'load s':>7} {'texts/s':>9} {'min cos':>8} {'mean cos':>9}")
+    for backend in backends:
+        for n in threads:
+            t0 = time.perf_counter()
+            model = load_encoder(model_name, backend, n)
+            load_s = time.perf_counter() - t0
+            encode_bucketed(model, texts[:batch])
+            t0 = time.perf_counter()
+            vecs = encode_bucketed(model, texts, max_batch=batch)
+            rate = len(texts) / (time.perf_counter() - t0)
+            cos = (ref * _unit(vecs)).sum(axis=1)
+            ok = ok and bool(cos.min() >= MIN_COSINE)
+            print(f'{backend:<10} {n or "auto":>7} {load_s:7.2f} {rate:9.1f} {cos.min():8.4f} {cos.mean():9.4f}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the encoder to ONNX and compare backends')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('export', help='write output/onnx/<model>/model.onnx')
+    p.add_argument('--model', default=MODEL_NAME)
+    p.add_argument('--quantize', action='store_true', help='also write the dynamic int8 model')
+    p = sub.add_parser('check', help='parity and throughput of each backend against torch')
+    p.add_argument('--model', default=MODEL_NAME)
+    p.add_argument('--backends', default=','.join(BACKENDS))
+    p.add_argument('--threads', default='0', help='comma-separated intra-op thread counts (0 = default)')
+    p.add_argument('--samples', type=int, default=256)
+    p.add_argument('--batch', type=int, default=32)
+    args = parser.parse_args()
+    if args.cmd == 'export':
+        print('wrote', export_onnx(args.model, args.quantize))
+        return
+    ok = check([b.strip() for b in args.backends.split(',') if b.strip()],
+               [int(t) for t in args.threads.split(',')], args.samples, args.batch, args.model)
+    if not ok:
+        raise SystemExit(f'parity check failed: cosine below {MIN_COSINE}')
+
+
+if __name__ == '__main__':
+    main()
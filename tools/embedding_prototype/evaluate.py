@@ -14,69 +14,50 @@ Gold identifiers use metadata `source_file::original_index` which is emitted by
 
 Usage:
   python evaluate.py --eval eval_dataset.json --k 10
+  python evaluate.py --eval eval_dataset.json --quantized [--rescore 4]
+
+--quantized compares ANN Recall@k/MRR and vector memory of float32 against float16 and
+per-dimension int8 vectors (ann_numpy.py), each with and without float32 re-scoring.
 """
 import argparse
 import json
 import os
+import time
 import numpy as np
-from collections import defaultdict
+
+from fusion import rank_merge
+from retriever import Retriever
 
 OUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
 EMB_PATH = os.path.join(OUT_DIR, 'embeddings.npy')
-META_PATH = os.path.join(OUT_DIR, 'metadata.json')
-NN_PKL = os.path.join(OUT_DIR, 'nn_model.pkl')
-
-if not os.path.exists(META_PATH):
-    raise SystemExit('Run compute_embeddings.py first')
-
-with open(META_PATH, 'r', encoding='utf-8') as f:
-    meta = json.load(f)
 
-id_map = [f"{m.get('source_file')}::{m.get('original_index')}" for m in meta]
+# metadata, indexes and the query model (EMBED_BACKEND, see encoder.py) load on first use
+retriever = Retriever(OUT_DIR)
 
-# Load embeddings and NN if available
-emb = None
-nn = None
-if os.path.exists(EMB_PATH):
-    emb = np.load(EMB_PATH)
-if os.path.exists(NN_PKL):
-    import pickle
-    with open(NN_PKL,'rb') as f:
-        nn = pickle.load(f)
 
-from sentence_transformers import SentenceTransformer
-MODEL = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+def encode(texts):
+    return retriever.model.encode(list(texts), batch_size=64, show_progress_bar=False)
 
 
 def lexical_search(q, k):
-    qn = q.lower().strip()
-    hits = []
-    for i,m in enumerate(meta):
-        text = (m.get('content','') + ' ' + (m.get('title') or '')).lower()
-        if qn in text:
-            hits.append(i)
-    return hits[:k]
+    return [idx for idx, _ in retriever.lex_index.search(q, k)]
 
 
 def ann_search(q, k):
-    if nn is None:
-        return []
-    q_emb = MODEL.encode([q])
-    dists, idxs = nn.kneighbors(q_emb, n_neighbors=k)
-    return [int(x) for x in idxs[0]]
+    return ann_search_batch([q], k)[0]
+
+
+def ann_search_batch(queries, k, q_embs=None):
+    """Top-k ANN rows for every query: one batched encode and one matrix search for the set."""
+    if retriever.searcher is None or not queries:
+        return [[] for _ in queries]
+    if q_embs is None:
+        q_embs = encode(queries)
+    return [[idx for idx, _ in hits] for hits in retriever.ann(q_embs, k)]
 
 
 def hybrid_search(q, k):
-    ann = ann_search(q, k*2)
-    lex = lexical_search(q, k*2)
-    # simple merge giving lex higher weight
-    score = defaultdict(float)
-    for i,idx in enumerate(ann):
-        score[idx] += 1.0/(i+1)
-    for i,idx in enumerate(lex):
-        score[idx] += 2.0/(i+1)
-    ordered = sorted(score.items(), key=lambda x: x[1], reverse=True)
-    return [idx for idx,_ in ordered][:k]
+    return rank_merge(ann_search(q, k*2), lexical_search(q, k*2), k)
 
 
 def recall_at_k(preds, golds):
@@ -95,35 +76,34 @@ def mrr(preds, golds):
 
 
 def parse_gold_list(gold_list):
-    # gold_list are identifiers like 'file.json::3'
+    # gold_list are identifiers like 'file.json::3'; the same file name may appear under tmp/ and build/tmp/,
+    # so one id can map to several metadata rows
     idxs = set()
     for g in gold_list:
-        if '::' in g:
-            try:
-                f, oi = g.split('::',1)
-                oi = int(oi)
-                # find matching indices in meta
-                for i,m in enumerate(meta):
-                    if m.get('source_file')==f and int(m.get('original_index'))==oi:
-                        idxs.add(i)
-            except Exception:
-                continue
+        idxs.update(retriever.meta.rows_for(g))
     return idxs
 
 
-def evaluate(eval_path, k=10):
+def load_cases(eval_path):
     with open(eval_path,'r',encoding='utf-8') as f:
         data = json.load(f)
     queries = data.get('queries', [])
+    cases = [(q.get('query'), parse_gold_list(q.get('gold',[]))) for q in queries]
+    return [(qq, golds) for qq, golds in cases if golds]
+
+
+def evaluate(eval_path, k=10):
+    t0 = time.perf_counter()
+    cases = load_cases(eval_path)
+    texts = [qq for qq,_ in cases]
+    # encode once, then one matrix search per depth (k for ANN, 2k for the hybrid merge)
+    q_embs = encode(texts) if (texts and retriever.searcher is not None) else None
+    ann_k = ann_search_batch(texts, k, q_embs)
+    ann_2k = ann_search_batch(texts, k*2, q_embs)
     results = {'lexical':[], 'ann':[], 'hybrid':[]}
-    for q in queries:
-        qq = q.get('query')
-        golds = parse_gold_list(q.get('gold',[]))
-        if not golds:
-            continue
+    for (qq, golds), ann_p, ann_wide in zip(cases, ann_k, ann_2k):
         lex_p = lexical_search(qq, k)
-        ann_p = ann_search(qq, k)
-        hyb_p = hybrid_search(qq, k)
+        hyb_p = rank_merge(ann_wide, lexical_search(qq, k*2), k)
         results['lexical'].append((recall_at_k(lex_p, golds), mrr(lex_p, golds)))
         results['ann'].append((recall_at_k(ann_p, golds), mrr(ann_p, golds)))
         results['hybrid'].append((recall_at_k(hyb_p, golds), mrr(hyb_p, golds)))
@@ -136,11 +116,49 @@ def evaluate(eval_path, k=10):
         recalls = [a for a,_ in arr]
         mrrs = [b for _,b in arr]
         print(f"{name}: Recall@{k}={np.mean(recalls):.4f}  MRR={np.mean(mrrs):.4f}  n={len(arr)}")
+    print(f'evaluated {len(cases)} queries in {time.perf_counter() - t0:.2f}s')
+
+
+def evaluate_quantized(eval_path, k=10, rescore=4):
+    import ann_numpy
+    if not os.path.exists(EMB_PATH):
+        raise SystemExit('embeddings.npy not found')
+    emb = np.load(EMB_PATH)
+    cases = load_cases(eval_path)
+    if not cases:
+        print('no queries')
+        return
+    q_embs = encode([qq for qq,_ in cases])
+    variants = [('float32', ann_numpy.NumpyFlatIndex.build(emb))]
+    for name, cls in (('float16', ann_numpy.NumpyF16Index), ('int8', ann_numpy.NumpyInt8Index)):
+        variants.append((name, cls.build(emb, rescore=0)))
+        variants.append((f'{name}+rescore{rescore}', cls.build(emb, rescore=rescore)))
+    base = None
+    print(f"{'vectors':<18} {'MB':>8} {'saved':>6} {'Recall@' + str(k):>10} {'MRR':>7} {'dRecall':>8} {'dMRR':>7}")
+    for name, index in variants:
+        _, idxs = index.search(q_embs, k)
+        preds = [[int(x) for x in row if x >= 0] for row in idxs]
+        r = float(np.mean([recall_at_k(p, golds) for p, (_, golds) in zip(preds, cases)]))
+        m = float(np.mean([mrr(p, golds) for p, (_, golds) in zip(preds, cases)]))
+        if base is None:
+            base = (index.nbytes, r, m)
+        saved = 1 - index.nbytes / base[0]
+        print(f'{name:<18} {index.nbytes / 2**20:8.2f} {saved:6.0%} {r:10.4f} {m:7.4f} {r - base[1]:+8.4f} {m - base[2]:+7.4f}')
+    print(f'n={len(cases)} queries, {emb.shape[0]} vectors of dim {emb.shape[1]}'
+          ' (re-scoring reads candidate rows from float32 embeddings.npy, kept on disk)')
 
 
 if __name__=='__main__':
     p = argparse.ArgumentParser()
     p.add_argument('--eval', required=True)
     p.add_argument('--k', type=int, default=10)
+    p.add_argument('--quantized', action='store_true', help='compare float32 / float16 / int8 ANN vectors')
+    p.add_argument('--rescore', type=int, default=4, help='--quantized: float32 re-score depth multiplier')
     args = p.parse_args()
-    evaluate(args.eval, args.k)
+    # ANN rows are skipped (not an error) when embeddings.npy is missing
+    if not os.path.exists(os.path.join(OUT_DIR, 'metadata.json')):
+        raise SystemExit('Run compute_embeddings.py first')
+    if args.quantized:
+        evaluate_quantized(args.eval, args.k, args.rescore)
+    else:
+        evaluate(args.eval, args.k)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Taxonomy facets over the metadata rows, as packed bitmaps, plus the filter expressions
+that ANN, lexical and hybrid search accept.
+
+KB_TAXONOMY_GUIDE.md lays documents out as `<行业>/<内容类型>/<专业或子类>/<文档slug>`
+under app/src/main/assets/kb/. compute_embeddings.py records that directory as each row's
+`taxonomy`, and this module derives the facets from it:
+
+  industry      行业 (first level)
+  content_type  内容类型 (second level)
+  specialty     专业/子类 (the levels between content type and document; '' when absent)
+  document      文档 slug (last level)
+  path          every prefix of the taxonomy path, so `path=铁路/专业知识` selects a subtree
+
+A facet value is one bit per row (np.packbits), and all of them live in a single memory-mapped
+`bitmaps.npy` under `output/facets/`, next to `facets.json`. 300k rows cost 37 KB per value.
+Rows collapsed as near-duplicates (aliases.json) add their own taxonomy to the canonical row,
+so a passage shared by two branches matches filters on either. Rows from tmp/ exports have no
+taxonomy and match no positive filter.
+
+Filter expressions:
+    industry=铁路 and content_type=专业知识
+    path=铁路/专业知识 and not document in (电力线路工必知必会手册, "带 空格的文档")
+    (specialty=电力 or specialty=供电) and industry!=南方电网
+`and` / `or` / `not` are case-insensitive, with the usual precedence. Values may be quoted.
+`FacetIndex.select()` turns an expression into a `Selection`, which holds the matching row ids
+and a boolean mask. The searchers score only those rows (ann_numpy.scan_search,
+LexicalIndex.search(allowed=...)), so a narrower filter means less work, and the top-k is
+never post-filtered.
+
+Usage: python facets.py [--rebuild] [--filter "industry=铁路"]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from index_io import OUT_DIR, fingerprint, is_fresh
+from kb_stream import iter_json_records
+from meta_store import ALIASES_NAME, input_names, open_meta
+
+FACETS_NAME = 'facets'
+FACETS = ('industry', 'content_type', 'specialty', 'document', 'path')
+# parsed selections kept per index; expressions repeat across queries
+_SELECTION_CACHE = 64
+
+
+def taxonomy_facets(taxonomy: Optional[str]) -> Dict[str, List[str]]:
+    """Facet values of one taxonomy path ('行业/内容类型[/专业...]/文档')."""
+    parts = [p for p in (taxonomy or '').split('/') if p]
+    if not parts:
+        return {}
+    out = {'industry': [parts[0]], 'path': ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]}
+    if len(parts) >= 2:
+        out['content_type'] = [parts[1]]
+    if len(parts) >= 3:
+        out['document'] = [parts[-1]]
+        out['specialty'] = ['/'.join(parts[2:-1])]
+    return out
+
+
+class Selection:
+    """Rows matched by one filter expression: sorted ids plus a boolean mask over all rows."""
+
+    def __init__(self, expr: str, mask: np.ndarray):
+        self.expr = expr
+        self.mask = mask
+        self.rows = np.flatnonzero(mask)
+
+    @property
+    def count(self) -> int:
+        return int(self.rows.size)
+
+    @property
+    def fraction(self) -> float:
+        return self.count / self.mask.size if self.mask.size else 0.0
+
+
+class FacetIndex:
+    def __init__(self, values: Dict[str, List[str]], bitmaps: np.ndarray, rows: int):
+        self.values = values  # facet -> values, in bitmap order
+        self.bitmaps = bitmaps  # uint8 [total values, ceil(rows / 8)]
+        self.n_rows = rows
+        self._slot = {}
+        for facet in FACETS:
+            for v in values.get(facet, ()):
+                self._slot[(facet, v)] = len(self._slot)
+        self._selections: Dict[str, Selection] = {}
+
+    @classmethod
+    def build(cls, taxonomies: Iterable[Optional[str]], rows: int,
+              aliases: Iterable[Tuple[int, Optional[str]]] = ()) -> 'FacetIndex':
+        members: Dict[Tuple[str, str], List[int]] = {}
+
+        def add(row, taxonomy):
+            for facet, vals in taxonomy_facets(taxonomy).items():
+                for v in vals:
+                    members.setdefault((facet, v), []).append(row)
+
+        for row, taxonomy in enumerate(taxonomies):
+            add(row, taxonomy)
+        for row, taxonomy in aliases:
+            add(row, taxonomy)
+        values = {facet: sorted(v for f, v in members if f == facet) for facet in FACETS}
+        slots = [(f, v) for f in FACETS for v in values[f]]
+        bitmaps = np.zeros((len(slots), (rows + 7) // 8), dtype=np.uint8)
+        for j, key in enumerate(slots):
+            mask = np.zeros(rows, dtype=bool)
+            mask[members[key]] = True
+            bitmaps[j] = np.packbits(mask)
+        return cls(values, bitmaps, rows)
+
+    def save(self, path: str, inputs: Dict) -> None:
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, 'bitmaps.npy'), self.bitmaps)
+        with open(os.path.join(tmp, 'facets.json'), 'w', encoding='utf-8') as f:
+            json.dump({'rows': self.n_rows, 'values': self.values, 'inputs': inputs}, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'FacetIndex':
+        with open(os.path.join(path, 'facets.json'), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        return cls(info['values'], np.load(os.path.join(path, 'bitmaps.npy'), mmap_mode='r'), info['rows'])
+
+    def counts(self, facet: str) -> Dict[str, int]:
+        return {v: int(np.unpackbits(self.bitmaps[self._slot[(facet, v)]], count=self.n_rows).sum())
+                for v in self.values.get(facet, ())}
+
+    def bitmap(self, facet: str, value: str) -> np.ndarray:
+        if facet not in FACETS:
+            raise ValueError(f'unknown facet {facet!r}; expected one of {FACETS}')
+        slot = self._slot.get((facet, value))
+        if slot is None:
+            return np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+        return np.asarray(self.bitmaps[slot])
+
+    def select(self, expr: str) -> Selection:
+        """Rows matching a filter expression; raises ValueError on a malformed one."""
+        key = ' '.join(expr.split())
+        sel = self._selections.get(key)
+        if sel is None:
+            packed = _Parser(key, self).parse()
+            sel = Selection(key, np.unpackbits(packed, count=self.n_rows).astype(bool))
+            if len(self._selections) >= _SELECTION_CACHE:
+                self._selections.pop(next(iter(self._selections)))
+            self._selections[key] = sel
+        return sel
+
+
+_TOKEN_RE = re.compile(r'\s*(?:(!=|=|\(|\)|,)|"([^"]*)"|\'([^\']*)\'|([^\s=!(),"\']+))')
+
+
+class _Parser:
+    """Recursive descent over `or` < `and` < `not` < comparison; evaluates on packed bitmaps."""
+
+    def __init__(self, expr: str, index: FacetIndex):
+        self.index = index
+        self.tokens: List[Tuple[str, str]] = []
+        pos = 0
+        while pos < len(expr):
+            m = _TOKEN_RE.match(expr, pos)
+            if not m or m.end() == pos:
+                raise ValueError(f'cannot parse filter at {expr[pos:]!r}')
+            pos = m.end()
+            op, dq, sq, word = m.groups()
+            if op:
+                self.tokens.append(('op', op))
+            elif word is not None and word.lower() in ('and', 'or', 'not', 'in'):
+                self.tokens.append(('kw', word.lower()))
+            elif word is not None or dq is not None or sq is not None:
+                self.tokens.append(('val', next(v for v in (word, dq, sq) if v is not None)))
+        self.pos = 0
+
+    def _peek(self) -> Tuple[str, str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else ('end', '')
+
+    def _take(self, kind: str, text: Optional[str] = None) -> str:
+        tok = self._peek()
+        if tok[0] != kind or (text is not None and tok[1] != text):
+            raise ValueError(f'expected {text or kind}, got {tok[1] or "end of filter"!r}')
+        self.pos += 1
+        return tok[1]
+
+    def _not(self, packed: np.ndarray) -> np.ndarray:
+        out = np.invert(packed)
+        spare = out.size * 8 - self.index.n_rows
+        if spare and out.size:
+            # padding bits past the last row must stay clear
+            out[-1] &= np.uint8(0xFF << spare & 0xFF)
+        return out
+
+    def parse(self) -> np.ndarray:
+        out = self._or()
+        if self._peek()[0] != 'end':
+            raise ValueError(f'unexpected {self._peek()[1]!r} in filter')
+        return out
+
+    def _or(self) -> np.ndarray:
+        out = self._and()
+        while self._peek() == ('kw', 'or'):
+            self.pos += 1
+            out = out | self._and()
+        return out
+
+    def _and(self) -> np.ndarray:
+        out = self._unary()
+        while self._peek() == ('kw', 'and'):
+            self.pos += 1
+            out = out & self._unary()
+        return out
+
+    def _unary(self) -> np.ndarray:
+        if self._peek() == ('kw', 'not'):
+            self.pos += 1
+            return self._not(self._unary())
+        if self._peek() == ('op', '('):
+            self.pos += 1
+            out = self._or()
+            self._take('op', ')')
+            return out
+        facet = self._take('val')
+        if self._peek() == ('kw', 'in'):
+            self.pos += 1
+            self._take('op', '(')
+            out = self.index.bitmap(facet, self._take('val')).copy()
+            while self._peek() == ('op', ','):
+                self.pos += 1
+                out |= self.index.bitmap(facet, self._take('val'))
+            self._take('op', ')')
+            return out
+        op = self._take('op')
+        if op not in ('=', '!='):
+            raise ValueError(f'expected = or != after {facet!r}')
+        out = self.index.bitmap(facet, self._take('val'))
+        return self._not(out) if op == '!=' else out
+
+
+def load_facets(out_dir: str = OUT_DIR, rebuild: bool = True) -> Optional[FacetIndex]:
+    """Open the persisted bitmaps, (re)building them from the metadata store when missing or stale."""
+    path = os.path.join(out_dir, FACETS_NAME)
+    try:
+        with open(os.path.join(path, 'facets.json'), 'r', encoding='utf-8') as f:
+            recorded = json.load(f)
+        if is_fresh(recorded.get('inputs'), out_dir):
+            return FacetIndex.load(path)
+    except Exception:
+        pass
+    meta = open_meta(out_dir, rebuild=rebuild)
+    if not rebuild or meta is None:
+        return None
+    names = input_names(out_dir)
+    inputs = fingerprint(out_dir, names)
+    aliases = ()
+    if ALIASES_NAME in names:
+        aliases = ((a['row'], a.get('taxonomy')) for a in iter_json_records(os.path.join(out_dir, ALIASES_NAME)))
+    taxonomies = (json.loads(extra).get('taxonomy') if extra else None for extra in meta.column('extra'))
+    index = FacetIndex.build(taxonomies, len(meta), aliases)
+    index.save(path, inputs)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rebuild', action='store_true', help='rebuild from the metadata store even when fresh')
+    parser.add_argument('--filter', action='append', default=[], help='filter expression to evaluate')
+    args = parser.parse_args()
+    if args.rebuild:
+        shutil.rmtree(os.path.join(OUT_DIR, FACETS_NAME), ignore_errors=True)
+    index = load_facets()
+    if index is None:
+        raise SystemExit('metadata.json not found; run compute_embeddings.py first')
+    print(f'{index.n_rows} rows, {index.bitmaps.shape[0]} facet values, {index.bitmaps.nbytes / 1024:.1f} KB of bitmaps')
+    for facet in FACETS:
+        if facet != 'path':
+            print(f'  {facet}:', ', '.join(f'{v or "(none)"}={c}' for v, c in index.counts(facet).items()) or '-')
+    for expr in args.filter:
+        t0 = time.perf_counter()
+        try:
+            sel = index.select(expr)
+        except ValueError as e:
+            print(f'{expr!r}: {e}')
+            continue
+        print(f'{sel.expr!r}: {sel.count} rows ({sel.fraction:.1%}) in {(time.perf_counter() - t0) * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
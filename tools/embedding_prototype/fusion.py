@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Side-effect-free merge functions for hybrid (ANN + lexical) retrieval.
+"""
+from collections import defaultdict
+
+
+def score_merge(ann, lex, k, ann_weight=1.0, lex_weight=2.0):
+    """Weighted sum of (idx, score) lists, deduped by index; used by hybrid_retriever.py."""
+    scores = {}
+    for idx, s in ann:
+        scores[idx] = scores.get(idx, 0.0) + ann_weight * s
+    for idx, s in lex:
+        scores[idx] = scores.get(idx, 0.0) + lex_weight * s
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+
+
+def rank_merge(ann, lex, k, ann_weight=1.0, lex_weight=2.0):
+    """Reciprocal-rank merge of two id lists giving lex higher weight; used by evaluate.py."""
+    score = defaultdict(float)
+    for i, idx in enumerate(ann):
+        score[idx] += ann_weight / (i + 1)
+    for i, idx in enumerate(lex):
+        score[idx] += lex_weight / (i + 1)
+    ordered = sorted(score.items(), key=lambda x: x[1], reverse=True)
+    return [idx for idx, _ in ordered][:k]
@@ -1,30 +1,30 @@
 #!/usr/bin/env python3
 """
-Generate a simple eval JSON from metadata.json by sampling entries.
+Generate a simple eval JSON from the metadata store (meta_store.py) by sampling entries.
 """
 import json
 import os
 import random
 
+from meta_store import open_meta
+
 OUT = os.path.join(os.path.dirname(__file__), 'output')
-META = os.path.join(OUT, 'metadata.json')
 
-if not os.path.exists(META):
+meta = open_meta(OUT)
+if meta is None:
     raise SystemExit('metadata.json not found; run compute_embeddings.py first')
 
-with open(META, 'r', encoding='utf-8') as f:
-    meta = json.load(f)
-
-candidates = [m for m in meta if len((m.get('content') or '').strip())>20]
+# scan only the content column; rows are decoded for the sampled entries alone
+candidates = [i for i, content in enumerate(meta.column('content')) if len(content.strip())>20]
 random.shuffle(candidates)
 
 queries = []
-for i, m in enumerate(candidates[:100]):
-    content = (m.get('content') or '').strip()
+for i, row in enumerate(candidates[:100]):
+    content = meta.get(row, 'content').strip()
     # take a short substring as query (first 30 chars or a meaningful chunk)
     q = content[:30]
     qid = f'q{i+1}'
-    gold = [f"{m.get('source_file')}::{m.get('original_index')}" ]
+    gold = [meta.row_id(row)]
     queries.append({"id": qid, "query": q, "gold": gold})
 
 out = {"queries": queries}
@@ -1,83 +1,60 @@
 #!/usr/bin/env python3
 """
-Simple hybrid retriever: combine ANN (embeddings) + lexical substring search over metadata content.
-Usage: python hybrid_retriever.py "query" --k 10
+Simple hybrid retriever: combine ANN (embeddings) + BM25 lexical search over metadata content
+(character n-gram inverted index, see lexical_index.py).
+Query vectors and merged top-k results are memoized in a QueryCache (query_cache.py) when
+the module is imported and queried repeatedly. `--rerank` reorders the top `--depth`
+candidates with the cross-encoder in rerank.py.
+The state lives in a lazily loaded `Retriever` (retriever.py): importing this module opens
+nothing, and `--mode lexical` answers without loading the query model.
+`--filter` restricts both sides to a taxonomy facet expression (facets.py), e.g. "path=铁路/专业知识".
+Usage: python hybrid_retriever.py "query" --k 10 [--mode hybrid|ann|lexical] [--filter EXPR] [--rerank --depth 30 --budget-ms 200]
 """
 import argparse
-import json
-import os
-import numpy as np
-import pickle
 
-OUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
-EMB_PATH = os.path.join(OUT_DIR, 'embeddings.npy')
-META_PATH = os.path.join(OUT_DIR, 'metadata.json')
-NN_PKL = os.path.join(OUT_DIR, 'nn_model.pkl')
+from retriever import MODES, Retriever, print_hits
 
-if not os.path.exists(EMB_PATH) or not os.path.exists(META_PATH):
-    raise SystemExit('Run compute_embeddings.py first')
+# EMBED_BACKEND=onnx|onnx-int8 swaps in the ONNX Runtime encoder (encoder.py)
+retriever = Retriever()
 
-emb = np.load(EMB_PATH)
-with open(META_PATH, 'r', encoding='utf-8') as f:
-    meta = json.load(f)
 
-try:
-    with open(NN_PKL, 'rb') as f:
-        nn = pickle.load(f)
-        use_nn = True
-except Exception:
-    nn = None
-    use_nn = False
+def lexical_search(q, k):
+    return retriever.lexical(q, k)
 
-from sentence_transformers import SentenceTransformer
-model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
 
-
-def lexical_search(meta, q, k):
-    q_norm = q.lower().strip()
-    hits = []
-    for i, m in enumerate(meta):
-        text = (m.get('content','') + ' ' + (m.get('title') or '')).lower()
-        if q_norm in text:
-            hits.append((i, 1.0))
-    return sorted(hits, key=lambda x: x[1], reverse=True)[:k]
+def ann_search(q, k):
+    return retriever.ann_search(q, k)
 
 
-def ann_search(q, k):
-    if nn is None:
-        return []
-    q_emb = model.encode([q])
-    dists, idxs = nn.kneighbors(q_emb, n_neighbors=k)
-    results = []
-    for dist, idx in zip(dists[0], idxs[0]):
-        results.append((int(idx), float(1 - dist)))
-    return results
+def search(q, k):
+    return retriever.search(q, k, 'hybrid')
 
 
-def merge(ann, lex, k):
-    # Simple merge: assign weights, dedupe by index
-    scores = {}
-    for idx, s in ann:
-        scores[idx] = scores.get(idx, 0.0) + 1.0 * s
-    for idx, s in lex:
-        scores[idx] = scores.get(idx, 0.0) + 2.0 * s
-    ordered = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
-    return ordered
+def search_reranked(q, k, depth=None, budget_ms=None):
+    """Hybrid top-`depth` candidates (default 3 x k) reordered by the cross-encoder; returns the top k."""
+    return retriever.search_reranked(q, k, depth, budget_ms)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('query')
     parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--mode', choices=MODES, default='hybrid')
+    parser.add_argument('--filter', default=None, help='facet filter, e.g. "industry=铁路 and content_type=专业知识"')
+    parser.add_argument('--rerank', action='store_true', help='rerank candidates with the cross-encoder')
+    parser.add_argument('--depth', type=int, default=None, help='candidates to rerank (default 3 x k)')
+    parser.add_argument('--budget-ms', type=float, default=None, help='rerank latency budget')
     args = parser.parse_args()
-    ann = ann_search(args.query, args.k)
-    lex = lexical_search(meta, args.query, args.k)
-    merged = merge(ann, lex, args.k)
-    for rank, (idx, score) in enumerate(merged, 1):
-        m = meta[idx]
-        print(f"#{rank} idx={idx} score={score:.4f} src={m.get('source_file')} title={m.get('title')}")
-        print(m.get('content')[:400].replace('\n',' '))
-        print('-'*60)
+    if retriever.error:
+        raise SystemExit(retriever.error)
+    try:
+        if args.rerank:
+            merged = retriever.search_reranked(args.query, args.k, args.depth, args.budget_ms, args.mode, args.filter)
+        else:
+            merged = retriever.search(args.query, args.k, args.mode, args.filter)
+    except ValueError as e:
+        raise SystemExit(f'bad --filter: {e}')
+    print_hits(retriever.meta, merged)
 
 if __name__=='__main__':
     main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Load the prebuilt ANN index written by build_index.py instead of refitting it per query.
+
+build_index.py records a manifest (`output/index_manifest.json`) with a fingerprint of
+embeddings.npy + metadata.json. `load_searcher` opens the stored index (memory-mapped
+where faiss supports it) when the fingerprint still matches, and rebuilds it only when
+the inputs changed or the artifact is missing.
+
+Both searchers take an optional `subset` of sorted row ids (a facet filter, facets.py) that
+is applied inside the search. NumPy indexes scan only those rows (ann_numpy.scan_search).
+faiss passes the subset to the index as an IDSelectorBitmap, with nprobe / efSearch scaled by
+1/selectivity (ann_numpy.filtered_depth): unscaled, HNSW found 0.28 of the filtered top-10 at
+1% selectivity. When the subset has no more rows than that probe would visit (nprobe lists, or
+efSearch * M graph neighbours), it is scanned exactly instead, from the index's own normalized
+rows where it stores them and from the memory-mapped embeddings.npy otherwise.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+OUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
+MANIFEST_NAME = 'index_manifest.json'
+FAISS_NAME = 'index.faiss'
+NUMPY_NAME = 'index_numpy'
+
+
+def _file_state(path: str, with_hash: bool) -> Dict:
+    st = os.stat(path)
+    state = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if with_hash:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        state['sha256'] = h.hexdigest()
+    return state
+
+
+def fingerprint(out_dir: str = OUT_DIR, names=('embeddings.npy', 'metadata.json')) -> Dict:
+    """Full content fingerprint of the index inputs (hashes every file)."""
+    return {name: _file_state(os.path.join(out_dir, name), True) for name in names}
+
+
+def is_fresh(recorded: Dict, out_dir: str = OUT_DIR) -> bool:
+    """Cheap stat check first; only re-hash a file whose size matches but mtime moved (e.g. a fresh clone)."""
+    for name, rec in (recorded or {}).items():
+        path = os.path.join(out_dir, name)
+        if not os.path.exists(path):
+            return False
+        cur = _file_state(path, False)
+        if cur['size'] != rec.get('size'):
+            return False
+        if cur['mtime_ns'] != rec.get('mtime_ns'):
+            if _file_state(path, True)['sha256'] != rec.get('sha256'):
+                return False
+            # same content: remember the new mtime so the next load is stat-only again
+            rec['mtime_ns'] = cur['mtime_ns']
+    return bool(recorded)
+
+
+def read_manifest(out_dir: str = OUT_DIR) -> Optional[Dict]:
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def write_manifest(manifest: Dict, out_dir: str = OUT_DIR) -> None:
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def apply_search_params(index, params: Dict) -> None:
+    """Set query-time knobs (nprobe for IVF, efSearch for HNSW, rescore depth for quantized) on an index."""
+    params = params or {}
+    if params.get('nprobe') and hasattr(index, 'nprobe'):
+        index.nprobe = int(params['nprobe'])
+    if 'rescore' in params and hasattr(index, 'rescore'):
+        index.rescore = int(params['rescore'] or 0)
+    if params.get('ef_search') and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = int(params['ef_search'])
+
+
+def _probe(index) -> Optional[Tuple[int, int, int]]:
+    """(depth, rows visited per unit of depth, depth cap) of an IVF / HNSW index; None for a flat scan."""
+    if hasattr(index, 'nprobe'):
+        return index.nprobe, max(1, index.ntotal // max(1, index.nlist)), index.nlist
+    if hasattr(index, 'hnsw'):
+        return index.hnsw.efSearch, index.hnsw.nb_neighbors(1), max(1, index.ntotal)
+    return None
+
+
+def _search_params(index, sel, depth: int):
+    """faiss SearchParameters carrying an id selector and the (filter-scaled) nprobe / efSearch."""
+    import faiss
+    if hasattr(index, 'nprobe'):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=depth)
+    if hasattr(index, 'hnsw'):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=depth)
+    return faiss.SearchParameters(sel=sel)
+
+
+def _stored_rows(index) -> Optional[np.ndarray]:
+    """Zero-copy view of the normalized float32 rows a flat / HNSW-flat index stores, else None."""
+    import faiss
+    flat = faiss.downcast_index(index.storage) if hasattr(index, 'storage') else index
+    if not isinstance(flat, faiss.IndexFlat):
+        return None
+    return faiss.rev_swig_ptr(flat.get_xb(), flat.ntotal * flat.d).reshape(flat.ntotal, flat.d)
+
+
+class FaissSearcher:
+    kind = 'faiss'
+
+    def __init__(self, index, source=None):
+        self.index = index
+        self.source = source  # float32 rows in id order (embeddings.npy), for exact subset scans
+        # already-normalized rows inside the index (views its memory, so `index` must outlive it)
+        self.rows = _stored_rows(index)
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def search(self, q_emb, k: int, subset=None) -> Tuple[np.ndarray, np.ndarray]:
+        q = np.ascontiguousarray(q_emb, dtype=np.float32)
+        q = q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        if subset is not None:
+            subset = np.asarray(subset, dtype=np.int64)
+        if subset is None or subset.size >= self.ntotal:
+            # a filter that keeps every row costs nothing extra
+            return self.index.search(q, min(k, self.ntotal))
+        import faiss
+        import ann_numpy
+        probe = _probe(self.index)
+        depth = None
+        if probe is not None:
+            depth = ann_numpy.filtered_depth(probe[0], subset.size, self.ntotal, probe[2])
+        scannable = self.rows is not None or self.source is not None
+        # exact scan when it touches no more rows than the filtered probe would (always for a flat index)
+        if scannable and (probe is None or subset.size <= depth * probe[1]):
+            if self.rows is not None:
+                scores_of = lambda q, rows: q @ self.rows[rows].T
+            else:
+                scores_of = lambda q, rows: q @ ann_numpy.normalize(self.source[rows]).T
+            return ann_numpy.scan_search(q, self.ntotal, k, scores_of, ann_numpy.block_rows(q.shape[1]), subset=subset)
+        if hasattr(faiss, 'IDSelectorBitmap'):
+            # one bit per row (faiss reads bit i & 7 of byte i >> 3): O(n / 8) to build, unlike a hash set
+            mask = np.zeros(self.ntotal, dtype=bool)
+            mask[subset] = True
+            bits = np.packbits(mask, bitorder='little')
+            sel = faiss.IDSelectorBitmap(self.ntotal, faiss.swig_ptr(bits))
+        else:
+            sel = faiss.IDSelectorBatch(subset.size, faiss.swig_ptr(subset))
+        return self.index.search(q, min(k, self.ntotal), params=_search_params(self.index, sel, depth or 0))
+
+
+class NumpySearcher:
+    kind = 'numpy'
+
+    def __init__(self, index):
+        self.index = index
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def search(self, q_emb, k: int, subset=None) -> Tuple[np.ndarray, np.ndarray]:
+        return self.index.search(q_emb, min(k, self.ntotal), subset)
+
+
+def _open_faiss(path: str):
+    import faiss
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except Exception:
+        # not every index type / faiss build supports mmap
+        return faiss.read_index(path)
+
+
+def _open(manifest: Dict, out_dir: str):
+    path = os.path.join(out_dir, manifest['path'])
+    params = manifest.get('params')
+    if manifest.get('kind') == 'faiss':
+        index = _open_faiss(path)
+        apply_search_params(index, params)
+        return FaissSearcher(index, np.load(os.path.join(out_dir, 'embeddings.npy'), mmap_mode='r'))
+    if manifest.get('kind') == 'numpy':
+        import ann_numpy
+        # quantized indexes re-score against the float32 rows, read lazily from the memory map
+        source = np.load(os.path.join(out_dir, 'embeddings.npy'), mmap_mode='r') if (params or {}).get('rescore') else None
+        return NumpySearcher(ann_numpy.load(path, mmap=True, source=source, **(params or {})))
+    raise ValueError(f"unsupported index kind {manifest.get('kind')!r}")
+
+
+def load_searcher(out_dir: str = OUT_DIR, rebuild: bool = True):
+    """Return a searcher over the prebuilt index, rebuilding it first if it is stale or missing."""
+    manifest = read_manifest(out_dir)
+    if manifest and is_fresh(manifest.get('inputs'), out_dir):
+        if manifest != read_manifest(out_dir):
+            write_manifest(manifest, out_dir)
+        try:
+            return _open(manifest, out_dir)
+        except Exception as e:
+            print('Prebuilt index unreadable, rebuilding:', e)
+    if not rebuild:
+        return None
+    import build_index
+    print('Index missing or stale; rebuilding')
+    # keep the operator's chosen index family and knobs across rebuilds
+    index_type = (manifest or {}).get('index_type', 'auto')
+    # manifests written by the old sklearn NearestNeighbors fallback
+    if index_type == 'sklearn':
+        index_type = 'auto'
+    try:
+        return _open(build_index.build(out_dir, index_type, (manifest or {}).get('params')), out_dir)
+    except SystemExit:
+        if index_type == 'auto':
+            raise
+        return _open(build_index.build(out_dir), out_dir)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Bounded-memory streaming helpers for the KB ingestion pipeline (compute_embeddings.py).
+
+- iter_json_records: incremental JSON/JSONL reader that yields one record at a time
+- iter_batches: groups a record stream into encode batches bounded by count and bytes
+- NpyAppendWriter / JsonArrayWriter: append-only writers for embeddings.npy / metadata.json
+"""
+import json
+import os
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 16
+# longest first line _looks_like_jsonl will parse; a longer one is taken as a single document
+SNIFF_CHARS = 1 << 20
+_DECODER = json.JSONDecoder()
+_WS = ' \t\r\n'
+
+
+class _Reader:
+    """Sliding text buffer over a file; only the unconsumed tail is kept in memory."""
+
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        self.buf += chunk
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f'expected one of {chars!r}, got {c!r}')
+        self.pos += 1
+        return c
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise ValueError('truncated JSON value')
+            # a value touching the buffer end may be a prefix (e.g. a number): read more first
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+
+def _iter_array(r: _Reader) -> Iterator[Any]:
+    r.expect('[')
+    if r.peek() == ']':
+        r.pos += 1
+        return
+    while True:
+        yield r.value()
+        if r.expect(',]') == ']':
+            return
+
+
+def _iter_root(r: _Reader) -> Iterator[Any]:
+    c = r.peek()
+    if c == '[':
+        yield from _iter_array(r)
+        return
+    if c != '{':
+        # a scalar root holds no records (json.load would accept it); anything else is not JSON
+        r.value()
+        if r.peek():
+            raise ValueError('extra data after the root value')
+        return
+    # root object: stream the first array-valued field, skip the others
+    r.expect('{')
+    if r.peek() == '}':
+        return
+    while True:
+        r.value()
+        r.expect(':')
+        if r.peek() == '[':
+            yield from _iter_array(r)
+            return
+        r.value()
+        if r.expect(',}') == '}':
+            return
+
+
+def _iter_lines(f) -> Iterator[Any]:
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except Exception:
+            continue
+
+
+def _looks_like_jsonl(path: str, limit: int = SNIFF_CHARS) -> bool:
+    """JSONL if the first non-blank line is a complete JSON value and another non-blank line follows.
+
+    Reads at most about `limit` characters per line, so a minified single-line document is not
+    loaded just to sniff it.
+    """
+    if path.endswith('.jsonl'):
+        return True
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.readline(limit)
+        while first and not first.strip():
+            first = f.readline(limit)
+        if not first.endswith('\n'):
+            # no line break within the cap (or a one-line file): one document
+            return False
+        try:
+            json.loads(first)
+        except Exception:
+            return False
+        while True:
+            line = f.readline(limit)
+            if not line:
+                return False
+            if line.strip():
+                return True
+
+
+def iter_json_records(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Yield the records of a JSON array, of the first array field of a root object, or of JSONL."""
+    if _looks_like_jsonl(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from _iter_lines(f)
+        return
+    yielded = False
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            for obj in _iter_root(_Reader(f, chunk_size)):
+                yielded = True
+                yield obj
+        except ValueError:
+            if yielded:
+                # records already handed out; a partial file keeps what was readable
+                return
+            f.seek(0)
+            yield from _iter_lines(f)
+
+
+def iter_batches(items: Iterable[Any], batch_size: int, max_bytes: Optional[int] = None,
+                 size_of: Callable[[Any], int] = lambda _: 0) -> Iterator[List[Any]]:
+    """Group a stream into lists of at most `batch_size` items and (softly) `max_bytes`."""
+    batch: List[Any] = []
+    used = 0
+    for it in items:
+        batch.append(it)
+        used += size_of(it)
+        if len(batch) >= batch_size or (max_bytes is not None and used >= max_bytes):
+            yield batch
+            batch, used = [], 0
+    if batch:
+        yield batch
+
+
+class NpyAppendWriter:
+    """Append float32 rows to a .npy file; the header is patched with the final row count on close."""
+
+    HEADER_LEN = 128
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.dim: Optional[int] = None
+        self.rows = 0
+        self.f = open(self.tmp_path, 'wb')
+        self.f.write(b'\0' * self.HEADER_LEN)
+
+    def append(self, arr) -> None:
+        arr = np.ascontiguousarray(arr, dtype='<f4')
+        if arr.ndim != 2:
+            raise ValueError('expected a 2-D batch of vectors')
+        if self.dim is None:
+            self.dim = arr.shape[1]
+        elif arr.shape[1] != self.dim:
+            raise ValueError(f'dim mismatch: {arr.shape[1]} != {self.dim}')
+        self.f.write(arr.tobytes())
+        self.rows += arr.shape[0]
+
+    def _header(self) -> bytes:
+        d = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (self.rows, self.dim or 0)
+        body_len = self.HEADER_LEN - 10
+        return b'\x93NUMPY\x01\x00' + body_len.to_bytes(2, 'little') + d.ljust(body_len - 1).encode('latin1') + b'\n'
+
+    def close(self) -> None:
+        self.f.seek(0)
+        self.f.write(self._header())
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        self.f.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class JsonArrayWriter:
+    """Write a JSON array one element at a time; the target is replaced atomically on close."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.count = 0
+        self.f = open(self.tmp_path, 'w', encoding='utf-8')
+        self.f.write('[')
+
+    def append(self, obj) -> None:
+        self.f.write(',\n  ' if self.count else '\n  ')
+        self.f.write(json.dumps(obj, ensure_ascii=False))
+        self.count += 1
+
+    def close(self) -> None:
+        self.f.write('\n]\n' if self.count else ']\n')
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        self.f.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Persisted inverted index over character n-grams with BM25 scoring for lexical search.
+
+KB content is Chinese without whitespace, so every whitespace-separated run is indexed
+as (NFKC, lowercased) character uni/bi/trigrams; table cells such as "10kV" or "0.35"
+get the same treatment. Queries use bi+trigrams per run (unigrams only for single-character
+runs), so any query that is a substring of a row matches it on the `and` path.
+
+Search paths:
+  and   posting-list intersection: rows containing every query gram (substring-like)
+  or    BM25 over the union of the query grams' postings
+  auto  `and` first, topped up from `or` when it yields fewer than k rows
+
+Both only touch the postings of the query grams, so latency does not scale with the
+corpus. `allowed` (a boolean row mask from a facet filter, facets.py) drops postings of
+excluded rows before scoring, so a filtered top-k is still k rows when k rows match.
+The index lives in `output/lexical_index/` and is rebuilt when metadata.json changes.
+Usage: python lexical_index.py [--query "变压器 故障" --k 10]
+"""
+import argparse
+import json
+import math
+import os
+import re
+import shutil
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from index_io import OUT_DIR, fingerprint, is_fresh
+from meta_store import open_meta
+
+INDEX_NAME = 'lexical_index'
+NGRAMS = (1, 2, 3)
+K1 = 1.2
+B = 0.75
+
+_RUN_RE = re.compile(r'\S+')
+
+
+def tokenize(text: str, query: bool = False) -> List[str]:
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    out = []
+    for run in _RUN_RE.findall(text):
+        for n in NGRAMS:
+            if n > len(run) or (query and n == 1 and len(run) > 1):
+                continue
+            out.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return out
+
+
+def doc_text(m: Dict) -> str:
+    return (m.get('content') or '') + ' ' + (m.get('title') or '')
+
+
+class LexicalIndex:
+    def __init__(self, vocab: Dict[str, Tuple[int, int]], docs, tfs, doclen, avgdl: float):
+        self.vocab = vocab  # term -> (offset, df) into docs/tfs
+        self.docs = docs
+        self.tfs = tfs
+        self.doclen = doclen
+        self.avgdl = avgdl
+
+    @property
+    def n_docs(self) -> int:
+        return int(self.doclen.shape[0])
+
+    @classmethod
+    def build(cls, meta) -> 'LexicalIndex':
+        # packed int32 arrays per term keep build memory near the size of the final postings
+        postings: Dict[str, Tuple[array, array]] = {}
+        doclen = np.zeros(len(meta), dtype=np.int32)
+        for i, m in enumerate(meta):
+            counts = Counter(tokenize(doc_text(m)))
+            doclen[i] = sum(counts.values())
+            for term, tf in counts.items():
+                p = postings.get(term)
+                if p is None:
+                    p = postings[term] = (array('i'), array('i'))
+                p[0].append(i)
+                p[1].append(tf)
+        vocab = {}
+        total = sum(len(p[0]) for p in postings.values())
+        docs = np.empty(total, dtype=np.int32)
+        tfs = np.empty(total, dtype=np.int32)
+        off = 0
+        for term in sorted(postings):
+            d, tf = postings.pop(term)
+            vocab[term] = (off, len(d))
+            docs[off:off + len(d)] = np.frombuffer(d, dtype=np.int32)
+            tfs[off:off + len(d)] = np.frombuffer(tf, dtype=np.int32)
+            off += len(d)
+        avgdl = float(doclen.mean()) if len(meta) else 0.0
+        return cls(vocab, docs, tfs, doclen, avgdl)
+
+    def save(self, path: str, inputs: Dict) -> None:
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, 'docs.npy'), self.docs)
+        np.save(os.path.join(tmp, 'tfs.npy'), self.tfs)
+        np.save(os.path.join(tmp, 'doclen.npy'), self.doclen)
+        with open(os.path.join(tmp, 'vocab.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.vocab, f, ensure_ascii=False, separators=(',', ':'))
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'avgdl': self.avgdl, 'ngrams': list(NGRAMS), 'inputs': inputs}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'LexicalIndex':
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        with open(os.path.join(path, 'vocab.json'), 'r', encoding='utf-8') as f:
+            vocab = {t: tuple(v) for t, v in json.load(f).items()}
+        arr = {n: np.load(os.path.join(path, n + '.npy'), mmap_mode='r') for n in ('docs', 'tfs', 'doclen')}
+        return cls(vocab, arr['docs'], arr['tfs'], np.asarray(arr['doclen']), info['avgdl'])
+
+    def _postings(self, term: str):
+        off, df = self.vocab[term]
+        return self.docs[off:off + df], self.tfs[off:off + df]
+
+    def _bm25(self, terms: List[str], restrict: Optional[np.ndarray] = None,
+              allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(doc ids, scores) for docs matching any term, optionally restricted to a sorted id set or a row mask."""
+        n = self.n_docs
+        parts_d, parts_s = [], []
+        for term, qtf in Counter(terms).items():
+            if term not in self.vocab:
+                continue
+            d, tf = self._postings(term)
+            if restrict is not None:
+                keep = np.isin(d, restrict, assume_unique=True)
+                d, tf = d[keep], tf[keep]
+            elif allowed is not None:
+                keep = allowed[d]
+                d, tf = d[keep], tf[keep]
+            df = self.vocab[term][1]
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            tf = np.asarray(tf, dtype=np.float32)
+            norm = K1 * (1 - B + B * self.doclen[d] / max(self.avgdl, 1e-9))
+            parts_d.append(np.asarray(d))
+            parts_s.append(qtf * idf * tf * (K1 + 1) / (tf + norm))
+        if not parts_d:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        uniq, inv = np.unique(np.concatenate(parts_d), return_inverse=True)
+        return uniq, np.bincount(inv, weights=np.concatenate(parts_s)).astype(np.float32)
+
+    def intersect(self, terms: List[str]) -> np.ndarray:
+        """Sorted ids of docs containing every term (shortest posting lists first)."""
+        uniq = set(terms)
+        if not uniq or any(t not in self.vocab for t in uniq):
+            return np.empty(0, dtype=np.int32)
+        acc = None
+        for term in sorted(uniq, key=lambda t: self.vocab[t][1]):
+            d = np.asarray(self._postings(term)[0])
+            acc = d if acc is None else np.intersect1d(acc, d, assume_unique=True)
+            if acc.size == 0:
+                break
+        return acc
+
+    def search(self, q: str, k: int, mode: str = 'auto',
+               allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        terms = tokenize(q, query=True)
+        if not terms:
+            return []
+        hits: List[Tuple[int, float]] = []
+        if mode in ('and', 'auto'):
+            ids = self.intersect(terms)
+            if allowed is not None:
+                ids = ids[allowed[ids]]
+            if ids.size:
+                d, s = self._bm25(terms, restrict=ids)
+                hits = _top(d, s, k)
+        if mode == 'or' or (mode == 'auto' and len(hits) < k):
+            seen = {i for i, _ in hits}
+            d, s = self._bm25(terms, allowed=allowed)
+            hits += [h for h in _top(d, s, k + len(seen)) if h[0] not in seen][:k - len(hits)]
+        return hits
+
+
+def _top(docs: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    if docs.size == 0:
+        return []
+    kk = min(k, docs.size)
+    part = np.argpartition(-scores, kk - 1)[:kk]
+    part = part[np.argsort(-scores[part], kind='stable')]
+    return [(int(docs[i]), float(scores[i])) for i in part]
+
+
+def load_lexical(meta=None, out_dir: str = OUT_DIR, rebuild: bool = True) -> Optional[LexicalIndex]:
+    """Open the persisted index, (re)building it from metadata.json when missing or stale."""
+    path = os.path.join(out_dir, INDEX_NAME)
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            recorded = json.load(f)
+        if recorded.get('ngrams') == list(NGRAMS) and is_fresh(recorded.get('inputs'), out_dir):
+            return LexicalIndex.load(path)
+    except Exception:
+        pass
+    if not rebuild:
+        return None
+    inputs = fingerprint(out_dir, ('metadata.json',))
+    if meta is None:
+        meta = open_meta(out_dir)
+    index = LexicalIndex.build(meta)
+    index.save(path, inputs)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--query')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--mode', choices=('auto', 'and', 'or'), default='auto')
+    args = parser.parse_args()
+    index = load_lexical()
+    print(f'lexical index: {index.n_docs} docs, {len(index.vocab)} terms, {index.docs.shape[0]} postings')
+    if args.query:
+        for rank, (idx, score) in enumerate(index.search(args.query, args.k, args.mode), 1):
+            print(f'#{rank} idx={idx} bm25={score:.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Columnar, memory-mapped metadata store (the read-side replacement for `json.load(metadata.json)`).
+
+Layout of `output/metadata/`:
+  store.json                  {"rows", "columns", "inputs": fingerprint of metadata.json}
+  <col>.off.npy / <col>.blob  uint64 offsets [rows + 1] into a UTF-8 blob, for title / content / extra
+  source_file.codes.npy       uint32 per row, into the interned table source_file.off.npy / .blob
+  original_index.npy          int64 per row (-1 where missing)
+  keys.npy / key_rows.npy     sorted (source code << 32 | original_index + 1) and the matching rows,
+                              for `source_file::original_index` lookups by binary search
+`extra` holds any other row fields as a JSON object ('' when there are none).
+
+Near-duplicates collapsed at ingest (near_dup.py) are listed in `output/aliases.json` as
+{"source_file", "original_index", "row", "similarity"}. They get no row of their own. Their
+keys point at the canonical row instead, so `rows_for()` resolves an alias id like any other.
+
+`open_meta()` maps the files, so opening costs the same for 100 rows or 10M. Rows are decoded
+only when indexed: `meta[i]` returns the same dict that `json.load` produced, so existing
+`meta[idx].get('content')` call sites are unchanged. `compute_embeddings.py` writes the store
+next to metadata.json; for an older metadata.json it is built on first open (streamed, see
+kb_stream.py) and rebuilt when metadata.json changes.
+
+Usage: python meta_store.py [--rebuild] [--id "file.json::3"]
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from index_io import OUT_DIR, fingerprint, is_fresh
+from kb_stream import iter_json_records
+
+STORE_NAME = 'metadata'
+ALIASES_NAME = 'aliases.json'
+STRING_COLUMNS = ('title', 'content', 'extra')
+_KNOWN = {'source_file', 'original_index', 'title', 'content'}
+
+
+class _StringColumnWriter:
+    def __init__(self, path: str, name: str):
+        self.base = os.path.join(path, name)
+        self.f = open(self.base + '.blob', 'wb')
+        self.offsets = array('Q', [0])
+
+    def append(self, s: str) -> None:
+        raw = s.encode('utf-8')
+        self.f.write(raw)
+        self.offsets.append(self.offsets[-1] + len(raw))
+
+    def close(self) -> None:
+        self.f.close()
+        np.save(self.base + '.off.npy', np.frombuffer(self.offsets, dtype=np.uint64))
+
+
+class MetaStoreWriter:
+    """Append rows one at a time; `close()` writes the lookup table and swaps the store in atomically."""
+
+    def __init__(self, out_dir: str = OUT_DIR):
+        self.path = os.path.join(out_dir, STORE_NAME)
+        self.tmp = self.path + '.tmp'
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        os.makedirs(self.tmp)
+        self.columns = {name: _StringColumnWriter(self.tmp, name) for name in STRING_COLUMNS}
+        self.sources: Dict[str, int] = {}
+        self.codes = array('I')
+        self.original = array('q')
+        self.count = 0
+        # (code, original_index, canonical row) of collapsed near-duplicates
+        self.alias_codes = array('I')
+        self.alias_original = array('q')
+        self.alias_rows = array('q')
+
+    def _source_key(self, m: Dict) -> Tuple[int, int]:
+        src = m.get('source_file')
+        src = '' if src is None else str(src)
+        code = self.sources.setdefault(src, len(self.sources))
+        oi = m.get('original_index')
+        try:
+            oi = int(oi)
+        except (TypeError, ValueError):
+            oi = -1
+        if not -1 <= oi < (1 << 32) - 1:
+            raise ValueError(f'original_index out of range: {oi}')
+        return code, oi
+
+    def append(self, m: Dict) -> None:
+        code, oi = self._source_key(m)
+        self.codes.append(code)
+        self.original.append(oi)
+        self.columns['title'].append(m.get('title') or '')
+        self.columns['content'].append(m.get('content') or '')
+        extra = {k: v for k, v in m.items() if k not in _KNOWN}
+        self.columns['extra'].append(json.dumps(extra, ensure_ascii=False) if extra else '')
+        self.count += 1
+
+    def add_alias(self, m: Dict, row: int) -> None:
+        """Resolve `m`'s source_file::original_index to the existing `row`."""
+        code, oi = self._source_key(m)
+        self.alias_codes.append(code)
+        self.alias_original.append(oi)
+        self.alias_rows.append(int(row))
+
+    def close(self, inputs: Dict) -> None:
+        for col in self.columns.values():
+            col.close()
+        table = _StringColumnWriter(self.tmp, 'source_file')
+        for src in self.sources:
+            table.append(src)
+        table.close()
+        codes = np.frombuffer(self.codes, dtype=np.uint32) if self.count else np.zeros(0, np.uint32)
+        original = np.frombuffer(self.original, dtype=np.int64) if self.count else np.zeros(0, np.int64)
+        np.save(os.path.join(self.tmp, 'source_file.codes.npy'), codes)
+        np.save(os.path.join(self.tmp, 'original_index.npy'), original)
+        keys = _key(codes, original)
+        rows = np.arange(self.count, dtype=np.int64)
+        if self.alias_rows:
+            keys = np.concatenate([keys, _key(np.frombuffer(self.alias_codes, dtype=np.uint32),
+                                              np.frombuffer(self.alias_original, dtype=np.int64))])
+            rows = np.concatenate([rows, np.frombuffer(self.alias_rows, dtype=np.int64)])
+        order = np.argsort(keys, kind='stable')
+        np.save(os.path.join(self.tmp, 'keys.npy'), keys[order])
+        np.save(os.path.join(self.tmp, 'key_rows.npy'), rows[order])
+        with open(os.path.join(self.tmp, 'store.json'), 'w', encoding='utf-8') as f:
+            json.dump({'rows': self.count, 'sources': len(self.sources), 'aliases': len(self.alias_rows),
+                       'columns': list(STRING_COLUMNS), 'inputs': inputs}, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp, self.path)
+
+    def abort(self) -> None:
+        for col in self.columns.values():
+            col.f.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def _key(codes: np.ndarray, original: np.ndarray) -> np.ndarray:
+    return (codes.astype(np.int64) << 32) | (original.astype(np.int64) + 1)
+
+
+def _map(path: str) -> np.ndarray:
+    # np.memmap refuses empty files
+    return np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+
+
+class _StringColumn:
+    def __init__(self, base: str):
+        self.offsets = np.load(base + '.off.npy', mmap_mode='r')
+        self.blob = _map(base + '.blob')
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.blob[start:end]).decode('utf-8')
+
+
+class MetaStore:
+    """Read-only, lazily decoded view of the metadata rows."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'store.json'), 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+        self.columns = {name: _StringColumn(os.path.join(path, name)) for name in self.info['columns']}
+        self._sources = _StringColumn(os.path.join(path, 'source_file'))
+        self._source_codes: Optional[Dict[str, int]] = None
+        self.codes = np.load(os.path.join(path, 'source_file.codes.npy'), mmap_mode='r')
+        self.original_index = np.load(os.path.join(path, 'original_index.npy'), mmap_mode='r')
+        self.keys = np.load(os.path.join(path, 'keys.npy'), mmap_mode='r')
+        self.key_rows = np.load(os.path.join(path, 'key_rows.npy'), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return self.info['rows']
+
+    def _row(self, i) -> int:
+        i = int(i)
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(f'row {i} out of range for {n} rows')
+        return i
+
+    def get(self, i, column: str) -> str:
+        return self.columns[column][self._row(i)]
+
+    def source_file(self, i) -> str:
+        return self._sources[int(self.codes[self._row(i)])]
+
+    def row_id(self, i) -> str:
+        """`source_file::original_index`, the identifier used by the eval gold lists."""
+        i = self._row(i)
+        oi = int(self.original_index[i])
+        return f"{self.source_file(i)}::{oi if oi >= 0 else None}"
+
+    def __getitem__(self, i) -> Dict:
+        i = self._row(i)
+        oi = int(self.original_index[i])
+        row = {'source_file': self.source_file(i), 'original_index': oi if oi >= 0 else None,
+               'title': self.columns['title'][i], 'content': self.columns['content'][i]}
+        extra = self.columns['extra'][i]
+        if extra:
+            row.update(json.loads(extra))
+        return row
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, name: str) -> Iterator[str]:
+        """Stream one string column without building row dicts."""
+        col = self.columns[name]
+        for i in range(len(self)):
+            yield col[i]
+
+    def rows_for(self, gold_id: str) -> List[int]:
+        """Rows whose `source_file::original_index` equals `gold_id` (a file name can occur more than once)."""
+        if '::' not in gold_id:
+            return []
+        src, oi = gold_id.rsplit('::', 1)
+        if self._source_codes is None:
+            self._source_codes = {self._sources[c]: c for c in range(len(self._sources))}
+        code = self._source_codes.get(src)
+        if code is None:
+            return []
+        try:
+            oi = -1 if oi == 'None' else int(oi)
+        except ValueError:
+            return []
+        if not -1 <= oi < (1 << 32) - 1:
+            return []
+        key = (code << 32) | (oi + 1)
+        lo, hi = np.searchsorted(self.keys, [key, key + 1])
+        return sorted(int(r) for r in self.key_rows[lo:hi])
+
+
+def input_names(out_dir: str = OUT_DIR) -> Tuple[str, ...]:
+    """Files the store is built from: metadata.json, plus aliases.json after a deduplicated ingest."""
+    names = ('metadata.json',)
+    return names + (ALIASES_NAME,) if os.path.exists(os.path.join(out_dir, ALIASES_NAME)) else names
+
+
+def build_store(records: Iterable[Dict], inputs: Dict, out_dir: str = OUT_DIR,
+                aliases: Iterable[Dict] = ()) -> MetaStore:
+    writer = MetaStoreWriter(out_dir)
+    try:
+        for m in records:
+            writer.append(m)
+        for a in aliases:
+            writer.add_alias(a, a['row'])
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close(inputs)
+    return MetaStore(writer.path)
+
+
+def open_meta(out_dir: str = OUT_DIR, rebuild: bool = True) -> Optional[MetaStore]:
+    """Open the store, (re)building it from metadata.json when missing or stale; None without metadata.json."""
+    path = os.path.join(out_dir, STORE_NAME)
+    meta_path = os.path.join(out_dir, 'metadata.json')
+    try:
+        with open(os.path.join(path, 'store.json'), 'r', encoding='utf-8') as f:
+            recorded = json.load(f)
+        if not os.path.exists(meta_path) or is_fresh(recorded.get('inputs'), out_dir):
+            return MetaStore(path)
+    except Exception:
+        pass
+    if not rebuild or not os.path.exists(meta_path):
+        return None
+    names = input_names(out_dir)
+    aliases = iter_json_records(os.path.join(out_dir, ALIASES_NAME)) if ALIASES_NAME in names else ()
+    return build_store(iter_json_records(meta_path), fingerprint(out_dir, names), out_dir, aliases)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rebuild', action='store_true', help='rebuild from metadata.json even when fresh')
+    parser.add_argument('--id', action='append', default=[], help='look up a source_file::original_index id')
+    args = parser.parse_args()
+    if args.rebuild:
+        shutil.rmtree(os.path.join(OUT_DIR, STORE_NAME), ignore_errors=True)
+    t0 = time.perf_counter()
+    meta = open_meta()
+    if meta is None:
+        raise SystemExit('metadata.json not found; run compute_embeddings.py first')
+    print(f'{len(meta)} rows, {meta.info.get("sources")} source files, {meta.info.get("aliases", 0)} aliases, opened in {(time.perf_counter() - t0) * 1000:.1f} ms')
+    for gold_id in args.id:
+        rows = meta.rows_for(gold_id)
+        print(gold_id, '->', rows, [meta.get(r, 'content')[:60] for r in rows])
+
+
+if __name__ == '__main__':
+    main()
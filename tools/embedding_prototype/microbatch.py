@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Asyncio micro-batching scheduler for the embedding service.
+
+Concurrent `/embed_batch` requests are queued and merged: the scheduler takes the oldest
+request, keeps collecting for up to `max_wait_ms` (or until `token_budget` / `max_items`
+is reached), runs one encode call for the merged texts on a dedicated executor thread and
+hands every caller back only its own rows. The event loop never runs the model, so new
+requests keep queueing (and merging) while a batch is being encoded.
+
+Backpressure: when `max_queue` requests are already waiting, `submit` raises `Overloaded`
+instead of queueing, which service.py maps to HTTP 503.
+
+Every merged batch feeds the `kb_batch_size` (texts) and `kb_queue_wait_seconds` histograms
+and an `encode` span, labeled with the batcher's `name` (telemetry.py).
+"""
+import asyncio
+import contextvars
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, List, Optional, Sequence
+
+import numpy as np
+
+import telemetry
+
+DEFAULT_MAX_WAIT_MS = 5.0
+DEFAULT_TOKEN_BUDGET = 16384
+DEFAULT_MAX_ITEMS = 512
+DEFAULT_MAX_QUEUE = 64
+
+
+BATCH_SIZE = telemetry.histogram('kb_batch_size', 'Texts per merged encode batch.', ('batcher',),
+                                 telemetry.SIZE_BUCKETS)
+QUEUE_WAIT = telemetry.histogram('kb_queue_wait_seconds', 'Time a request waited before its batch started.',
+                                 ('batcher',))
+
+
+class Overloaded(Exception):
+    """The request queue is full; the caller should retry later."""
+
+
+class _Request:
+    __slots__ = ('texts', 'cost', 'future', 'enqueued')
+
+    def __init__(self, texts: List[str], cost: int, future: asyncio.Future):
+        self.texts = texts
+        self.cost = cost
+        self.future = future
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+                 token_budget: int = DEFAULT_TOKEN_BUDGET, max_items: int = DEFAULT_MAX_ITEMS,
+                 max_queue: int = DEFAULT_MAX_QUEUE, size_of: Callable[[str], int] = len, name: str = 'embed'):
+        self.encode = encode
+        self.name = name
+        self.max_wait = max_wait_ms / 1000.0
+        self.token_budget = token_budget
+        self.max_items = max_items
+        self.max_queue = max_queue
+        self.size_of = size_of
+        self._pending: Deque[_Request] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # one thread: the model is not re-entrant and torch already parallelizes a single encode
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='encode')
+        self.batches = 0
+        self.requests = 0
+        self.items = 0
+        self.rejected = 0
+        self.queue_wait_ms = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            # a fresh context: otherwise the loop inherits the first caller's trace span (telemetry.py)
+            self._task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            req = self._pending.popleft()
+            if not req.future.done():
+                req.future.set_exception(Overloaded('service shutting down'))
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, texts: Sequence[str]) -> np.ndarray:
+        """Embeddings for `texts` (float32 [len(texts), dim]), encoded together with concurrent callers."""
+        texts = list(texts)
+        if len(self._pending) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f'{len(self._pending)} requests queued')
+        self.start()
+        req = _Request(texts, sum(self.size_of(t) for t in texts),
+                       asyncio.get_running_loop().create_future())
+        self._pending.append(req)
+        self._wakeup.set()
+        return await req.future
+
+    def stats(self) -> dict:
+        return {'queue_depth': self.queue_depth, 'max_queue': self.max_queue, 'batches': self.batches,
+                'requests': self.requests, 'items': self.items, 'rejected': self.rejected,
+                'avg_requests_per_batch': round(self.requests / self.batches, 2) if self.batches else 0.0,
+                'avg_queue_wait_ms': round(self.queue_wait_ms / self.requests, 3) if self.requests else 0.0}
+
+    def _full(self, cost: int, items: int, req: _Request) -> bool:
+        return cost + req.cost > self.token_budget or items + len(req.texts) > self.max_items
+
+    async def _collect(self) -> List[_Request]:
+        while not self._pending:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        group = [self._pending.popleft()]
+        cost, items = group[0].cost, len(group[0].texts)
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while cost < self.token_budget and items < self.max_items:
+            if not self._pending:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                continue
+            # an oversized request stays at the head of the queue and starts the next batch
+            if self._full(cost, items, self._pending[0]):
+                break
+            req = self._pending.popleft()
+            group.append(req)
+            cost += req.cost
+            items += len(req.texts)
+        return group
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            group = await self._collect()
+            # callers that disconnected while queued are dropped before encoding
+            group = [r for r in group if not r.future.done()]
+            if not group:
+                continue
+            texts = [t for r in group for t in r.texts]
+            now = time.perf_counter()
+            self.batches += 1
+            self.requests += len(group)
+            self.items += len(texts)
+            self.queue_wait_ms += sum((now - r.enqueued) * 1000 for r in group)
+            if telemetry.ENABLED:
+                BATCH_SIZE.observe(len(texts), self.name)
+                for r in group:
+                    QUEUE_WAIT.observe(now - r.enqueued, self.name)
+            try:
+                with telemetry.span('encode', items=len(texts), batcher=self.name, requests=len(group)):
+                    embs = await loop.run_in_executor(self._executor, self.encode, texts)
+            except Exception as e:
+                for r in group:
+                    if not r.future.done():
+                        r.future.set_exception(e)
+                continue
+            off = 0
+            for r in group:
+                if not r.future.done():
+                    r.future.set_result(embs[off:off + len(r.texts)])
+                off += len(r.texts)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Streaming near-duplicate detection for KB items (MinHash + LSH over character shingles).
+
+The exports under tmp/ repeat passages: per-model variants such as
+knowledge_base.gemini_2_5_flash.partial.json, and docx_tables_* re-extractions. Text is
+NFKC-normalized, lowercased and stripped of whitespace and punctuation. It is then cut into
+overlapping character 3-grams, since CJK has no word boundaries. Each item gets a MinHash
+signature of NUM_PERM values, and the signature is split into BANDS bands. Items sharing any
+band bucket are candidates. A candidate counts as a duplicate when the estimated Jaccard
+similarity (the fraction of equal signature values) reaches the threshold.
+
+`NearDupIndex.add()` works one item at a time in stream order: the first item of a cluster
+becomes its canonical row and later matches are reported against it, so memory grows with the
+number of canonical rows only. compute_embeddings.py drops the duplicates before encoding and
+records them as aliases (see meta_store.py), so their `source_file::original_index` ids still
+resolve to the canonical row.
+
+Usage: python near_dup.py [--threshold 0.8]   (report clusters in output/metadata.json)
+"""
+import argparse
+import os
+import re
+import unicodedata
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+NUM_PERM = 64
+BANDS = 16
+SHINGLE = 3
+DEFAULT_THRESHOLD = 0.8
+# texts shorter than this (after normalization) are only collapsed when identical
+MIN_CHARS = 8
+# smallest prime above 2**32; shingle hashes are 32-bit and the coefficients below 2**31,
+# so (a * x + b) stays inside uint64
+_PRIME = np.uint64((1 << 32) + 15)
+# whitespace, ASCII and CJK punctuation (full-width forms are folded by NFKC first)
+_STRIP_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    return _STRIP_RE.sub('', unicodedata.normalize('NFKC', text or '').lower())
+
+
+def shingles(text: str, n: int = SHINGLE) -> List[str]:
+    if len(text) <= n:
+        return [text] if text else []
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+
+    def signature(self, grams: List[str]) -> np.ndarray:
+        x = np.fromiter((zlib.crc32(g.encode('utf-8')) for g in set(grams)), dtype=np.uint64)
+        if not len(x):
+            return np.full(len(self.a), np.iinfo(np.uint32).max, dtype=np.uint32)
+        return ((x[:, None] * self.a + self.b) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+class NearDupIndex:
+    """In-order MinHash/LSH index: `add(row, text)` returns (canonical row, similarity) or None."""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = NUM_PERM, bands: int = BANDS):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.threshold = threshold
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.buckets: List[Dict[bytes, int]] = [{} for _ in range(bands)]
+        self.signatures: Dict[int, np.ndarray] = {}
+        # exact normalized text -> canonical row, for texts too short to shingle meaningfully
+        self.short: Dict[str, int] = {}
+        self.seen = 0
+        self.dups = 0
+
+    def add(self, row: int, text: str) -> Optional[Tuple[int, float]]:
+        self.seen += 1
+        norm = normalize_text(text)
+        if len(norm) < MIN_CHARS:
+            canon = self.short.setdefault(norm, row)
+            if canon != row:
+                self.dups += 1
+                return canon, 1.0
+            return None
+        sig = self.hasher.signature(shingles(norm))
+        keys = [sig[b * self.rows_per_band:(b + 1) * self.rows_per_band].tobytes() for b in range(self.bands)]
+        best = None
+        for cand in {bucket[key] for bucket, key in zip(self.buckets, keys) if key in bucket}:
+            sim = float(np.mean(self.signatures[cand] == sig))
+            if sim >= self.threshold and (best is None or sim > best[1] or (sim == best[1] and cand < best[0])):
+                best = (cand, sim)
+        if best is not None:
+            self.dups += 1
+            return best
+        self.signatures[row] = sig
+        for bucket, key in zip(self.buckets, keys):
+            bucket.setdefault(key, row)
+        return None
+
+    @property
+    def ratio(self) -> float:
+        return self.dups / self.seen if self.seen else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--show', type=int, default=5, help='clusters to print')
+    args = parser.parse_args()
+    from meta_store import open_meta
+    meta = open_meta(os.path.join(os.path.dirname(__file__), 'output'))
+    if meta is None:
+        raise SystemExit('metadata.json not found; run compute_embeddings.py first')
+    index = NearDupIndex(args.threshold)
+    clusters: Dict[int, List[Tuple[int, float]]] = {}
+    for row, text in enumerate(meta.column('content')):
+        hit = index.add(row, text)
+        if hit is not None:
+            clusters.setdefault(hit[0], []).append((row, hit[1]))
+    print(f'{index.dups} of {index.seen} rows are near-duplicates ({index.ratio:.1%}) '
+          f'in {len(clusters)} clusters at threshold {args.threshold}')
+    for canon, members in sorted(clusters.items(), key=lambda c: -len(c[1]))[:args.show]:
+        print(f'{meta.row_id(canon)}: {meta.get(canon, "content")[:60]!r}')
+        for row, sim in members:
+            print(f'  {sim:.2f} {meta.row_id(row)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Bounded in-memory cache for repeated search queries (service.py, hybrid_retriever.py, rerank.py).
+
+Three kinds of entries share one LRU:
+  vector   normalized query text + model name                  -> float32 query embedding
+  results  normalized query text + model + index version + mode/k -> final top-k [(row, score)]
+  pair     normalized query text + cross-encoder + document hash -> rerank score
+
+Eviction is least-recently-used under both an entry count and a byte cap; an optional TTL
+expires entries on access. Result keys carry `index_version()` so a rebuilt index never
+serves stale rows, and `invalidate_results()` drops them eagerly when the caller reloads.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from embedding_cache import normalize_content
+from index_io import MANIFEST_NAME, OUT_DIR
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_MAX_BYTES = 64 << 20
+# rough per-entry bookkeeping (key tuple, OrderedDict node, timestamps)
+_ENTRY_OVERHEAD = 200
+
+
+def normalize_query(q: str) -> str:
+    return normalize_content(q).lower()
+
+
+def index_version(out_dir: str = OUT_DIR) -> str:
+    """Short hash of what the search results depend on: ANN manifest and lexical index metadata."""
+    h = hashlib.sha1()
+    for path in (os.path.join(out_dir, MANIFEST_NAME), os.path.join(out_dir, 'lexical_index', 'meta.json')):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except Exception:
+            info = None
+        # the input hashes identify the data; mtimes are refreshed on reload and would churn the version
+        inputs = {name: rec.get('sha256') for name, rec in ((info or {}).get('inputs') or {}).items()}
+        info = {k: v for k, v in (info or {}).items() if k != 'inputs'}
+        h.update(json.dumps([info, inputs], sort_keys=True).encode('utf-8'))
+    return h.hexdigest()[:12]
+
+
+def _sizeof(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes + _ENTRY_OVERHEAD
+    if isinstance(value, (list, tuple)):
+        # top-k lists of (int, float) pairs
+        return 72 * len(value) + _ENTRY_OVERHEAD
+    return sys.getsizeof(value) + _ENTRY_OVERHEAD
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl or None
+        self._data: 'OrderedDict[Hashable, Tuple[Any, int, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = {'vector': 0, 'results': 0, 'pair': 0}
+        self.misses = {'vector': 0, 'results': 0, 'pair': 0}
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @staticmethod
+    def vector_key(q: str, model_name: str) -> Tuple:
+        return ('vector', normalize_query(q), model_name)
+
+    @staticmethod
+    def results_key(q: str, model_name: str, version: str, *params) -> Tuple:
+        return ('results', normalize_query(q), model_name, version) + tuple(params)
+
+    @staticmethod
+    def pair_key(q: str, model_name: str, doc_key: str) -> Tuple:
+        return ('pair', normalize_query(q), model_name, doc_key)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses[key[0]] += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits[key[0]] += 1
+            return entry[0]
+
+    def put(self, key: Tuple, value: Any) -> None:
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        if isinstance(value, np.ndarray):
+            # callers get views of this array back; never let them mutate the cached copy
+            value = value.copy()
+            value.flags.writeable = False
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, size, time.monotonic())
+            self.bytes += size
+            while self._data and (len(self._data) > self.max_entries or self.bytes > self.max_bytes):
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _drop(self, key: Hashable) -> None:
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def invalidate_results(self) -> None:
+        """Forget all top-k results (query vectors stay valid: they do not depend on the index)."""
+        with self._lock:
+            for key in [k for k in self._data if k[0] == 'results']:
+                self._drop(key)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        def rate(kind):
+            total = self.hits[kind] + self.misses[kind]
+            return round(self.hits[kind] / total, 4) if total else 0.0
+        return {'entries': len(self._data), 'bytes': self.bytes, 'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes, 'ttl_s': self.ttl, 'hits': dict(self.hits),
+                'misses': dict(self.misses), 'hit_rate': {k: rate(k) for k in self.hits},
+                'evictions': self.evictions, 'expirations': self.expirations,
+                'invalidations': self.invalidations}
@@ -1,56 +1,154 @@
 #!/usr/bin/env python3
 """
-Rerank candidates using a cross-encoder model (sentence-transformers CrossEncoder).
-Usage: python rerank.py "query"
+Rerank first-stage candidates with a cross-encoder (sentence-transformers CrossEncoder).
+
+Candidates come from the ANN / hybrid retriever (best first); `Reranker.rerank()` scores
+(query, document) pairs in length-bucketed batches (batching.plan_batches), so short table
+rows are not padded to the longest paragraph. Scores are memoized per (query, document text)
+in a QueryCache, and an optional latency budget stops scoring once the next batch would
+overrun it: rows left unscored keep their first-stage order below every re-scored row.
+
+Library use (retriever.Retriever.search_reranked, service.py /search with "rerank": true):
+    reranker = Reranker()
+    top = reranker.rerank(query, candidates, meta, k=10, budget_ms=150)
+
+Usage: python rerank.py "query" [--topk 10] [--depth 30] [--budget-ms 200]
 """
-import os
-import json
-import numpy as np
-from sentence_transformers import CrossEncoder
+import argparse
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
 
-OUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
-META_PATH = os.path.join(OUT_DIR, 'metadata.json')
+from batching import plan_batches, token_lengths
+from embedding_cache import content_key
+from query_cache import QueryCache
+import telemetry
 
-if not os.path.exists(META_PATH):
-    raise SystemExit('Run compute_embeddings.py first')
+CE_NAME = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+# documents are truncated before scoring; the cross-encoder only sees 512 tokens anyway
+MAX_DOC_CHARS = 512
+# pairs per wave of first-stage candidates; the budget check can only cut between batches
+DEFAULT_MAX_BATCH = 32
+DEFAULT_TOKEN_BUDGET = 8192
 
-with open(META_PATH, 'r', encoding='utf-8') as f:
-    meta = json.load(f)
 
-model_name = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
-print('Loading cross-encoder', model_name)
-ce = CrossEncoder(model_name)
+def doc_text(m: Dict) -> str:
+    return (m.get('title', '') + '\n' + (m.get('content') or ''))[:MAX_DOC_CHARS]
 
-import argparse
-parser = argparse.ArgumentParser()
-parser.add_argument('query')
-parser.add_argument('--topk', type=int, default=10)
-args = parser.parse_args()
-
-# Collect initial candidates by simple lexical match + embedding-based sample
-# For demo, take first N items that contain any query token or top-N by simple embedding distance
-q = args.query
-q_tokens = q.lower().split()
-
-candidates = []
-for i,m in enumerate(meta):
-    text = (m.get('title','') + '\n' + m.get('content','')).lower()
-    if any(tok in text for tok in q_tokens):
-        candidates.append((i, text))
-    if len(candidates) >= args.topk*3:
-        break
-
-# fallback: if no lexical candidates, sample first topk*3
-if not candidates:
-    for i,m in enumerate(meta[:args.topk*3]):
-        candidates.append((i, (m.get('title','') + '\n' + m.get('content','')).lower()))
-
-pairs = [[q, c[1][:512]] for c in candidates]
-scores = ce.predict(pairs)
-scored = sorted(zip(candidates, scores), key=lambda x: x[1], reverse=True)[:args.topk]
-
-for rank, ((idx, _), score) in enumerate(scored, 1):
-    m = meta[idx]
-    print(f"#{rank} idx={idx} score={score:.4f} src={m.get('source_file')} title={m.get('title')}")
-    print(m.get('content')[:600].replace('\n',' '))
-    print('-'*60)
+
+class Reranker:
+    """Cross-encoder second stage; the model is loaded on first use and shared by all callers."""
+
+    def __init__(self, model_name: str = CE_NAME, cache: Optional[QueryCache] = None,
+                 token_budget: int = DEFAULT_TOKEN_BUDGET, max_batch: int = DEFAULT_MAX_BATCH, model=None):
+        self.model_name = model_name
+        self.cache = cache if cache is not None else QueryCache()
+        self.token_budget = token_budget
+        self.max_batch = max_batch
+        self._model = model
+        self._lock = threading.Lock()
+        # smoothed cost of one padded token, used to predict whether the next batch fits the budget
+        self.ms_per_token: Optional[float] = None
+        self.last_stats: Dict = {}
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name)
+        return self._model
+
+    def _fits(self, t0: float, budget_ms: Optional[float], padded: int) -> bool:
+        if budget_ms is None:
+            return True
+        elapsed = (time.perf_counter() - t0) * 1000
+        return elapsed + padded * (self.ms_per_token or 0.0) <= budget_ms
+
+    def _observe(self, padded: int, ms: float) -> None:
+        rate = ms / max(1, padded)
+        self.ms_per_token = rate if self.ms_per_token is None else 0.8 * self.ms_per_token + 0.2 * rate
+
+    def score(self, query: str, texts: Sequence[str], budget_ms: Optional[float] = None,
+              t0: Optional[float] = None) -> List[Optional[float]]:
+        """Cross-encoder score per text (None where the budget ran out); `texts` are in priority order."""
+        t0 = time.perf_counter() if t0 is None else t0
+        keys = [QueryCache.pair_key(query, self.model_name, content_key(t)) for t in texts]
+        scores: List[Optional[float]] = [self.cache.get(key) for key in keys]
+        todo = [j for j, s in enumerate(scores) if s is None]
+        cached, scored = len(texts) - len(todo), 0
+        if todo:
+            model = self.model
+            q_len = token_lengths(model, [query])[0]
+            max_len = getattr(model, 'max_length', None) or 512
+            lens = [min(q_len + n, max_len) for n in token_lengths(model, [texts[j] for j in todo])]
+            # waves keep first-stage priority; inside a wave, batches are bucketed by length
+            batches = [[todo[w + i] for i in b]
+                       for w in range(0, len(todo), self.max_batch)
+                       for b in plan_batches(lens[w:w + self.max_batch], self.token_budget, self.max_batch)]
+            pair_len = dict(zip(todo, lens))
+            for batch in batches:
+                padded = len(batch) * max(pair_len[j] for j in batch)
+                if not self._fits(t0, budget_ms, padded):
+                    break
+                tb = time.perf_counter()
+                out = model.predict([(query, texts[j]) for j in batch], batch_size=len(batch),
+                                    show_progress_bar=False)
+                self._observe(padded, (time.perf_counter() - tb) * 1000)
+                for j, s in zip(batch, out):
+                    scores[j] = float(s)
+                    self.cache.put(keys[j], float(s))
+                scored += len(batch)
+        self.last_stats = {'candidates': len(texts), 'cached': cached, 'scored': scored,
+                           'skipped': len(todo) - scored, 'ms': round((time.perf_counter() - t0) * 1000, 2)}
+        return scores
+
+    def rerank(self, query: str, candidates: Sequence[Tuple[int, float]], meta: Sequence[Dict],
+               k: Optional[int] = None, budget_ms: Optional[float] = None) -> List[Tuple[int, float]]:
+        """Reorder first-stage (row, score) candidates by cross-encoder score; returns the top `k`.
+
+        With `budget_ms`, candidates the budget did not reach follow the re-scored ones in their
+        first-stage order, with decreasing placeholder scores below the lowest cross-encoder score.
+        """
+        t0 = time.perf_counter()
+        with telemetry.span('rerank', items=len(candidates)) as sp:
+            scores = self.score(query, [doc_text(meta[idx]) for idx, _ in candidates], budget_ms, t0)
+            sp.set(**self.last_stats)
+        done = sorted(((candidates[j][0], s) for j, s in enumerate(scores) if s is not None),
+                      key=lambda x: x[1], reverse=True)
+        floor = done[-1][1] if done else 0.0
+        rest = [(candidates[j][0], floor - (n + 1)) for n, j in
+                enumerate(j for j, s in enumerate(scores) if s is None)]
+        return (done + rest)[:k] if k else done + rest
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('query')
+    parser.add_argument('--topk', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=None, help='first-stage candidates to rerank (default 3 x topk)')
+    parser.add_argument('--budget-ms', type=float, default=None, help='stop scoring once this much time is spent')
+    args = parser.parse_args()
+
+    # candidates come from the same hybrid search; indexes and models load on first use
+    from retriever import Retriever
+    r = Retriever()
+    if r.error:
+        raise SystemExit(r.error)
+    candidates = r.search(args.query, args.depth or args.topk * 3)
+    print('Loading cross-encoder', CE_NAME)
+    reranker = r.reranker
+    scored = reranker.rerank(args.query, candidates, r.meta, args.topk, args.budget_ms)
+    print(f"reranked {reranker.last_stats['scored']} of {len(candidates)} candidates "
+          f"({reranker.last_stats['skipped']} over budget) in {reranker.last_stats['ms']} ms")
+
+    for rank, (idx, score) in enumerate(scored, 1):
+        m = r.meta[idx]
+        print(f"#{rank} idx={idx} score={score:.4f} src={m.get('source_file')} title={m.get('title')}")
+        print(m.get('content')[:600].replace('\n',' '))
+        print('-'*60)
+
+
+if __name__ == '__main__':
+    main()
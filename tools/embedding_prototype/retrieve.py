@@ -1,20 +1,16 @@
 #!/usr/bin/env python3
 """
-Simple retrieval script that loads embeddings.npy and metadata.json and answers nearest neighbors.
+Simple retrieval script that opens the metadata store (meta_store.py) plus the prebuilt ANN index
+from build_index.py (rebuilt only when stale, see index_io.py) and answers nearest neighbors.
 Usage:
   python retrieve.py "your query here" --k 5
 """
 import argparse
-import json
 import os
-import numpy as np
 
-try:
-    from sentence_transformers import SentenceTransformer
-except Exception:
-    raise SystemExit('Missing sentence-transformers. Install via requirements.txt')
-
-from sklearn.neighbors import NearestNeighbors
+from encoder import BACKENDS, load_encoder
+from index_io import load_searcher
+from meta_store import open_meta
 
 ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 OUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
@@ -23,28 +19,21 @@ MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
 
 def load_index():
     emb_path = os.path.join(OUT_DIR, 'embeddings.npy')
-    meta_path = os.path.join(OUT_DIR, 'metadata.json')
-    if not os.path.exists(emb_path) or not os.path.exists(meta_path):
+    meta = open_meta(OUT_DIR)
+    if not os.path.exists(emb_path) or meta is None:
         raise SystemExit('Run compute_embeddings.py first to generate embeddings and metadata')
-    emb = np.load(emb_path)
-    with open(meta_path, 'r', encoding='utf-8') as f:
-        meta = json.load(f)
-    return emb, meta
-
-
-def build_nn(embeddings):
-    nn = NearestNeighbors(n_neighbors=10, algorithm='auto', metric='cosine')
-    nn.fit(embeddings)
-    return nn
+    return load_searcher(OUT_DIR), meta
 
 
-def query_topk(model, nn, embeddings, meta, q, k=5):
+def query_topk(model, searcher, meta, q, k=5):
     q_emb = model.encode([q])
-    dists, idxs = nn.kneighbors(q_emb, n_neighbors=k)
+    scores, idxs = searcher.search(q_emb, k)
     out = []
-    for dist, idx in zip(dists[0], idxs[0]):
+    for score, idx in zip(scores[0], idxs[0]):
+        if idx < 0:
+            continue
         item = meta[idx]
-        out.append({'score': float(1 - dist), 'title': item.get('title'), 'content': item.get('content'), 'source': item.get('source_file')})
+        out.append({'score': float(score), 'title': item.get('title'), 'content': item.get('content'), 'source': item.get('source_file')})
     return out
 
 
@@ -52,11 +41,11 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('query', type=str)
     parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--backend', choices=BACKENDS, default=None, help='encoder backend (default: EMBED_BACKEND or torch)')
     args = parser.parse_args()
-    emb, meta = load_index()
-    model = SentenceTransformer(MODEL_NAME)
-    nn = build_nn(emb)
-    results = query_topk(model, nn, emb, meta, args.query, args.k)
+    searcher, meta = load_index()
+    model = load_encoder(MODEL_NAME, args.backend)
+    results = query_topk(model, searcher, meta, args.query, args.k)
     for i, r in enumerate(results, 1):
         print(f"#{i} score={r['score']:.4f} src={r['source']} title={r['title']}")
         print(r['content'][:600].replace('\n', ' '))
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Warm retrieval state shared by hybrid_retriever.py, evaluate.py, rerank.py and service.py.
+
+Importing this module only pulls in numpy and the sibling modules; torch,
+sentence-transformers, onnxruntime and faiss load the first time a query needs them. Every
+artifact is opened lazily on first access and then stays resident:
+
+  meta       columnar metadata store, memory-mapped (meta_store.py)
+  lex_index  BM25 n-gram index, postings memory-mapped (lexical_index.py)
+  searcher   prebuilt ANN index, memory-mapped / faiss (index_io.py)
+  model      query encoder (encoder.py; EMBED_BACKEND picks torch or ONNX Runtime)
+  reranker   cross-encoder second stage (rerank.py)
+  facets     taxonomy filter bitmaps (facets.py)
+
+So a lexical-only query never imports torch or opens the ANN index, and `--help` costs the
+numpy import. Library use:
+
+    r = Retriever()
+    r.search('变压器 故障', 10, mode='lexical')   # [(row, score), ...]
+    r.meta[row]['content']
+    r.search('接地', 10, filter='path=铁路/专业知识')   # only rows under that taxonomy subtree
+
+Encode, ann, lexical, merge and rerank calls are timed as telemetry.py spans; `--trace FILE`
+(or TRACE_FILE) appends them as JSON lines. `--profile` prints the cold-start breakdown (imports, artifact opens, first query) and which
+heavy modules ended up loaded; `python -X importtime retriever.py ...` gives the per-module view.
+
+Usage: python retriever.py "query" [--k 10] [--mode lexical|ann|hybrid] [--filter EXPR] [--rerank] [--profile]
+                          [--trace FILE]
+"""
+import time
+
+_T_IMPORT = time.perf_counter()
+
+import argparse  # noqa: E402
+import os  # noqa: E402
+import sys  # noqa: E402
+import threading  # noqa: E402
+from typing import Dict, List, Optional, Sequence, Tuple  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+from facets import load_facets  # noqa: E402
+from fusion import score_merge  # noqa: E402
+from index_io import OUT_DIR, load_searcher  # noqa: E402
+from lexical_index import load_lexical  # noqa: E402
+from meta_store import open_meta  # noqa: E402
+from query_cache import QueryCache, index_version  # noqa: E402
+from rerank import CE_NAME, Reranker  # noqa: E402
+import telemetry  # noqa: E402
+
+_T_IMPORTED = time.perf_counter()
+
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+MODES = ('ann', 'lexical', 'hybrid')
+# modules whose import dominates cold start; --profile reports which ones a query pulled in
+HEAVY_MODULES = ('torch', 'sentence_transformers', 'transformers', 'onnxruntime', 'sklearn', 'faiss')
+
+_UNSET = object()
+
+
+class Retriever:
+    """Lazily opened, then resident, search state over one output directory; thread-safe to warm."""
+
+    def __init__(self, out_dir: str = OUT_DIR, model_name: str = MODEL_NAME, backend: Optional[str] = None,
+                 threads: Optional[int] = None, cache: Optional[QueryCache] = None, model=None,
+                 cache_name: Optional[str] = None, reranker: Optional[Reranker] = None):
+        self.out_dir = out_dir
+        self.model_name = model_name
+        self.backend = backend
+        self.threads = threads
+        # cache keys carry the backend when it changes the vectors (see encoder.encoder_id)
+        self.cache_name = cache_name or model_name
+        self.cache = cache if cache is not None else QueryCache()
+        self._model = model
+        self._reranker = reranker
+        self._meta = self._lex = self._searcher = self._version = self._facets = _UNSET
+        self._lock = threading.RLock()
+        # seconds spent opening each artifact, for --profile and /health
+        self.timings: Dict[str, float] = {}
+
+    def _load(self, attr: str, name: str, fn):
+        if getattr(self, attr) is _UNSET:
+            with self._lock:
+                if getattr(self, attr) is _UNSET:
+                    t0 = time.perf_counter()
+                    setattr(self, attr, fn())
+                    self.timings[name] = time.perf_counter() - t0
+        return getattr(self, attr)
+
+    @property
+    def error(self) -> Optional[str]:
+        """Why searching is impossible (missing inputs), or None."""
+        for name in ('metadata.json', 'embeddings.npy'):
+            if not os.path.exists(os.path.join(self.out_dir, name)):
+                return 'Run compute_embeddings.py first'
+        return None
+
+    @property
+    def meta(self):
+        return self._load('_meta', 'meta', lambda: open_meta(self.out_dir))
+
+    @property
+    def lex_index(self):
+        return self._load('_lex', 'lexical', lambda: load_lexical(None, self.out_dir))
+
+    @property
+    def searcher(self):
+        # None without embeddings: ANN and hybrid then fall back to lexical-only hits
+        return self._load('_searcher', 'ann_index', lambda: load_searcher(self.out_dir) if os.path.exists(
+            os.path.join(self.out_dir, 'embeddings.npy')) else None)
+
+    @property
+    def facets(self):
+        return self._load('_facets', 'facets', lambda: load_facets(self.out_dir))
+
+    @property
+    def version(self) -> str:
+        return self._load('_version', 'version', lambda: index_version(self.out_dir))
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from encoder import load_encoder
+                    t0 = time.perf_counter()
+                    self._model = load_encoder(self.model_name, self.backend, self.threads)
+                    self.timings['model'] = time.perf_counter() - t0
+        return self._model
+
+    @property
+    def reranker(self) -> Reranker:
+        if self._reranker is None:
+            with self._lock:
+                if self._reranker is None:
+                    # the cross-encoder itself still loads on the first rerank
+                    self._reranker = Reranker(CE_NAME, cache=self.cache)
+        return self._reranker
+
+    def warm(self, model: bool = True) -> 'Retriever':
+        """Open every artifact now (and load the encoder) instead of on the first query."""
+        if self.error is None:
+            for attr in ('meta', 'searcher', 'lex_index', 'version'):
+                getattr(self, attr)
+            if model:
+                self.model.encode(['warmup'], show_progress_bar=False)
+        return self
+
+    def select(self, expr: Optional[str]):
+        """Selection for a filter expression (facets.py), or None for no filter; raises ValueError."""
+        if not expr or not expr.strip():
+            return None
+        if self.facets is None:
+            raise ValueError('no facet index; run compute_embeddings.py first')
+        return self.facets.select(expr)
+
+    def embed(self, queries: Sequence[str]) -> np.ndarray:
+        """Query vectors, memoized per normalized query."""
+        vecs = [self.cache.get(QueryCache.vector_key(q, self.cache_name)) for q in queries]
+        missing = [i for i, v in enumerate(vecs) if v is None]
+        if missing:
+            with telemetry.span('encode', items=len(missing)):
+                embs = self.model.encode([queries[i] for i in missing], batch_size=max(1, len(missing)),
+                                         show_progress_bar=False)
+            for i, emb in zip(missing, embs):
+                vecs[i] = emb
+                self.cache.put(QueryCache.vector_key(queries[i], self.cache_name), emb)
+        return np.stack(vecs).astype(np.float32, copy=False)
+
+    def ann(self, q_embs, k: int, subset=None) -> List[List[Tuple[int, float]]]:
+        """Top-k (row, cosine) per query vector from the prebuilt index, among `subset` rows if given."""
+        if self.searcher is None or (subset is not None and not len(subset)):
+            return [[] for _ in range(len(q_embs))]
+        with telemetry.span('ann', items=len(q_embs), k=k, kind=self.searcher.kind,
+                            rows=self.searcher.ntotal if subset is None else len(subset)):
+            scores, idxs = self.searcher.search(np.asarray(q_embs, dtype=np.float32), k, subset)
+        return [[(int(i), float(s)) for s, i in zip(srow, irow) if i >= 0] for srow, irow in zip(scores, idxs)]
+
+    def ann_search(self, q: str, k: int, sel=None) -> List[Tuple[int, float]]:
+        if self.searcher is None or (sel is not None and not sel.count):
+            return []
+        return self.ann(self.embed([q]), k, None if sel is None else sel.rows)[0]
+
+    def lexical(self, q: str, k: int, sel=None) -> List[Tuple[int, float]]:
+        if sel is not None and not sel.count:
+            return []
+        with telemetry.span('lexical', items=1, k=k) as sp:
+            hits = self.lex_index.search(q, k, allowed=None if sel is None else sel.mask)
+            sp.set(hits=len(hits))
+        # BM25 is unbounded; scale to [0, 1] so the lexical weight in score_merge() keeps its meaning
+        top = max((s for _, s in hits), default=0.0) or 1.0
+        return [(idx, s / top) for idx, s in hits]
+
+    def first_stage(self, q: str, k: int, mode: str = 'hybrid', ann_hits=None,
+                    depth: Optional[int] = None, sel=None) -> List[Tuple[int, float]]:
+        """Uncached top-k for one query; hybrid fuses `depth` (default k) candidates from each side.
+
+        Pass `ann_hits` when the ANN search already ran (batched) at that depth. `sel` (from
+        select()) restricts both sides to the filtered rows inside the search.
+        """
+        depth = depth or k
+        if mode == 'lexical':
+            return self.lexical(q, k, sel)
+        if ann_hits is None:
+            ann_hits = self.ann_search(q, k if mode == 'ann' else depth, sel)
+        if mode == 'ann':
+            return ann_hits[:k]
+        lex_hits = self.lexical(q, depth, sel)
+        with telemetry.span('merge', items=len(ann_hits) + len(lex_hits)):
+            return score_merge(ann_hits, lex_hits, k)
+
+    def search(self, q: str, k: int, mode: str = 'hybrid', filter: Optional[str] = None) -> List[Tuple[int, float]]:
+        """Top-k (row, score) for `mode` in MODES, optionally within a facet filter; memoized per index version."""
+        if mode not in MODES:
+            raise ValueError(f'mode must be one of {MODES}')
+        sel = self.select(filter)
+        params = (mode,) if sel is None else (mode, 'filter', sel.expr)
+        key = QueryCache.results_key(q, self.cache_name, self.version, *params, k)
+        # the root span of a query: encode / ann / lexical / merge spans below share its trace id
+        with telemetry.span('search', items=1, mode=mode, k=k) as sp:
+            hits = self.cache.get(key)
+            sp.set(cached=hits is not None)
+            if hits is None:
+                hits = self.first_stage(q, k, mode, sel=sel)
+                self.cache.put(key, hits)
+        return hits
+
+    def search_reranked(self, q: str, k: int, depth: Optional[int] = None, budget_ms: Optional[float] = None,
+                        mode: str = 'hybrid', filter: Optional[str] = None) -> List[Tuple[int, float]]:
+        """Top-`depth` candidates (default 3 x k) reordered by the cross-encoder; returns the top k."""
+        return self.reranker.rerank(q, self.search(q, depth or k * 3, mode, filter), self.meta, k, budget_ms)
+
+
+def print_hits(meta, hits, width: int = 400) -> None:
+    for rank, (idx, score) in enumerate(hits, 1):
+        m = meta[idx]
+        print(f"#{rank} idx={idx} score={score:.4f} src={m.get('source_file')} title={m.get('title')}")
+        print((m.get('content') or '')[:width].replace('\n', ' '))
+        print('-' * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('query')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--mode', choices=MODES, default='hybrid')
+    parser.add_argument('--filter', default=None, help='facet filter, e.g. "industry=铁路 and content_type=专业知识"')
+    parser.add_argument('--rerank', action='store_true', help='rerank candidates with the cross-encoder')
+    parser.add_argument('--depth', type=int, default=None, help='candidates to rerank (default 3 x k)')
+    parser.add_argument('--budget-ms', type=float, default=None, help='rerank latency budget')
+    parser.add_argument('--profile', action='store_true', help='print the cold-start time breakdown')
+    parser.add_argument('--trace', default=None, help='append per-stage spans to this JSON-lines file')
+    args = parser.parse_args()
+    telemetry.configure(trace_path=args.trace)
+
+    t0 = time.perf_counter()
+    r = Retriever()
+    if r.error:
+        raise SystemExit(r.error)
+    try:
+        if args.rerank:
+            hits = r.search_reranked(args.query, args.k, args.depth, args.budget_ms, args.mode, args.filter)
+        else:
+            hits = r.search(args.query, args.k, args.mode, args.filter)
+    except ValueError as e:
+        raise SystemExit(f'bad --filter: {e}')
+    t1 = time.perf_counter()
+    # artifacts opened for the query itself; printing the hits may open more (e.g. the metadata)
+    opened = dict(r.timings)
+    print_hits(r.meta, hits)
+    if args.profile:
+        rows = [('imports (numpy + siblings)', _T_IMPORTED - _T_IMPORT)]
+        rows += [(f'open {name}', s) for name, s in opened.items()]
+        rows += [('query', t1 - t0 - sum(opened.values())), ('total (import to first result)', t1 - _T_IMPORT)]
+        for name, s in rows:
+            print(f'{name:<32} {s * 1000:8.1f} ms')
+        print('heavy modules loaded:', ', '.join(m for m in HEAVY_MODULES if m in sys.modules) or 'none')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,357 @@
-from fastapi import FastAPI, HTTPException
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+import numpy as np
+from pydantic import BaseModel
+from typing import List, Dict, Optional
+
+# allow `uvicorn tools.embedding_prototype.service:app` from the repo root to find sibling modules
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from batching import encode_bucketed  # noqa: E402
+from encoder import encoder_id, load_encoder  # noqa: E402
+from index_io import OUT_DIR  # noqa: E402
+from microbatch import MicroBatcher, Overloaded  # noqa: E402
+from query_cache import QueryCache  # noqa: E402
+from rerank import CE_NAME, Reranker  # noqa: E402
+from retriever import Retriever  # noqa: E402
+import telemetry  # noqa: E402
+import wire  # noqa: E402
 
 app = FastAPI()
-model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+# EMBED_BACKEND=torch|onnx|onnx-int8 and EMBED_THREADS select the encoder (see encoder.py)
+model = load_encoder()
+# cache keys carry the backend when it changes the vectors
+MODEL_NAME = encoder_id('sentence-transformers/all-MiniLM-L6-v2', os.environ.get('EMBED_BACKEND', 'torch'))
+
+# concurrent /embed_batch calls are merged into one encode on a dedicated thread (see microbatch.py);
+# tune with EMBED_MAX_WAIT_MS / EMBED_TOKEN_BUDGET / EMBED_MAX_ITEMS / EMBED_MAX_QUEUE
+batcher = MicroBatcher(
+    lambda texts: encode_bucketed(model, texts),
+    max_wait_ms=float(os.environ.get('EMBED_MAX_WAIT_MS', 5)),
+    token_budget=int(os.environ.get('EMBED_TOKEN_BUDGET', 16384)),
+    max_items=int(os.environ.get('EMBED_MAX_ITEMS', 512)),
+    max_queue=int(os.environ.get('EMBED_MAX_QUEUE', 64)),
+    # CJK text is roughly one token per character, plus [CLS]/[SEP]
+    size_of=lambda t: len(t) + 2,
+    name='embed',
+)
+
+# search queries get their own batcher so they never wait behind bulk /embed_batch work; no merge window:
+# queries that arrive while an encode is running are still merged into the next one
+query_batcher = MicroBatcher(
+    lambda texts: model.encode(texts, batch_size=len(texts), show_progress_bar=False),
+    max_wait_ms=float(os.environ.get('SEARCH_MAX_WAIT_MS', 0)),
+    max_queue=int(os.environ.get('SEARCH_MAX_QUEUE', 256)),
+    name='query',
+)
+
+SEARCH_MODES = ('ann', 'lexical', 'hybrid')
+MAX_K = 100
+# how often /search stats the index files to notice a rebuild
+RELOAD_CHECK_S = 2.0
+
+# repeated field queries skip the encode and the index search; QUERY_CACHE_TTL_S=0 disables expiry
+query_cache = QueryCache(
+    max_entries=int(os.environ.get('QUERY_CACHE_ENTRIES', 4096)),
+    max_bytes=int(float(os.environ.get('QUERY_CACHE_MAX_MB', 64)) * (1 << 20)),
+    ttl=float(os.environ.get('QUERY_CACHE_TTL_S', 0)),
+)
+
+# "rerank": true reorders the first-stage candidates with a cross-encoder, loaded on first use.
+# Pair scores share the query cache; scoring runs on its own thread so it never blocks the event loop.
+reranker = Reranker(os.environ.get('RERANK_MODEL', CE_NAME), cache=query_cache)
+rerank_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rerank')
+RERANK_BUDGET_MS = float(os.environ.get('RERANK_BUDGET_MS', 200))
+MAX_RERANK_DEPTH = 200
+
+
+def _signature(out_dir: str) -> tuple:
+    sig = []
+    for name in ('metadata.json', 'embeddings.npy', 'index_manifest.json', os.path.join('lexical_index', 'meta.json')):
+        try:
+            st = os.stat(os.path.join(out_dir, name))
+            sig.append((st.st_size, st.st_mtime_ns))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
+class SearchState(Retriever):
+    """The shared Retriever (retriever.py) kept resident for /search (see AnnApiService.kt).
+
+    Unlike the scripts, the service opens everything at startup and records the file signature
+    it loaded, so current_state() can notice a rebuild. The model, query cache and reranker are
+    the service-wide ones and survive reloads.
+    """
+
+    def __init__(self, out_dir: str = OUT_DIR):
+        super().__init__(out_dir, cache=query_cache, model=model, cache_name=MODEL_NAME, reranker=reranker)
+        self.checked_at = time.monotonic()
+        self.signature = _signature(out_dir)
+        if self.error is None:
+            # memory-mapped columns: row dicts are decoded only for the hits a caller asks about
+            self.warm(model=False)
+            # loading may rebuild the indexes or refresh manifest mtimes: record the settled state
+            self.signature = _signature(out_dir)
+
+    @property
+    def ready(self) -> bool:
+        return self.error is None and self.searcher is not None
+
+
+search_state = SearchState()
+# first encode pays for lazy torch initialization; do it before serving
+model.encode(['warmup'], show_progress_bar=False)
+
+# a rebuilt index is loaded off the event loop; held for the whole load so only one runs at a time
+reload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reload')
+_reload_lock = threading.Lock()
+
+
+def _reload() -> None:
+    global search_state
+    try:
+        state = SearchState()
+        # a half-written rebuild fails to load: keep serving the old index and retry on a later check
+        if state.ready or not search_state.ready:
+            search_state = state
+            query_cache.invalidate_results()
+    finally:
+        _reload_lock.release()
+
+
+def current_state() -> SearchState:
+    """The resident search state; a changed index is reloaded in the background while this one serves."""
+    state = search_state
+    now = time.monotonic()
+    if now - state.checked_at >= RELOAD_CHECK_S:
+        state.checked_at = now
+        if _signature(OUT_DIR) != state.signature and _reload_lock.acquire(blocking=False):
+            reload_executor.submit(_reload)
+    return state
+
+
+class SearchRequest(BaseModel):
+    query: str
+    k: int = 10
+    mode: str = 'ann'
+    rerank: bool = False
+    # first-stage candidates to rerank (default 3 x k) and the rerank latency budget
+    rerank_depth: Optional[int] = None
+    budget_ms: Optional[float] = None
+    # taxonomy facet expression (facets.py), applied inside the search, e.g. "path=铁路/专业知识"
+    filter: Optional[str] = None
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    k: int = 10
+    mode: str = 'ann'
+    rerank: bool = False
+    rerank_depth: Optional[int] = None
+    budget_ms: Optional[float] = None
+    filter: Optional[str] = None
+
+
+async def _query_vectors(queries: List[str]) -> np.ndarray:
+    vecs = [query_cache.get(QueryCache.vector_key(q, MODEL_NAME)) for q in queries]
+    missing = [i for i, v in enumerate(vecs) if v is None]
+    if missing:
+        try:
+            embs = await query_batcher.submit([queries[i] for i in missing])
+        except Overloaded as e:
+            raise HTTPException(status_code=503, detail=f'overloaded: {e}', headers={'Retry-After': '1'})
+        for i, emb in zip(missing, embs):
+            vecs[i] = emb
+            query_cache.put(QueryCache.vector_key(queries[i], MODEL_NAME), emb)
+    return np.stack(vecs)
+
+
+async def _rerank(state: 'SearchState', queries: List[str], todo: List[int], results: List, k: int,
+                  budget_ms: float) -> int:
+    """Rerank results[i] for i in todo within one shared budget; returns how many candidates were cut."""
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+    cut = 0
+
+    def run(q, hits, left):
+        # read last_stats on the rerank thread, before the next request can overwrite it
+        return reranker.rerank(q, hits, state.meta, k, left), reranker.last_stats['skipped']
+
+    for i in todo:
+        left = budget_ms - (time.perf_counter() - t0) * 1000
+        # carry the request's trace span onto the rerank thread
+        ctx = contextvars.copy_context()
+        results[i], skipped = await loop.run_in_executor(rerank_executor, ctx.run, run, queries[i], results[i], left)
+        cut += skipped
+    return cut
+
+
+async def _search(queries: List[str], k: int, mode: str, response: Response, rerank: bool = False,
+                  rerank_depth: Optional[int] = None, budget_ms: Optional[float] = None,
+                  filter: Optional[str] = None) -> List[List[Dict]]:
+    state = current_state()
+    if not state.ready:
+        raise HTTPException(status_code=503, detail=f'search index not loaded: {state.error}')
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=422, detail=f'mode must be one of {SEARCH_MODES}')
+    try:
+        sel = state.select(filter)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f'filter: {e}')
+    k = max(1, min(k, MAX_K))
+    # the first stage returns `first` candidates: k, or the rerank depth when reranking
+    first = max(k, min(rerank_depth or k * 3, MAX_RERANK_DEPTH)) if rerank else k
+    # hybrid fuses twice as many candidates from each side, like hybrid_retriever.py
+    depth = first * 2 if mode == 'hybrid' else first
+    params = (mode, k, 'rerank', first) if rerank else (mode, k)
+    if sel is not None:
+        params += ('filter', sel.expr)
+    keys = [QueryCache.results_key(q, MODEL_NAME, state.version, *params) for q in queries]
+    results = [query_cache.get(key) for key in keys]
+    todo = [i for i, r in enumerate(results) if r is None]
+    ann = [None for _ in todo]
+    t0 = time.perf_counter()
+    if mode != 'lexical' and todo:
+        # queueing plus the shared encode; the batcher's own `encode` span covers the model call
+        with telemetry.span('query_vectors', items=len(todo)):
+            q_embs = await _query_vectors([queries[i] for i in todo])
+    t1 = time.perf_counter()
+    if mode != 'lexical' and todo:
+        ann = state.ann(q_embs, depth, None if sel is None else sel.rows)
+    for i, ann_hits in zip(todo, ann):
+        results[i] = state.first_stage(queries[i], first, mode, ann_hits, depth, sel)
+    t2 = time.perf_counter()
+    cut = 0
+    if rerank and todo:
+        cut = await _rerank(state, queries, todo, results, k, RERANK_BUDGET_MS if budget_ms is None else budget_ms)
+    t3 = time.perf_counter()
+    if not cut:
+        # a budget-truncated ranking is not the answer to this query; recompute it next time
+        for i in todo:
+            query_cache.put(keys[i], results[i])
+    timing = f'encode;dur={(t1 - t0) * 1000:.2f}, search;dur={(t2 - t1) * 1000:.2f}, '
+    if rerank:
+        timing += f'rerank;dur={(t3 - t2) * 1000:.2f};desc="{cut} over budget", '
+    response.headers['Server-Timing'] = timing + f'cache;desc="{len(queries) - len(todo)}/{len(queries)} hit"'
+    return [[{'id': idx, 'score': round(score, 6)} for idx, score in hits] for hits in results]
+
+
+@app.post('/search')
+async def search(req: SearchRequest, response: Response):
+    """Top-k metadata row indices for one query: {"results": [{"id", "score"}]}."""
+    return {'results': (await _search([req.query], req.k, req.mode, response, req.rerank, req.rerank_depth,
+                                      req.budget_ms, req.filter))[0]}
+
+
+@app.post('/search_batch')
+async def search_batch(req: BatchSearchRequest, response: Response):
+    """Several queries in one call (one encode, one index search): {"results": [[{"id", "score"}], ...]}."""
+    return {'results': await _search(req.queries, req.k, req.mode, response, req.rerank, req.rerank_depth,
+                                     req.budget_ms, req.filter)}
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    await batcher.stop()
+    await query_batcher.stop()
+    rerank_executor.shutdown(wait=False)
+    reload_executor.shutdown(wait=False)
 
 
 @app.post('/embed_batch')
-async def embed_batch(batch: List[Dict]):
+async def embed_batch(batch: List[Dict], request: Request, format: Optional[str] = None):
+    """JSON by default; binary float32/float16 frames or msgpack via Accept or ?format= (see wire.py)."""
     try:
-        ids = [str(b.get('id', '')) for b in batch]
-        texts = [b.get('content', '') for b in batch]
-        embs = model.encode(texts, show_progress_bar=False)
-        results = {ids[i]: embs[i].tolist() for i in range(len(ids))}
-        return {'results': results}
+        fmt = wire.negotiate(request.headers.get('accept'), format)
+    except ValueError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    ids = [str(b.get('id', '')) for b in batch]
+    texts = [b.get('content', '') or '' for b in batch]
+    if not texts and fmt == 'json':
+        return {'results': {}}
+    try:
+        embs = await batcher.submit(texts) if texts else np.zeros((0, 0), dtype=np.float32)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=f'overloaded: {e}', headers={'Retry-After': '1'})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if fmt != 'json':
+        try:
+            body, ctype = wire.encode_response(ids, embs, fmt)
+        except ImportError:
+            raise HTTPException(status_code=406, detail='msgpack is not installed on the server')
+        return Response(content=body, media_type=ctype)
+    results = {ids[i]: embs[i].tolist() for i in range(len(ids))}
+    return {'results': results}
 
 
 @app.get('/health')
 async def health():
-    return {'status': 'ok'}
+    return {'status': 'ok', 'batcher': batcher.stats(), 'query_batcher': query_batcher.stats(),
+            'search_index': search_state.searcher.kind if search_state.ready else search_state.error,
+            'rows': len(search_state.meta) if search_state.ready else 0,
+            'load_ms': {name: round(s * 1000, 1) for name, s in search_state.timings.items()}}
+
+
+@app.get('/stats')
+async def stats():
+    return {'query_cache': query_cache.stats(), 'index_version': search_state.version if search_state.ready else None,
+            'batcher': batcher.stats(), 'query_batcher': query_batcher.stats()}
+
+
+REQUEST_SECONDS = telemetry.histogram('kb_request_seconds', 'HTTP request latency by endpoint and status.',
+                                      ('endpoint', 'status'))
+
+
+@app.middleware('http')
+async def trace_requests(request: Request, call_next):
+    # one trace per request: the spans of _search, the lexical / merge stages and the rerank join it
+    with telemetry.span('request', endpoint=request.url.path) as sp:
+        t0 = time.perf_counter()
+        response = await call_next(request)
+        sp.set(status=response.status_code)
+    if telemetry.ENABLED and request.url.path != '/metrics':
+        REQUEST_SECONDS.observe(time.perf_counter() - t0, request.url.path, str(response.status_code))
+    return response
+
+
+@telemetry.collector
+def _service_samples():
+    """Scrape-time gauges and counters from the batchers, the query cache and the loaded index."""
+    for name, b in (('embed', batcher), ('query', query_batcher)):
+        st = b.stats()
+        labels = {'batcher': name}
+        yield 'kb_queue_depth', 'gauge', 'Requests waiting for an encode batch.', labels, st['queue_depth']
+        yield 'kb_batches_total', 'counter', 'Encode batches run.', labels, st['batches']
+        yield 'kb_batch_requests_total', 'counter', 'Requests merged into encode batches.', labels, st['requests']
+        yield 'kb_rejected_total', 'counter', 'Requests refused with 503 because the queue was full.', labels, st['rejected']
+    st = query_cache.stats()
+    yield 'kb_cache_entries', 'gauge', 'Entries in the query cache.', {}, st['entries']
+    yield 'kb_cache_bytes', 'gauge', 'Approximate bytes held by the query cache.', {}, st['bytes']
+    for kind in st['hits']:
+        yield 'kb_cache_hits_total', 'counter', 'Query cache hits by entry kind.', {'kind': kind}, st['hits'][kind]
+        yield 'kb_cache_misses_total', 'counter', 'Query cache misses by entry kind.', {'kind': kind}, st['misses'][kind]
+    yield 'kb_cache_evictions_total', 'counter', 'Query cache LRU evictions.', {}, st['evictions']
+    yield 'kb_cache_invalidations_total', 'counter', 'Cached results dropped after an index reload.', {}, st['invalidations']
+    yield 'kb_index_rows', 'gauge', 'Rows in the loaded search index.', {}, len(search_state.meta) if search_state.ready else 0
+
+
+@app.get('/metrics')
+async def metrics():
+    """Prometheus text exposition: stage / request histograms, batch sizes, queue depth, cache stats."""
+    return PlainTextResponse(telemetry.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/profile')
+async def profile():
+    """Folded stacks from the sampling profiler (flamegraph.pl / speedscope); needs PROFILE_HZ."""
+    if telemetry.profiler is None:
+        raise HTTPException(status_code=404, detail='sampling profiler is off; start the service with PROFILE_HZ=100')
+    return PlainTextResponse(telemetry.profiler.folded())
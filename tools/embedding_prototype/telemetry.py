@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Timing spans, Prometheus-style metrics, a JSON-lines trace file and an opt-in sampling
+profiler for the Python pipeline (compute_embeddings.py, retriever.py, service.py).
+
+    with telemetry.span('ann', queries=len(q)):
+        ...
+
+Each span adds its duration to the `kb_stage_seconds{stage=...}` histogram. With a trace
+file configured, it also appends one JSON line when it closes (`ts`, `trace`, `id`, `parent`,
+`stage`, `ms`, `items` and the keyword attributes), in the spirit of the Android worker's
+embedding_worker_metrics.log. Spans opened inside another span share its `trace` id
+(contextvars, so this holds across awaits), which ties one /search request's encode, ann,
+lexical, merge and rerank lines together. `render()` returns every metric in the Prometheus
+text format: service.py serves it on GET /metrics, and compute_embeddings.py --metrics-out
+writes it as a node_exporter textfile. Values read at scrape time (queue depth, cache stats)
+come from `collector()` callbacks, so they cost nothing between scrapes.
+
+Environment (read at import, so every script honors them):
+  PIPELINE_METRICS=0  spans become a shared no-op; nothing is timed or recorded
+  TRACE_FILE=path     append span lines to this JSON-lines file
+  PROFILE_HZ=N        sample every thread's Python stack N times a second; the folded stacks
+                      (flamegraph.pl / speedscope input) go to PROFILE_OUT at exit
+                      (default output/profile.folded)
+
+When a feature is off it costs nothing beyond one attribute check: no trace lines are written and
+no profiler thread is started. With metrics on and no trace file, a span costs about 2 us
+(`python telemetry.py --overhead`).
+
+Usage: python telemetry.py [--overhead] [--profile-seconds 5 --hz 100]
+"""
+import argparse
+import atexit
+import contextvars
+import itertools
+import json
+import math
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+OUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
+# seconds; spans range from sub-millisecond lexical lookups to multi-second encode windows
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+PROFILE_NAME = 'profile.folded'
+
+# (metric name, type, help, labels, value) rows yielded by collector callbacks
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(v) -> str:
+    return str(v).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _fmt_value(v: float) -> str:
+    if v == math.inf:
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination, as Prometheus expects."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        out = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for labels, s in sorted(series.items()):
+            acc = 0
+            for bound, n in zip(self.buckets + (math.inf,), s):
+                acc += n
+                le = 'le="' + _fmt_value(bound) + '"'
+                out.append(f'{self.name}_bucket{_fmt_labels(self.labels, labels, le)} {acc}')
+            out.append(f'{self.name}_sum{_fmt_labels(self.labels, labels)} {s[-2]!r}')
+            out.append(f'{self.name}_count{_fmt_labels(self.labels, labels)} {s[-1]}')
+        return out
+
+
+class CounterMetric:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self) -> List[str]:
+        out = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for labels, v in sorted(values.items()):
+            out.append(f'{self.name}{_fmt_labels(self.labels, labels)} {_fmt_value(v)}')
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, *args, **kw):
+        with self._lock:
+            m = self.metrics.get(name)
+            if m is None:
+                m = self.metrics[name] = cls(name, *args, **kw)
+            return m
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> CounterMetric:
+        return self._get(CounterMetric, name, help, labels)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+        for m in metrics:
+            lines += m.render()
+        grouped: Dict[str, List[Sample]] = {}
+        for fn in collectors:
+            try:
+                for sample in fn():
+                    grouped.setdefault(sample[0], []).append(sample)
+            except Exception as e:  # a broken collector must not take /metrics down
+                lines.append(f'# collector {getattr(fn, "__name__", fn)} failed: {_escape(e)}')
+        for name, samples in grouped.items():
+            lines += [f'# HELP {name} {samples[0][2]}', f'# TYPE {name} {samples[0][1]}']
+            for _, _, _, labels, value in samples:
+                lines.append(f'{name}{_fmt_labels(list(labels), list(labels.values()))} {_fmt_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+ENABLED = os.environ.get('PIPELINE_METRICS', '1') != '0'
+
+STAGE_SECONDS = REGISTRY.histogram('kb_stage_seconds', 'Wall time of one pipeline stage call.', ('stage',))
+STAGE_ITEMS = REGISTRY.counter('kb_stage_items_total', 'Items (texts, queries, rows) handled per stage.', ('stage',))
+
+
+def histogram(name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.histogram(name, help, labels, buckets)
+
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> CounterMetric:
+    return REGISTRY.counter(name, help, labels)
+
+
+def collector(fn: Callable[[], Iterable[Sample]]) -> Callable[[], Iterable[Sample]]:
+    """Register `fn` to be called on every render(); usable as a decorator."""
+    with REGISTRY._lock:
+        REGISTRY.collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+class TraceWriter:
+    """Appends one JSON object per span; line-buffered so a crash loses at most the current line."""
+
+    def __init__(self, path: str):
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        self.path = path
+        self._f = open(path, 'a', encoding='utf-8', buffering=1)
+        self._lock = threading.Lock()
+
+    def write(self, rec: Dict) -> None:
+        line = json.dumps(rec, ensure_ascii=False, default=str)
+        with self._lock:
+            self._f.write(line + '\n')
+
+    def close(self) -> None:
+        with self._lock:
+            self._f.close()
+
+
+_tracer: Optional[TraceWriter] = None
+_span_ids = itertools.count(1)
+# span ids restart with every process; trace ids carry this prefix so runs appending to one file stay apart
+_RUN = f'{os.getpid():x}{int(time.time()) & 0xFFFFFF:06x}'
+# (trace id, parent span id) of the innermost open span in this thread / task
+_current: contextvars.ContextVar = contextvars.ContextVar('kb_span', default=None)
+
+
+def record(stage: str, secs: float, items: Optional[int] = None, start: Optional[float] = None,
+           trace: bool = True, **attrs) -> None:
+    """Account for a stage whose duration was measured elsewhere (e.g. in a worker process).
+
+    `trace=False` feeds only the metrics, for per-item calls that would flood the trace file.
+    """
+    if ENABLED:
+        STAGE_SECONDS.observe(secs, stage)
+        if items is not None:
+            STAGE_ITEMS.inc(items, stage)
+    if trace and _tracer is not None:
+        cur = _current.get()
+        sid = next(_span_ids)
+        _write(stage, secs, items, start, sid, cur[0] if cur else f'{_RUN}.{sid}', cur[1] if cur else None, attrs)
+
+
+def _write(stage, secs, items, start, sid, trace, parent, attrs) -> None:
+    rec = {'ts': round(start if start is not None else time.time() - secs, 6), 'trace': trace, 'id': sid,
+           'parent': parent, 'stage': stage, 'ms': round(secs * 1000, 3)}
+    if items is not None:
+        rec['items'] = items
+    rec.update(attrs)
+    tracer = _tracer
+    if tracer is not None:
+        tracer.write(rec)
+
+
+class _Span:
+    __slots__ = ('stage', 'items', 'attrs', 't0', 'wall', 'sid', 'trace', 'parent', 'token')
+
+    def __init__(self, stage: str, items: Optional[int], attrs: Dict):
+        self.stage = stage
+        self.items = items
+        self.attrs = attrs
+
+    def __enter__(self) -> '_Span':
+        if _tracer is not None:
+            cur = _current.get()
+            self.sid = next(_span_ids)
+            self.trace, self.parent = (cur[0], cur[1]) if cur else (f'{_RUN}.{self.sid}', None)
+            self.token = _current.set((self.trace, self.sid))
+            self.wall = time.time()
+        else:
+            self.token = None
+        self.t0 = time.perf_counter()
+        return self
+
+    def set(self, **attrs) -> None:
+        """Attach attributes known only once the work ran (hit counts, rows scanned)."""
+        if 'items' in attrs:
+            self.items = attrs.pop('items')
+        self.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        secs = time.perf_counter() - self.t0
+        if ENABLED:
+            STAGE_SECONDS.observe(secs, self.stage)
+            if self.items is not None:
+                STAGE_ITEMS.inc(self.items, self.stage)
+        if self.token is not None:
+            _current.reset(self.token)
+            if exc_type is not None:
+                self.attrs['error'] = exc_type.__name__
+            _write(self.stage, secs, self.items, self.wall, self.sid, self.trace, self.parent, self.attrs)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage: str, items: Optional[int] = None, **attrs):
+    """Context manager timing one `stage`; a shared no-op when metrics and tracing are both off."""
+    if not ENABLED and _tracer is None:
+        return _NOOP
+    return _Span(stage, items, attrs)
+
+
+class SamplingProfiler:
+    """Samples every other thread's Python stack `hz` times a second from a daemon thread.
+
+    Stacks are kept as folded strings ('thread;file:func;file:func') with sample counts, the
+    input format of flamegraph.pl and speedscope. Sampling happens from the outside via
+    sys._current_frames(), so the profiled code runs unmodified; the cost is one stack walk
+    per thread per tick (about 1% of a core at 100 Hz with a handful of threads).
+    """
+
+    def __init__(self, hz: float = 100.0, path: Optional[str] = None):
+        self.interval = 1.0 / max(hz, 1e-3)
+        self.path = path
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> 'SamplingProfiler':
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self.path:
+            self.dump(self.path)
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def folded(self) -> str:
+        with self._lock:
+            return ''.join(f'{stack} {n}\n' for stack, n in self.stacks.most_common())
+
+    def dump(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.folded())
+
+
+profiler: Optional[SamplingProfiler] = None
+
+
+def configure(trace_path: Optional[str] = None, profile_hz: Optional[float] = None,
+              profile_path: Optional[str] = None) -> None:
+    """Open the trace file and/or start the sampling profiler (flushed at exit); None leaves a feature as is."""
+    global _tracer, profiler
+    if trace_path and (_tracer is None or _tracer.path != trace_path):
+        old, _tracer = _tracer, TraceWriter(trace_path)
+        if old is not None:
+            old.close()
+    if profile_hz and profiler is None:
+        profiler = SamplingProfiler(profile_hz, profile_path or os.path.join(OUT_DIR, PROFILE_NAME)).start()
+        atexit.register(profiler.stop)
+
+
+@collector
+def _profiler_samples() -> Iterable[Sample]:
+    if profiler is not None:
+        yield 'kb_profiler_samples_total', 'counter', 'Stack samples taken by the sampling profiler.', {}, profiler.samples
+
+
+configure(os.environ.get('TRACE_FILE') or None, float(os.environ.get('PROFILE_HZ') or 0) or None,
+          os.environ.get('PROFILE_OUT') or None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--overhead', action='store_true', help='time span() with metrics on and off')
+    parser.add_argument('--n', type=int, default=200000)
+    parser.add_argument('--profile-seconds', type=float, default=0, help='profile a busy loop and print folded stacks')
+    parser.add_argument('--hz', type=float, default=100)
+    args = parser.parse_args()
+    global ENABLED
+    if args.overhead:
+        for label, enabled in (('metrics off', False), ('metrics on', True)):
+            ENABLED = enabled
+            t0 = time.perf_counter()
+            for _ in range(args.n):
+                with span('noop'):
+                    pass
+            print(f'{label:<12} {(time.perf_counter() - t0) / args.n * 1e6:.3f} us per span')
+        t0 = time.perf_counter()
+        for _ in range(args.n):
+            pass
+        print(f'{"empty loop":<12} {(time.perf_counter() - t0) / args.n * 1e6:.3f} us per iteration')
+    if args.profile_seconds:
+        prof = SamplingProfiler(args.hz).start()
+        end = time.perf_counter() + args.profile_seconds
+        while time.perf_counter() < end:
+            sum(i * i for i in range(1000))
+        prof.stop()
+        print(f'{prof.samples} samples')
+        print(prof.folded()[:2000])
+    if not args.overhead and not args.profile_seconds:
+        print(render(), end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Sharded, append-only embedding store (replaces one `<id>.emb` + `<id>.json` per item).
+
+Layout of a store directory:
+  store.json               {"dim", "shard_rows", "generation"}; replaced atomically
+  g<gen>-<shard>.f32       fixed-stride float32 rows (little-endian), at most shard_rows each
+  g<gen>-index.jsonl       append-only {"id", "s", "r"}: id -> (shard, row); later lines win
+  g<gen>-tombstones.jsonl  append-only {"id", "s", "r"}: deletes of that exact location
+
+Appends write and fsync the vectors first and the index lines second, so an index line is
+the commit point. On open, rows past the last committed one (a crashed append) and a torn
+final log line are truncated away. compact() rewrites the live rows under generation+1,
+swaps store.json and only then removes the old generation.
+
+Readers get numpy.memmap views: `matrix()` is zero-copy whenever the live rows are one
+contiguous shard (always true right after compact() for stores under shard_rows).
+
+Usage:
+  python vector_store.py import local_app_files/embeddings [--store DIR]
+  python vector_store.py stats|compact [--store DIR]
+"""
+import argparse
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_STORE = os.path.join(os.path.dirname(__file__), 'local_app_files', 'embeddings', 'store')
+DEFAULT_SHARD_ROWS = 1 << 18
+STORE_NAME = 'store.json'
+_FILE_RE = re.compile(r'^g(\d+)-')
+
+Location = Tuple[int, int]
+
+
+def _fsync_append(path: str, data: bytes) -> None:
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_log(path: str) -> List[Dict]:
+    """Parse a JSON-lines log, dropping (and truncating) a torn final line."""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    if end != len(data):
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+    return [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+
+
+class VectorStore:
+    def __init__(self, path: str = DEFAULT_STORE, dim: Optional[int] = None, shard_rows: int = DEFAULT_SHARD_ROWS):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        info = self._read_info()
+        if info is None:
+            info = {'dim': dim, 'shard_rows': shard_rows, 'generation': 0}
+            self._write_info(info)
+        elif dim is not None and info.get('dim') not in (None, dim):
+            raise ValueError(f"store {path} holds dim {info['dim']}, not {dim}")
+        self.dim: Optional[int] = info.get('dim')
+        self.shard_rows = int(info['shard_rows'])
+        self.generation = int(info['generation'])
+        self._loc: Dict[str, Location] = {}
+        self._rows: List[int] = []  # committed rows per shard
+        self._maps: Dict[int, np.memmap] = {}
+        self._recover()
+
+    # -- files -------------------------------------------------------------------------
+    def _read_info(self) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.path, STORE_NAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_info(self, info: Dict) -> None:
+        tmp = os.path.join(self.path, STORE_NAME + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, STORE_NAME))
+
+    def _info(self) -> Dict:
+        return {'dim': self.dim, 'shard_rows': self.shard_rows, 'generation': self.generation}
+
+    def _file(self, name: str, gen: Optional[int] = None) -> str:
+        return os.path.join(self.path, f'g{self.generation if gen is None else gen}-{name}')
+
+    def _shard_path(self, shard: int, gen: Optional[int] = None) -> str:
+        return self._file(f'{shard:05d}.f32', gen)
+
+    @property
+    def _stride(self) -> int:
+        return (self.dim or 0) * 4
+
+    def _recover(self) -> None:
+        # leftovers of an interrupted compaction (or an old generation) are not referenced
+        for name in os.listdir(self.path):
+            m = _FILE_RE.match(name)
+            if m and int(m.group(1)) != self.generation:
+                os.remove(os.path.join(self.path, name))
+        for rec in _read_log(self._file('index.jsonl')):
+            loc = (rec['s'], rec['r'])
+            self._loc[rec['id']] = loc
+            while len(self._rows) <= loc[0]:
+                self._rows.append(0)
+            self._rows[loc[0]] = max(self._rows[loc[0]], loc[1] + 1)
+        for rec in _read_log(self._file('tombstones.jsonl')):
+            if self._loc.get(rec['id']) == (rec['s'], rec['r']):
+                del self._loc[rec['id']]
+        shard = 0
+        while os.path.exists(self._shard_path(shard)):
+            committed = self._rows[shard] * self._stride if shard < len(self._rows) else 0
+            if os.path.getsize(self._shard_path(shard)) != committed:
+                # vectors written by an append whose index lines never landed
+                with open(self._shard_path(shard), 'r+b') as f:
+                    f.truncate(committed)
+            shard += 1
+
+    # -- queries -----------------------------------------------------------------------
+    def __len__(self) -> int:
+        return len(self._loc)
+
+    def __contains__(self, id_: str) -> bool:
+        return str(id_) in self._loc
+
+    @property
+    def total_rows(self) -> int:
+        """Rows on disk including superseded/deleted ones (reclaimed by compact())."""
+        return sum(self._rows)
+
+    def shard(self, shard: int) -> np.ndarray:
+        """Read-only memmap of one shard's committed rows."""
+        rows = self._rows[shard]
+        m = self._maps.get(shard)
+        if m is None or m.shape[0] != rows:
+            m = np.memmap(self._shard_path(shard), dtype='<f4', mode='r', shape=(rows, self.dim)) if rows else \
+                np.zeros((0, self.dim or 0), dtype='<f4')
+            self._maps[shard] = m
+        return m
+
+    def get(self, id_: str) -> Optional[np.ndarray]:
+        loc = self._loc.get(str(id_))
+        return None if loc is None else self.shard(loc[0])[loc[1]]
+
+    def ids(self) -> List[str]:
+        """Live ids in storage order (the row order of matrix())."""
+        return [id_ for id_, _ in sorted(self._loc.items(), key=lambda kv: kv[1])]
+
+    def matrix(self) -> Tuple[List[str], np.ndarray]:
+        """(ids, [n, dim] float32) of the live rows; a zero-copy memmap when they are one contiguous shard."""
+        ids = self.ids()
+        if not ids:
+            return [], np.zeros((0, self.dim or 0), dtype='<f4')
+        locs = [self._loc[i] for i in ids]
+        if len(self._rows) == 1 and len(ids) == self._rows[0]:
+            return ids, self.shard(0)
+        by_shard: Dict[int, List[int]] = {}
+        for s, r in locs:
+            by_shard.setdefault(s, []).append(r)
+        return ids, np.concatenate([self.shard(s)[rows] for s, rows in sorted(by_shard.items())])
+
+    # -- writes ------------------------------------------------------------------------
+    def append(self, ids: Sequence[str], vecs) -> None:
+        """Add (or replace) vectors; durable and visible once this returns."""
+        vecs = np.ascontiguousarray(vecs, dtype='<f4')
+        if vecs.ndim == 1:
+            vecs = vecs[None, :]
+        if vecs.shape[0] != len(ids):
+            raise ValueError(f'{len(ids)} ids for {vecs.shape[0]} vectors')
+        if not len(ids):
+            return
+        if self.dim is None:
+            self.dim = int(vecs.shape[1])
+            self._write_info(self._info())
+        elif vecs.shape[1] != self.dim:
+            raise ValueError(f'dim mismatch: {vecs.shape[1]} != {self.dim}')
+        if not self._rows:
+            self._rows.append(0)
+        lines, pos = [], 0
+        pending = list(self._rows)
+        sizes: Dict[str, int] = {}  # pre-append size of every file this call writes to
+
+        def append_to(path: str, data: bytes) -> None:
+            if path not in sizes:
+                sizes[path] = os.path.getsize(path) if os.path.exists(path) else 0
+            _fsync_append(path, data)
+
+        try:
+            while pos < len(ids):
+                shard = len(pending) - 1
+                if pending[shard] >= self.shard_rows:
+                    pending.append(0)
+                    continue
+                take = min(len(ids) - pos, self.shard_rows - pending[shard])
+                append_to(self._shard_path(shard), vecs[pos:pos + take].tobytes())
+                for j in range(take):
+                    lines.append({'id': str(ids[pos + j]), 's': shard, 'r': pending[shard] + j})
+                pending[shard] += take
+                pos += take
+            # commit point: the vectors are on disk before any index line references them
+            append_to(self._file('index.jsonl'),
+                      ''.join(json.dumps(rec, ensure_ascii=False) + '\n' for rec in lines).encode('utf-8'))
+        except BaseException:
+            # undo partial writes, or the next append's row numbers would not match the shard bytes
+            for path, size in sizes.items():
+                if not os.path.exists(path):
+                    continue
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+            raise
+        self._rows = pending
+        for rec in lines:
+            self._loc[rec['id']] = (rec['s'], rec['r'])
+
+    def delete(self, ids: Iterable[str]) -> int:
+        recs = []
+        for id_ in ids:
+            loc = self._loc.pop(str(id_), None)
+            if loc is not None:
+                recs.append({'id': str(id_), 's': loc[0], 'r': loc[1]})
+        if recs:
+            _fsync_append(self._file('tombstones.jsonl'),
+                          ''.join(json.dumps(rec, ensure_ascii=False) + '\n' for rec in recs).encode('utf-8'))
+        return len(recs)
+
+    def compact(self) -> Dict:
+        """Rewrite live rows contiguously under a new generation and drop the old files."""
+        before = self.total_rows
+        ids = self.ids()
+        old_gen, new_gen = self.generation, self.generation + 1
+        lines, rows = [], []
+        for start in range(0, len(ids), self.shard_rows):
+            chunk = ids[start:start + self.shard_rows]
+            shard = len(rows)
+            with open(self._shard_path(shard, new_gen), 'wb') as f:
+                for block in range(0, len(chunk), 4096):
+                    part = chunk[block:block + 4096]
+                    f.write(np.stack([self.get(i) for i in part]).astype('<f4', copy=False).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            lines.extend({'id': id_, 's': shard, 'r': r} for r, id_ in enumerate(chunk))
+            rows.append(len(chunk))
+        with open(self._file('index.jsonl', new_gen), 'wb') as f:
+            f.write(''.join(json.dumps(rec, ensure_ascii=False) + '\n' for rec in lines).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        self._maps.clear()
+        self.generation = new_gen
+        # the swap: from here on readers opening the store see only the new generation
+        self._write_info(self._info())
+        for name in os.listdir(self.path):
+            if name.startswith(f'g{old_gen}-'):
+                os.remove(os.path.join(self.path, name))
+        self._rows = rows
+        self._loc = {rec['id']: (rec['s'], rec['r']) for rec in lines}
+        return {'rows_before': before, 'rows_after': self.total_rows, 'live': len(self)}
+
+    def stats(self) -> Dict:
+        return {'path': self.path, 'dim': self.dim, 'generation': self.generation, 'live': len(self),
+                'rows_on_disk': self.total_rows, 'shards': len(self._rows), 'shard_rows': self.shard_rows,
+                'bytes': self.total_rows * self._stride}
+
+
+def import_emb_dir(src: str, store: VectorStore, batch: int = 1024) -> int:
+    """Append every `<id>.emb` (raw float32) in `src` to the store; returns the number imported."""
+    names = sorted(n for n in os.listdir(src) if n.endswith('.emb'))
+    imported = 0
+    for start in range(0, len(names), batch):
+        ids, rows = [], []
+        for name in names[start:start + batch]:
+            vec = np.fromfile(os.path.join(src, name), dtype='<f4')
+            if store.dim is not None and vec.shape[0] != store.dim:
+                print(f'skipping {name}: {vec.shape[0]} floats, store dim is {store.dim}')
+                continue
+            if store.dim is None and rows and vec.shape[0] != rows[0].shape[0]:
+                print(f'skipping {name}: {vec.shape[0]} floats, expected {rows[0].shape[0]}')
+                continue
+            ids.append(name[:-len('.emb')])
+            rows.append(vec)
+        if rows:
+            store.append(ids, np.stack(rows))
+            imported += len(ids)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=('import', 'stats', 'compact'))
+    parser.add_argument('src', nargs='?', help='directory of <id>.emb files (import)')
+    parser.add_argument('--store', default=DEFAULT_STORE)
+    args = parser.parse_args()
+    store = VectorStore(args.store)
+    if args.command == 'import':
+        if not args.src:
+            parser.error('import needs the .emb directory')
+        print(f'imported {import_emb_dir(args.src, store)} vectors')
+    elif args.command == 'compact':
+        print(store.compact())
+    print(store.stats())
+
+
+if __name__ == '__main__':
+    main()
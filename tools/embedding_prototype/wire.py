@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Binary response formats for /embed_batch and embed_batch_cli.py.
+
+The JSON response (`{"results": {id: [floats]}}`) costs ~8-10x the float32 payload and a
+float->text->float round trip on both ends. Clients can instead ask for:
+
+  application/x-embeddings-f32   frame below, rows as little-endian float32
+  application/x-embeddings-f16   frame below, rows as little-endian float16 (half the bytes)
+  application/msgpack            {"dim", "dtype", "results": {id: <row bytes>}} (needs `msgpack`)
+
+Frame layout (all integers little-endian):
+  magic   4s   b'EMBF'
+  version u8   1
+  dtype   u8   1 = float32, 2 = float16
+  _       u16  reserved (0)
+  count   u32  number of rows
+  dim     u32  floats per row
+  table   count x (id_len u16, id utf-8, offset u64, nbytes u32)
+  pad     zeros up to a multiple of 8 bytes from the frame start
+  payload count x dim values; each row's bytes are payload[offset:offset + nbytes]
+
+A float32 row slice is byte-compatible with the Android worker's `<id>.emb`; it can be used
+(or saved) without parsing.
+"""
+import struct
+from typing import Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+MAGIC = b'EMBF'
+VERSION = 1
+JSON_TYPE = 'application/json'
+F32_TYPE = 'application/x-embeddings-f32'
+F16_TYPE = 'application/x-embeddings-f16'
+MSGPACK_TYPE = 'application/msgpack'
+FORMATS = {'json': JSON_TYPE, 'f32': F32_TYPE, 'f16': F16_TYPE, 'msgpack': MSGPACK_TYPE}
+
+_DTYPES = {1: np.dtype('<f4'), 2: np.dtype('<f2')}
+_CODES = {'f32': 1, 'f16': 2}
+_HEAD = struct.Struct('<4sBBHII')
+_ENTRY = struct.Struct('<QI')
+
+
+def negotiate(accept: str, fmt: str = None) -> str:
+    """Pick a format name from an explicit `?format=` value or the Accept header (JSON by default).
+
+    Among the supported types in Accept, the one with the highest q-value wins (earliest on ties).
+    """
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f'unknown format {fmt!r}; expected one of {sorted(FORMATS)}')
+        return fmt
+    best, best_q = 'json', 0.0
+    names = {ctype: name for name, ctype in FORMATS.items()}
+    for part in (accept or '').split(','):
+        mime, *params = [p.strip() for p in part.split(';')]
+        name = names.get(mime.lower())
+        if name is None:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        # highest q wins, ties go to the earlier entry; q=0 means "not acceptable"
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def encode_frame(ids: Sequence[str], embs: np.ndarray, fmt: str = 'f32') -> bytes:
+    code = _CODES[fmt]
+    rows = np.ascontiguousarray(embs, dtype=_DTYPES[code])
+    dim = rows.shape[1] if rows.ndim == 2 else 0
+    row_bytes = dim * rows.itemsize
+    parts = [_HEAD.pack(MAGIC, VERSION, code, 0, len(ids), dim)]
+    for i, id_ in enumerate(ids):
+        raw = str(id_).encode('utf-8')
+        parts.append(struct.pack('<H', len(raw)) + raw + _ENTRY.pack(i * row_bytes, row_bytes))
+    head_len = sum(len(p) for p in parts)
+    # 8-byte aligned payload so np.frombuffer views it without copying
+    parts.append(b'\0' * (-head_len % 8))
+    parts.append(rows.tobytes())
+    return b''.join(parts)
+
+
+def iter_frame(buf) -> Iterator[Tuple[str, memoryview]]:
+    """Yield (id, row bytes) from a frame; the memoryviews reference `buf` (no copy)."""
+    view = memoryview(buf)
+    magic, version, code, _, count, dim = _HEAD.unpack_from(view, 0)
+    if magic != MAGIC or version != VERSION or code not in _DTYPES:
+        raise ValueError('not an embeddings frame')
+    pos = _HEAD.size
+    table: List[Tuple[str, int, int]] = []
+    for _ in range(count):
+        (n,) = struct.unpack_from('<H', view, pos)
+        id_ = bytes(view[pos + 2:pos + 2 + n]).decode('utf-8')
+        offset, nbytes = _ENTRY.unpack_from(view, pos + 2 + n)
+        table.append((id_, offset, nbytes))
+        pos += 2 + n + _ENTRY.size
+    payload = view[pos + (-pos % 8):]
+    for id_, offset, nbytes in table:
+        yield id_, payload[offset:offset + nbytes]
+
+
+def frame_dtype(buf) -> np.dtype:
+    return _DTYPES[_HEAD.unpack_from(buf, 0)[2]]
+
+
+def decode_frame(buf) -> Tuple[List[str], np.ndarray]:
+    """(ids, [count, dim] array in the frame's dtype)."""
+    dtype = frame_dtype(buf)
+    ids, rows = [], []
+    for id_, row in iter_frame(buf):
+        ids.append(id_)
+        rows.append(np.frombuffer(row, dtype=dtype))
+    dim = _HEAD.unpack_from(buf, 0)[5]
+    return ids, (np.stack(rows) if rows else np.zeros((0, dim), dtype=dtype))
+
+
+def encode_msgpack(ids: Sequence[str], embs: np.ndarray) -> bytes:
+    import msgpack
+    rows = np.ascontiguousarray(embs, dtype='<f4')
+    return msgpack.packb({'dim': int(rows.shape[1]) if rows.ndim == 2 else 0, 'dtype': '<f4',
+                          'results': {str(id_): rows[i].tobytes() for i, id_ in enumerate(ids)}})
+
+
+def encode_response(ids: Sequence[str], embs: np.ndarray, fmt: str) -> Tuple[bytes, str]:
+    """Serialize a binary response for `fmt` ('f32', 'f16' or 'msgpack'); returns (body, content type)."""
+    if fmt == 'msgpack':
+        return encode_msgpack(ids, embs), MSGPACK_TYPE
+    return encode_frame(ids, embs, fmt), FORMATS[fmt]